@@ -0,0 +1,57 @@
+import argparse
+import timeit
+
+import numpy as np
+import torch
+
+from horch.boxes import box_iou, encode, decode
+
+
+def random_boxes(n, size=512):
+    lt = np.random.uniform(0, size * 0.8, size=(n, 2))
+    wh = np.random.uniform(1, size * 0.2, size=(n, 2))
+    return np.concatenate([lt, lt + wh], axis=1).astype(np.float32)
+
+
+def bench(name, f, number):
+    t = min(timeit.repeat(f, number=number, repeat=3)) / number
+    print("%-40s %10.3f ms" % (name, t * 1000))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks of horch.boxes")
+    parser.add_argument('-n', type=int, default=20000, help="number of anchors")
+    parser.add_argument('-m', type=int, default=50, help="number of ground truth boxes")
+    parser.add_argument('-b', type=int, default=8, help="batch size")
+    parser.add_argument('--number', type=int, default=10)
+    args = parser.parse_args()
+    n, m, b = args.n, args.m, args.b
+
+    anchors = random_boxes(n)
+    gts = np.stack([random_boxes(m) for _ in range(b)])
+    devices = ['cpu'] + (['cuda'] if torch.cuda.is_available() else [])
+
+    for mode in ['iou', 'giou', 'diou', 'ciou']:
+        bench("numpy %s (%d, %d)" % (mode, n, m), lambda: box_iou(anchors, gts[0], mode), args.number)
+        for device in devices:
+            a = torch.from_numpy(anchors).to(device)
+            g = torch.from_numpy(gts).to(device)
+
+            def f():
+                box_iou(a, g, mode)
+                if device == 'cuda':
+                    torch.cuda.synchronize()
+            bench("torch %s %s (%d, %d, %d)" % (device, mode, b, n, m), f, args.number)
+
+    a = torch.from_numpy(anchors)
+    bench("torch cpu iou chunked (%d, %d, %d)" % (b, n, m),
+          lambda: box_iou(a, torch.from_numpy(gts), max_elements=1 << 18), args.number)
+
+    targets = np.repeat(gts[0], n // m + 1, axis=0)[:n]
+    bench("numpy encode/decode (%d)" % n, lambda: decode(encode(targets, anchors), anchors), args.number)
+    t, a = torch.from_numpy(targets), torch.from_numpy(anchors)
+    bench("torch cpu encode/decode (%d)" % n, lambda: decode(encode(t, a), a), args.number)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+import argparse
+import time
+
+import torch
+import torch.nn as nn
+
+from horch.train.metrics import TrainLoss
+from horch.train.metrics.classification import TopKAccuracy
+
+
+def bench(name, model, optimizer, x, y, metrics, sync, steps):
+    criterion = nn.CrossEntropyLoss()
+
+    def step():
+        optimizer.zero_grad()
+        y_pred = model(x)
+        loss = criterion(y_pred, y)
+        loss.backward()
+        optimizer.step()
+        output = {"loss": loss.detach(), "y_pred": y_pred.detach(), "y_true": y, "batch_size": x.size(0)}
+        for m in metrics:
+            o = m.output_transform(output)
+            if sync:
+                # Metrics before accumulation on device, with a sync per value
+                o = (o[0].item(), o[1])
+            m.update(o)
+
+    for m in metrics:
+        m.reset()
+    for _ in range(10):
+        step()
+    if x.is_cuda:
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(steps):
+        step()
+    values = [m.compute() for m in metrics]
+    elapsed = time.perf_counter() - start
+    print("%-40s %10.1f steps/s  %s" % (name, steps / elapsed, ["%.4f" % v for v in values]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Steps per second with metrics synced every batch or on compute")
+    parser.add_argument('-b', type=int, default=128, help="batch size")
+    parser.add_argument('-c', type=int, default=100, help="number of classes")
+    parser.add_argument('--width', type=int, default=1024)
+    parser.add_argument('--steps', type=int, default=200)
+    args = parser.parse_args()
+
+    devices = ['cpu'] + (['cuda'] if torch.cuda.is_available() else [])
+    for device in devices:
+        model = nn.Sequential(
+            nn.Linear(args.width, args.width), nn.ReLU(),
+            nn.Linear(args.width, args.width), nn.ReLU(),
+            nn.Linear(args.width, args.c),
+        ).to(device)
+        optimizer = torch.optim.SGD(model.parameters(), lr=0.01)
+        x = torch.randn(args.b, args.width, device=device)
+        y = torch.randint(args.c, (args.b,), device=device)
+        for sync in [True, False]:
+            metrics = [TrainLoss(), TopKAccuracy(k=5)]
+            name = "%s %s" % (device, "item() per batch" if sync else "on device")
+            bench(name, model, optimizer, x, y, metrics, sync, args.steps)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+import argparse
+import timeit
+
+import torch
+
+from horch.models.detection.anchor import AnchorGenerator
+from horch.models.detection.postprocess import postprocess
+
+
+def bench(name, f, number):
+    t = min(timeit.repeat(f, number=number, repeat=3)) / number
+    print("%-40s %10.3f ms" % (name, t * 1000))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks of detection post-processing")
+    parser.add_argument('-b', type=int, default=8, help="batch size")
+    parser.add_argument('-s', type=int, default=512, help="image size")
+    parser.add_argument('-c', type=int, default=80, help="number of classes")
+    parser.add_argument('--number', type=int, default=10)
+    args = parser.parse_args()
+
+    strides = (8, 16, 32, 64, 128)
+    gen = AnchorGenerator(strides)
+    sizes = [(args.s // s, args.s // s) for s in strides]
+    devices = ['cpu'] + (['cuda'] if torch.cuda.is_available() else [])
+    for device in devices:
+        anchors = gen(sizes, device)
+        loc_preds = [torch.randn(args.b, w, h, 9, 4, device=device) * 0.1 for w, h in sizes]
+        cls_preds = [torch.randn(args.b, w, h, 9, args.c, device=device) - 4 for w, h in sizes]
+        for method in ['nms', 'matrix', 'soft']:
+            def f():
+                postprocess(loc_preds, cls_preds, anchors, args.c, method=method, image_size=(args.s, args.s))
+                if device == 'cuda':
+                    torch.cuda.synchronize()
+            number = 1 if method == 'soft' else args.number
+            bench("%s %s (b=%d, s=%d)" % (device, method, args.b, args.s), f, number)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,221 @@
+r"""
+Operations on bounding boxes, for both ``np.ndarray`` and ``torch.Tensor``.
+
+Boxes are arrays of shape (..., 4) in one of the formats
+
+- ``ltrb``: [left, top, right, bottom]
+- ``ltwh``: [left, top, width, height], as in COCO annotations
+- ``xywh``: [center x, center y, width, height]
+
+and all functions but the conversions take ``ltrb`` boxes.
+"""
+import math
+
+import numpy as np
+import torch
+
+__all__ = [
+    "ltrb_to_ltwh", "ltwh_to_ltrb", "ltrb_to_xywh", "xywh_to_ltrb", "convert",
+    "box_area", "clip", "box_iou", "aligned_box_iou", "encode", "decode",
+]
+
+_EPS = 1e-7
+
+
+def _stack(xs):
+    if torch.is_tensor(xs[0]):
+        return torch.stack(xs, dim=-1)
+    return np.stack(xs, axis=-1)
+
+
+def _cat(xs, axis):
+    if torch.is_tensor(xs[0]):
+        return torch.cat(xs, dim=axis)
+    return np.concatenate(xs, axis=axis)
+
+
+def _maximum(a, b):
+    if torch.is_tensor(a):
+        return torch.max(a, b)
+    return np.maximum(a, b)
+
+
+def _minimum(a, b):
+    if torch.is_tensor(a):
+        return torch.min(a, b)
+    return np.minimum(a, b)
+
+
+def _clamp(x, min=None, max=None):
+    if torch.is_tensor(x):
+        return x.clamp(min=min, max=max)
+    return np.clip(x, min, max)
+
+
+def _as_like(x, like):
+    if torch.is_tensor(like):
+        return like.new_tensor(x)
+    return np.asarray(x, dtype=like.dtype)
+
+
+def _log(x):
+    return torch.log(x) if torch.is_tensor(x) else np.log(x)
+
+
+def _exp(x):
+    return torch.exp(x) if torch.is_tensor(x) else np.exp(x)
+
+
+def _atan(x):
+    return torch.atan(x) if torch.is_tensor(x) else np.arctan(x)
+
+
+def ltrb_to_ltwh(boxes):
+    l, t, r, b = boxes[..., 0], boxes[..., 1], boxes[..., 2], boxes[..., 3]
+    return _stack([l, t, r - l, b - t])
+
+
+def ltwh_to_ltrb(boxes):
+    l, t, w, h = boxes[..., 0], boxes[..., 1], boxes[..., 2], boxes[..., 3]
+    return _stack([l, t, l + w, t + h])
+
+
+def ltrb_to_xywh(boxes):
+    l, t, r, b = boxes[..., 0], boxes[..., 1], boxes[..., 2], boxes[..., 3]
+    return _stack([(l + r) / 2, (t + b) / 2, r - l, b - t])
+
+
+def xywh_to_ltrb(boxes):
+    x, y, w, h = boxes[..., 0], boxes[..., 1], boxes[..., 2], boxes[..., 3]
+    return _stack([x - w / 2, y - h / 2, x + w / 2, y + h / 2])
+
+
+def convert(boxes, src, dst):
+    r"""
+    Convert boxes from format `src` to `dst`, both of ``ltrb``, ``ltwh`` or ``xywh``.
+    """
+    if src == dst:
+        return boxes
+    if src == 'ltwh':
+        boxes = ltwh_to_ltrb(boxes)
+    elif src == 'xywh':
+        boxes = xywh_to_ltrb(boxes)
+    elif src != 'ltrb':
+        raise ValueError("Not supported format: %s" % src)
+    if dst == 'ltwh':
+        return ltrb_to_ltwh(boxes)
+    elif dst == 'xywh':
+        return ltrb_to_xywh(boxes)
+    elif dst != 'ltrb':
+        raise ValueError("Not supported format: %s" % dst)
+    return boxes
+
+
+def box_area(boxes):
+    return (boxes[..., 2] - boxes[..., 0]) * (boxes[..., 3] - boxes[..., 1])
+
+
+def clip(boxes, size):
+    r"""
+    Clip boxes to an image of `size` (w, h).
+    """
+    w, h = size
+    return _stack([
+        _clamp(boxes[..., 0], 0, w), _clamp(boxes[..., 1], 0, h),
+        _clamp(boxes[..., 2], 0, w), _clamp(boxes[..., 3], 0, h),
+    ])
+
+
+def _iou(boxes1, boxes2, mode):
+    # Broadcasts boxes1 and boxes2
+    l1, t1, r1, b1 = boxes1[..., 0], boxes1[..., 1], boxes1[..., 2], boxes1[..., 3]
+    l2, t2, r2, b2 = boxes2[..., 0], boxes2[..., 1], boxes2[..., 2], boxes2[..., 3]
+    w1, h1 = r1 - l1, b1 - t1
+    w2, h2 = r2 - l2, b2 - t2
+    inter = _clamp(_minimum(r1, r2) - _maximum(l1, l2), min=0) * \
+        _clamp(_minimum(b1, b2) - _maximum(t1, t2), min=0)
+    union = w1 * h1 + w2 * h2 - inter
+    iou = inter / _clamp(union, min=_EPS)
+    if mode == 'iou':
+        return iou
+
+    cw = _maximum(r1, r2) - _minimum(l1, l2)
+    ch = _maximum(b1, b2) - _minimum(t1, t2)
+    if mode == 'giou':
+        enclose = _clamp(cw * ch, min=_EPS)
+        return iou - (enclose - union) / enclose
+
+    diag = _clamp(cw ** 2 + ch ** 2, min=_EPS)
+    dist = ((l2 + r2 - l1 - r1) ** 2 + (t2 + b2 - t1 - b1) ** 2) / 4
+    diou = iou - dist / diag
+    if mode == 'diou':
+        return diou
+    elif mode == 'ciou':
+        v = (4 / math.pi ** 2) * (_atan(w2 / _clamp(h2, min=_EPS)) - _atan(w1 / _clamp(h1, min=_EPS))) ** 2
+        alpha = v / _clamp(1 - iou + v, min=_EPS)
+        return diou - alpha * v
+    raise ValueError("Not supported mode: %s" % mode)
+
+
+def box_iou(boxes1, boxes2, mode='iou', max_elements=1 << 24):
+    r"""
+    Pairwise IoU (or a variant of it) between two sets of boxes.
+
+    Parameters
+    ----------
+    boxes1 : ``Union[np.ndarray, torch.Tensor]``
+        (..., N, 4) boxes.
+    boxes2 : ``Union[np.ndarray, torch.Tensor]``
+        (..., M, 4) boxes. Leading dimensions are broadcast with `boxes1`, e.g. (B, N, 4)
+        and (B, M, 4) for batches.
+    mode : ``str``
+        One of ``iou``, ``giou``, ``diou`` and ``ciou``.
+    max_elements : ``int``
+        Boxes of `boxes1` are processed in chunks, so that intermediate results have at most
+        this number of elements.
+
+    Returns
+    -------
+    ious : ``Union[np.ndarray, torch.Tensor]``
+        (..., N, M) values.
+    """
+    n, m = boxes1.shape[-2], boxes2.shape[-2]
+    batch = max(int(np.prod(boxes1.shape[:-2])), int(np.prod(boxes2.shape[:-2])))
+    rows = max(max_elements // max(batch * m, 1), 1)
+    boxes1 = boxes1[..., :, None, :]
+    boxes2 = boxes2[..., None, :, :]
+    if n <= rows:
+        return _iou(boxes1, boxes2, mode)
+    return _cat([_iou(boxes1[..., i:i + rows, :, :], boxes2, mode) for i in range(0, n, rows)], axis=-2)
+
+
+def aligned_box_iou(boxes1, boxes2, mode='iou'):
+    r"""
+    IoU (or a variant of it) between corresponding boxes of broadcastable (..., 4) arrays.
+    """
+    return _iou(boxes1, boxes2, mode)
+
+
+def encode(boxes, anchors, stds=(0.1, 0.1, 0.2, 0.2)):
+    r"""
+    Encode boxes as offsets to anchors, [dx, dy, log(dw), log(dh)] divided by `stds`.
+    Both are ``ltrb`` and broadcast.
+    """
+    boxes = ltrb_to_xywh(boxes)
+    anchors = ltrb_to_xywh(anchors)
+    dxy = (boxes[..., :2] - anchors[..., :2]) / anchors[..., 2:]
+    dwh = _log(_clamp(boxes[..., 2:] / anchors[..., 2:], min=_EPS))
+    deltas = _cat([dxy, dwh], axis=-1)
+    return deltas / _as_like(stds, deltas)
+
+
+def decode(deltas, anchors, stds=(0.1, 0.1, 0.2, 0.2), max_ratio=math.log(1000. / 16)):
+    r"""
+    Decode offsets from `encode` to ``ltrb`` boxes. Log scales are clamped to `max_ratio`
+    to avoid overflow of exp.
+    """
+    deltas = deltas * _as_like(stds, deltas)
+    anchors = ltrb_to_xywh(anchors)
+    xy = deltas[..., :2] * anchors[..., 2:] + anchors[..., :2]
+    wh = _exp(_clamp(deltas[..., 2:], max=max_ratio)) * anchors[..., 2:]
+    return _cat([xy - wh / 2, xy + wh / 2], axis=-1)
@@ -19,12 +19,11 @@ from torch._six import queue, container_abcs, string_classes, int_classes
 from torch.utils.data import IterableDataset, Sampler, SequentialSampler, RandomSampler, BatchSampler
 from torch.utils.data import _utils
 
-from horch.dataloader.worker import _worker_loop
+from horch.dataloader.worker import _worker_loop, _ResumeIteration, _IterableDatasetStopIteration, get_worker_info
+from horch.dataloader.pin_memory import _pin_memory_loop, _recv
 
 import horch.mq
 
-get_worker_info = _utils.worker.get_worker_info
-
 # This function used to be defined in this file. However, it was moved to
 # _utils/collate.py. Although it is rather hard to access this from user land
 # (one has to explicitly directly `import torch.utils.data.dataloader`), there
@@ -44,6 +43,14 @@ def default_collate(batch):
     elem_type = type(elem)
     if isinstance(elem, torch.Tensor):
         out = None
+        worker_info = get_worker_info()
+        if worker_info is not None and worker_info.shared_memory:
+            # If we're in a background process sending results through shared
+            # memory, concatenate directly into a shared memory tensor to avoid
+            # an extra copy
+            numel = sum([x.numel() for x in batch])
+            storage = elem.storage()._new_shared(numel)
+            out = elem.new(storage)
         return torch.stack(batch, 0, out=out)
     elif elem_type.__module__ == 'numpy' and elem_type.__name__ != 'str_' \
             and elem_type.__name__ != 'string_':
@@ -73,6 +80,27 @@ def default_collate(batch):
     raise TypeError(default_collate_err_msg_format.format(elem_type))
 
 
+class _MapDatasetFetcher(_utils.fetch._BaseDatasetFetcher):
+    r"""Fetches samples of a map-style dataset. When automatic batching is enabled
+    and the dataset implements ``__getitems__(indices)``, the whole batch is loaded
+    with one call to it, which should return a list of samples, instead of one
+    ``dataset[i]`` per index."""
+
+    def __init__(self, dataset, auto_collation, collate_fn, drop_last):
+        super(_MapDatasetFetcher, self).__init__(dataset, auto_collation, collate_fn, drop_last)
+        self._getitems = getattr(dataset, '__getitems__', None)
+
+    def fetch(self, possibly_batched_index):
+        if self.auto_collation:
+            if self._getitems is not None:
+                data = self._getitems(possibly_batched_index)
+            else:
+                data = [self.dataset[idx] for idx in possibly_batched_index]
+        else:
+            data = self.dataset[possibly_batched_index]
+        return self.collate_fn(data)
+
+
 class _DatasetKind(object):
     Map = 0
     Iterable = 1
@@ -80,7 +108,7 @@ class _DatasetKind(object):
     @staticmethod
     def create_fetcher(kind, dataset, auto_collation, collate_fn, drop_last):
         if kind == _DatasetKind.Map:
-            return _utils.fetch._MapDatasetFetcher(dataset, auto_collation, collate_fn, drop_last)
+            return _MapDatasetFetcher(dataset, auto_collation, collate_fn, drop_last)
         else:
             return _utils.fetch._IterableDatasetFetcher(dataset, auto_collation, collate_fn, drop_last)
 
@@ -142,6 +170,27 @@ class DataLoader(object):
         worker_init_fn (callable, optional): If not ``None``, this will be called on each
             worker subprocess with the worker id (an int in ``[0, num_workers - 1]``) as
             input, after seeding and before data loading. (default: ``None``)
+        shared_memory (bool, optional): If ``True``, workers place tensor storages of
+            their results in shared memory and only send handles to them over the socket,
+            instead of serializing the whole batch. The main process then receives
+            batches without copying tensor data. Otherwise, tensors and arrays are sent
+            as separate frames of a multipart message, received without copying tensor
+            data. NumPy arrays are copied if their frames are read-only, so they stay
+            writable as before. (default: ``False``)
+        transport (str, optional): ZMQ transport used between workers and the main
+            process, ``'ipc'`` or ``'tcp'``. ``None`` picks ``'ipc'`` when it is available
+            and falls back to ``'tcp'`` on the loopback interface. (default: ``None``)
+        prefetch_factor (int, optional): number of batches loaded in advance by each
+            worker. ``2`` means there will be a total of ``2 * num_workers`` batches
+            prefetched across all workers. (default: ``2``)
+        max_prefetch_factor (int, optional): upper bound the prefetch depth may grow to
+            when the consumer keeps waiting for the next batch. ``None`` means
+            ``2 * prefetch_factor``. Set it to :attr:`prefetch_factor` to disable
+            growing. (default: ``None``)
+        persistent_workers (bool, optional): If ``True``, the data loader will not shutdown
+            the worker processes after a dataset has been consumed once. This keeps the
+            workers, their dataset copies and the sockets alive across epochs, and only
+            the sampler is restarted on each new iteration. (default: ``False``)
 
 
     .. warning:: If the ``spawn`` start method is used, :attr:`worker_init_fn`
@@ -164,7 +213,9 @@ class DataLoader(object):
     def __init__(self, dataset, batch_size=1, shuffle=False, sampler=None,
                  batch_sampler=None, num_workers=0, collate_fn=None,
                  pin_memory=False, drop_last=False, timeout=0,
-                 worker_init_fn=None, multiprocessing_context=None):
+                 worker_init_fn=None, multiprocessing_context=None, shared_memory=False,
+                 transport=None, prefetch_factor=2, max_prefetch_factor=None,
+                 persistent_workers=False):
         torch._C._log_api_usage_once("python.data_loader")
 
         if num_workers < 0:
@@ -174,12 +225,34 @@ class DataLoader(object):
         if timeout < 0:
             raise ValueError('timeout option should be non-negative')
 
+        if persistent_workers and num_workers == 0:
+            raise ValueError('persistent_workers option needs num_workers > 0')
+
+        if prefetch_factor < 1:
+            raise ValueError('prefetch_factor option should be positive')
+
+        if num_workers > 0 and transport not in [None, 'ipc', 'tcp']:
+            # inproc endpoints are only reachable within the process that bound them
+            raise ValueError("transport option should be 'ipc' or 'tcp' with workers, "
+                             "got %r" % (transport,))
+
+        if max_prefetch_factor is None:
+            max_prefetch_factor = 2 * prefetch_factor
+        elif max_prefetch_factor < prefetch_factor:
+            raise ValueError('max_prefetch_factor option should not be less than prefetch_factor')
+
         self.dataset = dataset
         self.num_workers = num_workers
         self.pin_memory = pin_memory
         self.timeout = timeout
         self.worker_init_fn = worker_init_fn
         self.multiprocessing_context = multiprocessing_context
+        self.shared_memory = shared_memory
+        self.transport = transport or horch.mq.default_transport()
+        self.prefetch_factor = prefetch_factor
+        self.max_prefetch_factor = max_prefetch_factor
+        self.persistent_workers = persistent_workers
+        self._iterator = None
 
         # Arg-check dataset related before checking samplers because we want to
         # tell users that iterable-style datasets are incompatible with custom
@@ -269,7 +342,7 @@ class DataLoader(object):
 
         if collate_fn is None:
             if self._auto_collation:
-                collate_fn = _utils.collate.default_collate
+                collate_fn = default_collate
             else:
                 collate_fn = _utils.collate.default_convert
 
@@ -319,6 +392,12 @@ class DataLoader(object):
     def __iter__(self):
         if self.num_workers == 0:
             return _SingleProcessDataLoaderIter(self)
+        elif self.persistent_workers:
+            if self._iterator is None:
+                self._iterator = _MultiProcessingDataLoaderIter(self)
+            else:
+                self._iterator._reset(self)
+            return self._iterator
         else:
             return _MultiProcessingDataLoaderIter(self)
 
@@ -724,18 +803,18 @@ class _MultiProcessingDataLoaderIter(_BaseDataLoaderIter):
             multiprocessing_context = loader.multiprocessing_context
 
         self._worker_init_fn = loader.worker_init_fn
+        self._shared_memory = loader.shared_memory
+        self._persistent_workers = loader.persistent_workers
         self._worker_queue_idx_cycle = itertools.cycle(range(self._num_workers))
+        # Total number of tasks in flight. It grows by one whenever the consumer
+        # has to wait for the next batch, up to `max_prefetch_factor * num_workers`.
+        self._prefetch_depth = loader.prefetch_factor * self._num_workers
+        self._max_prefetch_depth = loader.max_prefetch_factor * self._num_workers
         self._worker_result_queue = multiprocessing_context.Queue()
-        self._zmq_consumer_context, self._zmq_consumer_socket, self._zmq_consumer_port = horch.mq.new_consumer()
+        self._zmq_consumer_context, self._zmq_consumer_socket, self._zmq_consumer_addr = \
+            horch.mq.new_consumer(loader.transport)
         self._worker_pids_set = False
         self._shutdown = False
-        self._send_idx = 0  # idx of the next task to be sent to workers
-        self._rcvd_idx = 0  # idx of the next task to be returned in __next__
-        # information about data not yet yielded, i.e., tasks w/ indices in range [rcvd_idx, send_idx).
-        # map: task idx => - (worker_id,)        if data isn't fetched (outstanding)
-        #                  \ (worker_id, data)   if data is already fetched (out-of-order)
-        self._task_info = {}
-        self._tasks_outstanding = 0  # always equal to count(v for v in task_info.values() if len(v) == 1)
         self._workers_done_event = multiprocessing_context.Event()
 
         self._index_queues = []
@@ -751,7 +830,8 @@ class _MultiProcessingDataLoaderIter(_BaseDataLoaderIter):
             w = multiprocessing_context.Process(
                 target=_worker_loop,
                 args=(self._dataset_kind, self._dataset, index_queue,
-                      self._worker_result_queue, self._zmq_consumer_port, self._workers_done_event,
+                      self._worker_result_queue, self._zmq_consumer_addr, self._shared_memory,
+                      self._workers_done_event,
                       self._auto_collation, self._collate_fn, self._drop_last,
                       self._base_seed + i, self._worker_init_fn, i, self._num_workers))
             w.daemon = True
@@ -770,8 +850,8 @@ class _MultiProcessingDataLoaderIter(_BaseDataLoaderIter):
             self._pin_memory_thread_done_event = threading.Event()
             self._data_queue = queue.Queue()
             pin_memory_thread = threading.Thread(
-                target=_utils.pin_memory._pin_memory_loop,
-                args=(self._worker_result_queue, self._data_queue,
+                target=_pin_memory_loop,
+                args=(self._zmq_consumer_socket, self._shared_memory, self._data_queue,
                       torch.cuda.current_device(),
                       self._pin_memory_thread_done_event))
             pin_memory_thread.daemon = True
@@ -785,9 +865,40 @@ class _MultiProcessingDataLoaderIter(_BaseDataLoaderIter):
         _utils.signal_handling._set_worker_pids(id(self), tuple(w.pid for w in self._workers))
         _utils.signal_handling._set_SIGCHLD_handler()
         self._worker_pids_set = True
+        self._reset(loader, first_iter=True)
+
+    def _reset(self, loader, first_iter=False):
+        self._sampler_iter = iter(self._index_sampler)
+        self._num_yielded = 0
+        self._IterableDataset_len_called = loader._IterableDataset_len_called
+        self._send_idx = 0  # idx of the next task to be sent to workers
+        self._rcvd_idx = 0  # idx of the next task to be returned in __next__
+        # information about data not yet yielded, i.e., tasks w/ indices in range [rcvd_idx, send_idx).
+        # map: task idx => - (worker_id,)        if data isn't fetched (outstanding)
+        #                  \ (worker_id, data)   if data is already fetched (out-of-order)
+        self._task_info = {}
+        self._tasks_outstanding = 0  # always equal to count(v for v in task_info.values() if len(v) == 1)
+        # Tasks are sent to the active worker with the fewest tasks in flight,
+        # so slow samples don't pile more work onto an already busy worker.
+        self._worker_tasks_outstanding = [0] * self._num_workers
+        # Workers that exhausted an `IterableDataset` in the last epoch are
+        # still alive when persistent, so they are all active again.
+        self._workers_status = [True] * self._num_workers
+        if not first_iter:
+            # Results of the last epoch may still be in flight if it was not
+            # fully consumed. Every worker acknowledges the resume after all of
+            # its previous results, so drain until each one has answered.
+            for index_queue in self._index_queues:
+                index_queue.put(_ResumeIteration())
+            resume_iteration_cnt = self._num_workers
+            while resume_iteration_cnt > 0:
+                return_idx, return_data = self._get_data()
+                if isinstance(return_idx, _ResumeIteration):
+                    assert return_data is None
+                    resume_iteration_cnt -= 1
 
         # prime the prefetch loop
-        for _ in range(2 * self._num_workers):
+        for _ in range(self._prefetch_depth):
             self._try_put_index()
 
     def _try_get_data(self, timeout=_utils.MP_STATUS_CHECK_INTERVAL):
@@ -803,8 +914,14 @@ class _MultiProcessingDataLoaderIter(_BaseDataLoaderIter):
         # Returns a 2-tuple:
         #   (bool: whether successfully get data, any: data if successful else None)
         try:
-            # data = self._data_queue.get(timeout=timeout)
-            data = horch.mq.get(self._zmq_consumer_socket)
+            if self._pin_memory:
+                # The pin memory thread owns the socket, as ZMQ sockets
+                # must not be shared between threads.
+                data = self._data_queue.get(timeout=timeout)
+            else:
+                if not self._zmq_consumer_socket.poll(timeout * 1000):
+                    raise queue.Empty
+                data = _recv(self._zmq_consumer_socket, self._shared_memory)
             return (True, data)
         except Exception as e:
             # At timeout and error, we manually check whether any worker has
@@ -873,7 +990,8 @@ class _MultiProcessingDataLoaderIter(_BaseDataLoaderIter):
                 self._rcvd_idx += 1
             else:
                 # no valid `self._rcvd_idx` is found (i.e., didn't break)
-                self._shutdown_workers()
+                if not self._persistent_workers:
+                    self._shutdown_workers()
                 raise StopIteration
 
             # Now `self._rcvd_idx` is the batch index we want to fetch
@@ -884,13 +1002,19 @@ class _MultiProcessingDataLoaderIter(_BaseDataLoaderIter):
                 return self._process_data(data)
 
             assert not self._shutdown and self._tasks_outstanding > 0
+            if self._num_yielded > 0 and self._prefetch_depth < self._max_prefetch_depth:
+                # The consumer is starving, prefetch deeper.
+                self._prefetch_depth += 1
+                self._try_put_index()
             idx, data = self._get_data()
             self._tasks_outstanding -= 1
+            if idx in self._task_info:
+                self._worker_tasks_outstanding[self._task_info[idx][0]] -= 1
 
             if self._dataset_kind == _DatasetKind.Iterable:
                 # Check for _IterableDatasetStopIteration
-                if isinstance(data, _utils.worker._IterableDatasetStopIteration):
-                    self._shutdown_worker(data.worker_id)
+                if isinstance(data, _IterableDatasetStopIteration):
+                    self._shutdown_worker(data.worker_id, shutdown=not self._persistent_workers)
                     self._try_put_index()
                     continue
 
@@ -902,22 +1026,27 @@ class _MultiProcessingDataLoaderIter(_BaseDataLoaderIter):
                 return self._process_data(data)
 
     def _try_put_index(self):
-        assert self._tasks_outstanding < 2 * self._num_workers
+        assert self._tasks_outstanding < self._prefetch_depth
         try:
             index = self._next_index()
         except StopIteration:
             return
-        for _ in range(self._num_workers):  # find the next active worker, if any
-            worker_queue_idx = next(self._worker_queue_idx_cycle)
-            if self._workers_status[worker_queue_idx]:
-                break
-        else:
-            # not found (i.e., didn't break)
+        worker_queue_idx = None
+        for _ in range(self._num_workers):  # find the least loaded active worker, if any
+            i = next(self._worker_queue_idx_cycle)
+            if self._workers_status[i] and (
+                    worker_queue_idx is None or
+                    self._worker_tasks_outstanding[i] < self._worker_tasks_outstanding[worker_queue_idx]):
+                worker_queue_idx = i
+        # start the next search one worker later, so that ties are broken round-robin
+        next(self._worker_queue_idx_cycle)
+        if worker_queue_idx is None:
             return
 
         self._index_queues[worker_queue_idx].put((self._send_idx, index))
         self._task_info[self._send_idx] = (worker_queue_idx,)
         self._tasks_outstanding += 1
+        self._worker_tasks_outstanding[worker_queue_idx] += 1
         self._send_idx += 1
 
     def _process_data(self, data):
@@ -927,18 +1056,22 @@ class _MultiProcessingDataLoaderIter(_BaseDataLoaderIter):
             data.reraise()
         return data
 
-    def _shutdown_worker(self, worker_id):
+    def _shutdown_worker(self, worker_id, shutdown=True):
         # Mark a worker as having finished its work and dead, e.g., due to
         # exhausting an `IterableDataset`. This should be used only when this
         # `_MultiProcessingDataLoaderIter` is going to continue running.
+        #
+        # With `shutdown=False` the worker is only marked as unavailable for
+        # the current epoch, so that persistent workers can be resumed.
 
-        assert self._workers_status[worker_id]
+        assert self._workers_status[worker_id] or (self._persistent_workers and shutdown)
 
-        # Signal termination to that specific worker.
-        q = self._index_queues[worker_id]
-        # Indicate that no more data will be put on this queue by the current
-        # process.
-        q.put(None)
+        if shutdown:
+            # Signal termination to that specific worker.
+            q = self._index_queues[worker_id]
+            # Indicate that no more data will be put on this queue by the current
+            # process.
+            q.put(None)
 
         # Note that we don't actually join the worker here, nor do we remove the
         # worker's pid from C side struct because (1) joining may be slow, and
@@ -969,9 +1102,8 @@ class _MultiProcessingDataLoaderIter(_BaseDataLoaderIter):
                 if hasattr(self, '_pin_memory_thread'):
                     # Use hasattr in case error happens before we set the attribute.
                     self._pin_memory_thread_done_event.set()
-                    # Send something to pin_memory_thread in case it is waiting
-                    # so that it can wake up and check `pin_memory_thread_done_event`
-                    self._worker_result_queue.put((None, None))
+                    # The thread polls the socket and wakes up within
+                    # `POLL_INTERVAL` to check `pin_memory_thread_done_event`.
                     self._pin_memory_thread.join()
                     self._worker_result_queue.close()
 
@@ -981,14 +1113,16 @@ class _MultiProcessingDataLoaderIter(_BaseDataLoaderIter):
                     # Get number of workers from `len(self._workers)` instead of
                     # `self._num_workers` in case we error before starting all
                     # workers.
-                    if self._workers_status[worker_id]:
+                    # Persistent workers marked unavailable are still alive
+                    # and waiting for the final signal.
+                    if self._workers_status[worker_id] or self._persistent_workers:
                         self._shutdown_worker(worker_id)
                 for w in self._workers:
                     w.join()
                 for q in self._index_queues:
                     q.cancel_join_thread()
                     q.close()
-                self._zmq_consumer_socket.close()
+                horch.mq.close_consumer(self._zmq_consumer_socket, self._zmq_consumer_addr)
             finally:
                 # Even though all this function does is putting into queues that
                 # we have called `cancel_join_thread` on, weird things can
@@ -0,0 +1,53 @@
+r""""Contains definitions of the methods used by the _MultiProcessingDataLoaderIter
+pin memory thread.
+
+Unlike the thread in PyTorch, it reads worker results from the ZMQ consumer
+socket, which is then only used by this thread.
+"""
+
+import torch
+from torch._six import queue
+from torch._utils import ExceptionWrapper
+from torch.utils.data._utils.pin_memory import pin_memory
+
+import horch.mq
+
+# The socket is polled in short intervals so that the thread notices
+# `done_event` quickly when the iterator is shut down.
+POLL_INTERVAL = 0.1
+
+
+def _recv(socket, shared_memory):
+    if shared_memory:
+        return horch.mq.get(socket, shared=True)
+    else:
+        return horch.mq.get_multipart(socket)
+
+
+def _pin_memory_loop(socket, shared_memory, out_queue, device_id, done_event):
+    # This setting is thread local, and prevents the copy in pin_memory from
+    # consuming all CPU cores.
+    torch.set_num_threads(1)
+
+    torch.cuda.set_device(device_id)
+
+    # See NOTE [ Data Loader Multiprocessing Shutdown Logic ] for details on the
+    # logic of this function.
+    while not done_event.is_set():
+        if not socket.poll(POLL_INTERVAL * 1000):
+            continue
+        idx, data = _recv(socket, shared_memory)
+        if not done_event.is_set() and not isinstance(data, ExceptionWrapper):
+            try:
+                data = pin_memory(data)
+            except Exception:
+                data = ExceptionWrapper(
+                    where="in pin memory thread for device {}".format(device_id))
+        while not done_event.is_set():
+            try:
+                out_queue.put((idx, data), timeout=POLL_INTERVAL)
+                break
+            except queue.Full:
+                continue
+        # save memory
+        del data, idx
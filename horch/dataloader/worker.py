@@ -77,7 +77,19 @@ r"""Dummy class used to signal the end of an IterableDataset"""
 _IterableDatasetStopIteration = namedtuple('_IterableDatasetStopIteration', ['worker_id'])
 
 
-def _worker_loop(dataset_kind, dataset, index_queue, data_queue, consumer_port, done_event,
+class _ResumeIteration(object):
+    r"""Dummy class used to resume the fetching when worker reuse is enabled"""
+    pass
+
+
+def _put(socket, data, shared_memory):
+    if shared_memory:
+        horch.mq.put(socket, data, shared=True)
+    else:
+        horch.mq.put_multipart(socket, data)
+
+
+def _worker_loop(dataset_kind, dataset, index_queue, data_queue, consumer_addr, shared_memory, done_event,
                  auto_collation, collate_fn, drop_last, seed, init_fn, worker_id,
                  num_workers):
     # See NOTE [ Data Loader Multiprocessing Shutdown Logic ] for details on the
@@ -91,7 +103,7 @@ def _worker_loop(dataset_kind, dataset, index_queue, data_queue, consumer_port,
         # https://docs.python.org/3/library/signal.html#execution-of-python-signal-handlers
         _set_worker_signal_handlers()
 
-        socket = horch.mq.new_producer(consumer_port)
+        socket = horch.mq.new_producer(consumer_addr)
 
         torch.set_num_threads(1)
         random.seed(seed)
@@ -99,9 +111,9 @@ def _worker_loop(dataset_kind, dataset, index_queue, data_queue, consumer_port,
 
         global _worker_info
         _worker_info = WorkerInfo(id=worker_id, num_workers=num_workers,
-                                  seed=seed, dataset=dataset)
+                                  seed=seed, dataset=dataset, shared_memory=shared_memory)
 
-        from torch.utils.data import _DatasetKind
+        from horch.dataloader.dataloader import _DatasetKind
 
         init_exception = None
 
@@ -135,7 +147,15 @@ def _worker_loop(dataset_kind, dataset, index_queue, data_queue, consumer_port,
                 r = index_queue.get(timeout=MP_STATUS_CHECK_INTERVAL)
             except queue.Empty:
                 continue
-            if r is None:
+            if isinstance(r, _ResumeIteration):
+                # Acknowledge the main process. Results are pushed in order, so
+                # everything sent before this is stale.
+                _put(socket, (r, None), shared_memory)
+                iteration_end = False
+                # Recreate the fetcher, which restarts an IterableDataset
+                fetcher = _DatasetKind.create_fetcher(dataset_kind, dataset, auto_collation, collate_fn, drop_last)
+                continue
+            elif r is None:
                 # Received the final signal
                 assert done_event.is_set() or iteration_end
                 break
@@ -165,7 +185,7 @@ def _worker_loop(dataset_kind, dataset, index_queue, data_queue, consumer_port,
                         data = ExceptionWrapper(
                             where="in DataLoader worker process {}".format(worker_id))
 
-            horch.mq.put(socket, (idx, data))
+            _put(socket, (idx, data), shared_memory)
             # data_queue.put((idx, obj_id))
             del data, idx, index, r  # save memory
     except KeyboardInterrupt:
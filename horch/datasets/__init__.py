@@ -1,9 +1,10 @@
 import math
 
 import numpy as np
-from torch.utils.data import Dataset
+from torch.utils.data import Dataset, IterableDataset
 from torchvision.transforms import Compose
 from horch.transforms import InputTransform
+from horch.datasets.utils import getitems
 
 BACKENDS = {
     'PIL': 0,
@@ -28,10 +29,17 @@ from horch.datasets.coco import CocoDetection
 from horch.datasets.voc import VOCDetection, VOCSegmentation, VOCDetectionConcat
 from horch.datasets.svhn import SVHNDetection
 from horch.datasets.animefaces import AnimeFaces
+from horch.datasets.mmap import MMapDataset, build_mmap_cache
+from horch.datasets.records import RecordDataset, write_records
 
 
 class Fullset(Dataset):
 
+    def __new__(cls, dataset=None, *args, **kwargs):
+        if cls is Fullset and isinstance(dataset, IterableDataset):
+            cls = IterableFullset
+        return super().__new__(cls)
+
     def __init__(self, dataset, transform):
         self.dataset = dataset
         self.transform = transform
@@ -40,6 +48,9 @@ class Fullset(Dataset):
         input, target = self.dataset[idx]
         return self.transform(input, target)
 
+    def __getitems__(self, indices):
+        return [self.transform(input, target) for input, target in getitems(self.dataset, indices)]
+
     def to_coco(self):
         assert hasattr(self.dataset, "to_coco"), "Dataset don't support to_coco"
         return self.dataset.to_coco()
@@ -51,6 +62,16 @@ class Fullset(Dataset):
         return "Fullset(%s)" % self.dataset
 
 
+class IterableFullset(Fullset, IterableDataset):
+    r"""
+    `Fullset` of an `IterableDataset`, created by `Fullset` automatically.
+    """
+
+    def __iter__(self):
+        for input, target in self.dataset:
+            yield self.transform(input, target)
+
+
 class Subset(Dataset):
     """
     Subset of a dataset at specified indices.
@@ -58,8 +79,16 @@ class Subset(Dataset):
     Arguments:
         dataset (Dataset): The whole Dataset
         indices (sequence): Indices in the whole set selected for subset
+
+    If `dataset` is an `IterableDataset` (e.g. `RecordDataset`), an `IterableSubset` is
+    created, which yields the selected samples in the order of the dataset.
     """
 
+    def __new__(cls, dataset=None, *args, **kwargs):
+        if cls is Subset and isinstance(dataset, IterableDataset):
+            cls = IterableSubset
+        return super().__new__(cls)
+
     def __init__(self, dataset, indices, transform=None):
         self.dataset = dataset
         self.indices = indices
@@ -73,9 +102,18 @@ class Subset(Dataset):
 
         return img, target
 
+    def __getitems__(self, indices):
+        samples = getitems(self.dataset, [self.indices[i] for i in indices])
+        if self.transform is not None:
+            samples = [self.transform(img, target) for img, target in samples]
+        return samples
+
     def get_image(self, idx):
         return self.dataset.get_image(self.indices[idx])
 
+    def get_image_file(self, idx):
+        return self.dataset.get_image_file(self.indices[idx])
+
     def get_target(self, idx):
         return self.dataset.get_target(self.indices[idx])
 
@@ -97,6 +135,25 @@ class Subset(Dataset):
         return fmt_str
 
 
+class IterableSubset(Subset, IterableDataset):
+    r"""
+    `Subset` of an `IterableDataset`, created by `Subset` automatically. Samples are read
+    with `iterate(indices)` if the dataset has it (e.g. `RecordDataset`), otherwise the
+    others are skipped while iterating over the dataset.
+    """
+
+    def __iter__(self):
+        if hasattr(self.dataset, 'iterate'):
+            samples = self.dataset.iterate(self.indices)
+        else:
+            indices = set(int(i) for i in self.indices)
+            samples = (sample for i, sample in enumerate(self.dataset) if i in indices)
+        for img, target in samples:
+            if self.transform is not None:
+                img, target = self.transform(img, target)
+            yield img, target
+
+
 def train_test_split(dataset, test_ratio, random=False, transform=None, test_transform=None):
     if isinstance(transform, Compose):
         transform = InputTransform(transform)
@@ -0,0 +1,313 @@
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from horch.io import fmt_path, read_json, save_json
+from horch.transforms.detection.boxlist import BoxList
+
+__all__ = ["CocoAnnotations"]
+
+_IMAGE_FIELDS = ("width", "height")
+_ANN_FIELDS = ("id", "category_id", "area", "iscrowd")
+_ARRAYS = (
+    "image_ids", "widths", "heights", "file_names", "file_name_offsets",
+    "image_extras", "image_extra_offsets", "ann_offsets", "ann_ids", "bboxes",
+    "category_ids", "areas", "iscrowd", "ann_extras", "ann_extra_offsets",
+)
+
+
+def _pack(strings):
+    data = [s.encode() for s in strings]
+    offsets = np.zeros(len(data) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(b) for b in data], dtype=np.int64)
+    return np.frombuffer(b"".join(data), dtype=np.uint8).copy(), offsets
+
+
+def _unpack(blob, offsets, i):
+    return blob[offsets[i]:offsets[i + 1]].tobytes().decode()
+
+
+def _extras(d, keys):
+    extras = {k: v for k, v in d.items() if k not in keys}
+    return json.dumps(extras) if extras else ""
+
+
+def _ranges(offsets, indices):
+    # Flat positions of the rows [offsets[i], offsets[i + 1]) for i in indices, and their new offsets
+    starts = offsets[indices]
+    counts = offsets[indices + 1] - starts
+    new_offsets = np.zeros(len(indices) + 1, dtype=np.int64)
+    np.cumsum(counts, out=new_offsets[1:])
+    positions = np.arange(new_offsets[-1]) + np.repeat(starts - new_offsets[:-1], counts)
+    return positions, new_offsets
+
+
+class CocoAnnotations:
+    r"""
+    COCO-style annotations stored as columnar arrays.
+
+    Images are kept in their original order, and annotations are sorted by image, so that
+    the annotations of the `i`-th image are the rows ``ann_offsets[i]:ann_offsets[i + 1]``.
+    Strings and keys other than the common ones (e.g. `segmentation`) are stored as utf-8 blobs
+    with offsets. As there are no Python objects per image or annotation, the arrays can be
+    memory-mapped and are shared copy-on-write by DataLoader workers.
+
+    Parameters
+    ----------
+    arrays : ``Dict[str, np.ndarray]``
+        Columns of the image and annotation tables.
+    meta : ``dict``
+        `categories`, the other top-level keys of the COCO dict and the fields present.
+    """
+
+    def __init__(self, arrays, meta):
+        for name in _ARRAYS:
+            setattr(self, name, arrays[name])
+        self.meta = meta
+
+    @staticmethod
+    def from_coco(data):
+        r"""
+        Create from a COCO dict. Annotations of images not in `images` are dropped.
+        """
+        images = data['images']
+        n = len(images)
+        image_ids = np.array([img['id'] for img in images], dtype=np.int64)
+        index = {img_id: i for i, img_id in enumerate(image_ids.tolist())}
+        anns = [ann for ann in data['annotations'] if ann['image_id'] in index]
+        img_index = np.array([index[ann['image_id']] for ann in anns], dtype=np.int64)
+        order = np.argsort(img_index, kind='stable')
+        anns = [anns[i] for i in order]
+        m = len(anns)
+
+        # Columns of keys present in every row, the others are kept with the extra keys
+        image_fields = [k for k in _IMAGE_FIELDS if n != 0 and all(k in img for img in images)]
+        ann_fields = [k for k in _ANN_FIELDS if m != 0 and all(k in ann for ann in anns)]
+        image_keys = ('id', 'file_name', *image_fields)
+        ann_keys = ('image_id', 'bbox', *ann_fields)
+
+        ann_offsets = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(img_index, minlength=n), out=ann_offsets[1:])
+        bboxes = np.array([ann['bbox'] for ann in anns], dtype=np.float64).reshape(m, 4)
+        arrays = {
+            "image_ids": image_ids,
+            "widths": np.array([img.get('width', 0) for img in images], dtype=np.int64),
+            "heights": np.array([img.get('height', 0) for img in images], dtype=np.int64),
+            "ann_offsets": ann_offsets,
+            "ann_ids": np.array([ann.get('id', -1) for ann in anns], dtype=np.int64),
+            "bboxes": bboxes,
+            "category_ids": np.array([ann.get('category_id', 0) for ann in anns], dtype=np.int64),
+            "areas": np.array([ann.get('area', 0) for ann in anns], dtype=np.float64),
+            "iscrowd": np.array([ann.get('iscrowd', 0) for ann in anns], dtype=np.uint8),
+        }
+        arrays["file_names"], arrays["file_name_offsets"] = _pack(img['file_name'] for img in images)
+        arrays["image_extras"], arrays["image_extra_offsets"] = _pack(
+            _extras(img, image_keys) for img in images)
+        arrays["ann_extras"], arrays["ann_extra_offsets"] = _pack(_extras(ann, ann_keys) for ann in anns)
+
+        meta = {k: v for k, v in data.items() if k not in ['images', 'annotations']}
+        meta.setdefault('categories', [])
+        meta['_fields'] = {"image": image_fields, "ann": ann_fields}
+        return CocoAnnotations(arrays, meta)
+
+    @staticmethod
+    def from_file(ann_file, cache=True):
+        r"""
+        Load from a COCO json file.
+
+        If `cache` is True, the arrays are saved to ``<ann_file>.cache`` the first time and
+        memory-mapped from there afterwards, as long as the json file isn't modified.
+        """
+        ann_file = fmt_path(ann_file)
+        cache_dir = ann_file.parent / (ann_file.name + ".cache")
+        stat = os.stat(ann_file)
+        source = {"size": stat.st_size, "mtime": stat.st_mtime}
+        if cache and (cache_dir / "meta.json").exists():
+            try:
+                meta = read_json(cache_dir / "meta.json")
+                if meta.get("_source") == source:
+                    return CocoAnnotations.load(cache_dir)
+            except (OSError, ValueError):
+                # Being replaced by another process
+                pass
+        annotations = CocoAnnotations.from_coco(read_json(ann_file))
+        if cache:
+            annotations.meta['_source'] = source
+            try:
+                annotations.save(cache_dir)
+                return CocoAnnotations.load(cache_dir)
+            except OSError:
+                # The directory of annotations may be read-only
+                pass
+        return annotations
+
+    def save(self, root):
+        r"""
+        Save to the directory `root`, which is replaced atomically, so that other processes
+        (e.g. DDP ranks) never read or memory-map partially written files.
+        """
+        root = fmt_path(root)
+        root.parent.mkdir(parents=True, exist_ok=True)
+        tmp = tempfile.mkdtemp(prefix=root.name + ".tmp-", dir=root.parent)
+        try:
+            for name in _ARRAYS:
+                np.save(os.path.join(tmp, name + ".npy"), getattr(self, name))
+            save_json(os.path.join(tmp, "meta.json"), self.meta)
+            if root.exists():
+                # Files memory-mapped from the old directory stay valid after it is removed
+                old = tempfile.mkdtemp(prefix=root.name + ".old-", dir=root.parent)
+                try:
+                    os.replace(root, old)
+                except OSError:
+                    # Already moved by another process
+                    pass
+                shutil.rmtree(old, ignore_errors=True)
+            try:
+                os.replace(tmp, root)
+            except OSError:
+                # Another process saved it first
+                if not (root / "meta.json").exists():
+                    raise
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    @staticmethod
+    def load(root, mmap=True):
+        root = fmt_path(root)
+        mmap_mode = 'r' if mmap else None
+        arrays = {name: np.load(root / (name + ".npy"), mmap_mode=mmap_mode) for name in _ARRAYS}
+        return CocoAnnotations(arrays, read_json(root / "meta.json"))
+
+    @property
+    def categories(self):
+        return self.meta['categories']
+
+    def __len__(self):
+        return len(self.image_ids)
+
+    def file_name(self, i):
+        return _unpack(self.file_names, self.file_name_offsets, i)
+
+    def image(self, i):
+        img = {"id": int(self.image_ids[i]), "file_name": self.file_name(i)}
+        for k in self.meta['_fields']['image']:
+            img[k] = int((self.widths if k == 'width' else self.heights)[i])
+        extras = _unpack(self.image_extras, self.image_extra_offsets, i)
+        if extras:
+            img.update(json.loads(extras))
+        return img
+
+    def _anns(self, s, e, image_ids):
+        fields = self.meta['_fields']['ann']
+        columns = {
+            "id": self.ann_ids[s:e].tolist(),
+            "category_id": self.category_ids[s:e].tolist(),
+            "area": self.areas[s:e].tolist(),
+            "iscrowd": self.iscrowd[s:e].tolist(),
+        }
+        bboxes = self.bboxes[s:e].tolist()
+        anns = []
+        for j in range(e - s):
+            ann = {"image_id": image_ids[j], "bbox": bboxes[j]}
+            for k in fields:
+                ann[k] = columns[k][j]
+            extras = _unpack(self.ann_extras, self.ann_extra_offsets, s + j)
+            if extras:
+                ann.update(json.loads(extras))
+            anns.append(ann)
+        return anns
+
+    def anns(self, i):
+        r"""
+        Annotations of the `i`-th image as COCO dicts.
+        """
+        s, e = self.ann_offsets[i], self.ann_offsets[i + 1]
+        return self._anns(s, e, [int(self.image_ids[i])] * (e - s))
+
+    def boxlist(self, i):
+        r"""
+        Annotations of the `i`-th image as a `BoxList` of views, without the extra keys.
+        """
+        s, e = self.ann_offsets[i], self.ann_offsets[i + 1]
+        fields = [k for k in self.meta['_fields']['ann'] if k != 'id']
+        areas = self.areas[s:e] if 'area' in fields else None
+        return BoxList(self.bboxes[s:e], self.category_ids[s:e], areas, self.iscrowd[s:e], fields=fields)
+
+    def subset(self, indices):
+        r"""
+        Annotations of the images at `indices`, selected by slicing the arrays.
+        """
+        indices = np.asarray(indices, dtype=np.int64).reshape(-1)
+        ann_pos, ann_offsets = _ranges(self.ann_offsets, indices)
+        arrays = {
+            "image_ids": self.image_ids[indices],
+            "widths": self.widths[indices],
+            "heights": self.heights[indices],
+            "ann_offsets": ann_offsets,
+            "ann_ids": self.ann_ids[ann_pos],
+            "bboxes": self.bboxes[ann_pos],
+            "category_ids": self.category_ids[ann_pos],
+            "areas": self.areas[ann_pos],
+            "iscrowd": self.iscrowd[ann_pos],
+        }
+        for blob, offsets, rows in [("file_names", "file_name_offsets", indices),
+                                    ("image_extras", "image_extra_offsets", indices),
+                                    ("ann_extras", "ann_extra_offsets", ann_pos)]:
+            pos, arrays[offsets] = _ranges(getattr(self, offsets), rows)
+            arrays[blob] = getattr(self, blob)[pos]
+        return CocoAnnotations(arrays, self.meta)
+
+    @staticmethod
+    def concat(annotations):
+        r"""
+        Concatenate annotations of the same categories. The ids of images and annotations
+        after the first are renumbered to follow the previous ones.
+        """
+        annotations = list(annotations)
+        first = annotations[0]
+        for a in annotations[1:]:
+            assert a.categories == first.categories
+
+        image_ids, ann_ids = [first.image_ids], [first.ann_ids]
+        next_image_id = int(first.image_ids.max(initial=-1)) + 1
+        next_ann_id = int(first.ann_ids.max(initial=-1)) + 1
+        for a in annotations[1:]:
+            image_ids.append(np.arange(next_image_id, next_image_id + len(a), dtype=np.int64))
+            ann_ids.append(np.arange(next_ann_id, next_ann_id + len(a.ann_ids), dtype=np.int64))
+            next_image_id += len(a)
+            next_ann_id += len(a.ann_ids)
+
+        def cat(name):
+            return np.concatenate([getattr(a, name) for a in annotations])
+
+        def cat_offsets(name):
+            offsets = [getattr(a, name) for a in annotations]
+            starts = np.cumsum([0] + [o[-1] for o in offsets[:-1]])
+            return np.concatenate([offsets[0][:1]] + [o[1:] + s for o, s in zip(offsets, starts)])
+
+        arrays = {name: cat(name) for name in
+                  ["widths", "heights", "bboxes", "category_ids", "areas", "iscrowd",
+                   "file_names", "image_extras", "ann_extras"]}
+        for name in ["ann_offsets", "file_name_offsets", "image_extra_offsets", "ann_extra_offsets"]:
+            arrays[name] = cat_offsets(name)
+        arrays["image_ids"] = np.concatenate(image_ids)
+        arrays["ann_ids"] = np.concatenate(ann_ids)
+        return CocoAnnotations(arrays, first.meta)
+
+    def to_coco(self):
+        r"""
+        Materialize as a COCO dict.
+        """
+        image_ids = np.repeat(self.image_ids, np.diff(self.ann_offsets)).tolist()
+        meta = {k: v for k, v in self.meta.items() if not k.startswith('_')}
+        return {
+            **meta,
+            "images": [self.image(i) for i in range(len(self))],
+            "annotations": self._anns(0, len(self.ann_ids), image_ids),
+        }
+
+    def __repr__(self):
+        return "CocoAnnotations(num_images=%d, num_annotations=%d)" % (len(self), len(self.ann_ids))
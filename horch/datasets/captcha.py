@@ -34,9 +34,15 @@ class Captcha(Dataset):
         self.labels = d["labels"].astype(np.int64)
 
     def __getitem__(self, index):
-        img = self.data[index]
-        target = self.labels[index]
+        return self._transform(self.data[index], self.labels[index])
 
+    def __getitems__(self, indices):
+        # One fancy-indexing slice per array instead of one lookup per sample
+        imgs = self.data[indices]
+        targets = self.labels[indices]
+        return [self._transform(img, target) for img, target in zip(imgs, targets)]
+
+    def _transform(self, img, target):
         img = Image.fromarray(img)
 
         if self.transform is not None:
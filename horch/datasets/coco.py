@@ -1,53 +1,36 @@
 import random
 import os
-import json
 from PIL import Image
 from torch.utils.data import Dataset
 
 # https://github.com/pytorch/vision/blob/master/torchvision/datasets/coco.py
-from horch.io import save_json, fmt_path, read_json
+from horch.io import save_json, fmt_path
+from horch.datasets.annotations import CocoAnnotations
 
 
 class CocoDetection(Dataset):
 
     def __init__(self, root, ann_file, transform=None):
-        from hpycocotools.coco import COCO
         self.root = root
         self.ann_file = ann_file
-
-        with open(self.ann_file, 'r') as f:
-            self.data = json.load(f)
-
-        self.coco = COCO(self.data, verbose=False)
-        self.ids = list(self.coco.imgs.keys())
+        self.annotations = CocoAnnotations.from_file(self.ann_file)
+        self.ids = self.annotations.image_ids
         self.transform = transform
 
     def to_coco(self, indices=None):
         if indices is None:
-            return self.data
-        ids = [self.ids[i] for i in indices]
-        images = self.coco.loadImgs(ids)
-        ann_ids = self.coco.getAnnIds(ids)
-        annotations = self.coco.loadAnns(ann_ids)
-        return {
-            **self.data,
-            "images": images,
-            "annotations": annotations,
-        }
+            return self.annotations.to_coco()
+        return self.annotations.subset(indices).to_coco()
+
+    def get_image_file(self, index):
+        return os.path.join(self.root, self.annotations.file_name(index))
 
     def get_image(self, index):
-        coco = self.coco
-        img_id = self.ids[index]
-        path = coco.loadImgs([img_id])[0]['file_name']
-        img = Image.open(os.path.join(self.root, path)).convert('RGB')
+        img = Image.open(self.get_image_file(index)).convert('RGB')
         return img
 
     def get_target(self, index):
-        coco = self.coco
-        img_id = self.ids[index]
-        ann_ids = coco.getAnnIds(imgIds=[img_id])
-        target = coco.loadAnns(ann_ids)
-        return target
+        return self.annotations.anns(index)
 
     def __getitem__(self, index):
         """
@@ -56,14 +39,8 @@ class CocoDetection(Dataset):
         Returns:
             tuple: Tuple (image, target). target is the object returned by ``coco.loadAnns``.
         """
-        coco = self.coco
-        img_id = self.ids[index]
-        ann_ids = coco.getAnnIds(imgIds=[img_id])
-        target = coco.loadAnns(ann_ids)
-
-        path = coco.loadImgs([img_id])[0]['file_name']
-
-        img = Image.open(os.path.join(self.root, path)).convert('RGB')
+        img = self.get_image(index)
+        target = self.get_target(index)
         if self.transform is not None:
             img, target = self.transform(img, target)
 
@@ -83,26 +60,16 @@ class CocoDetection(Dataset):
 
 
 def extract(ann_file, d, indices, suffix, img_dir=None):
-    sub_d = {
-        k: v
-        for k, v in d.items()
-        if k not in ['images', 'annotations']
-    }
-    images = d['images']
-    sub_images = [images[i] for i in indices]
-    sub_images_ids = set(img['id'] for img in sub_images)
-    sub_annotations = [ann for ann in d['annotations'] if ann['image_id'] in sub_images_ids]
-    sub_d['images'] = sub_images
-    sub_d['annotations'] = sub_annotations
-    save_json(ann_file.parent / (ann_file.stem + "_" + suffix + ".json"), sub_d)
+    if not isinstance(d, CocoAnnotations):
+        d = CocoAnnotations.from_coco(d)
+    save_json(ann_file.parent / (ann_file.stem + "_" + suffix + ".json"), d.subset(indices).to_coco())
 
 def sample(ann_file, k):
     ann_file = fmt_path(ann_file)
 
-    d = read_json(ann_file)
-    images = d['images']
+    d = CocoAnnotations.from_file(ann_file, cache=False)
 
-    n = len(images)
+    n = len(d)
     indices = list(range(n))
     random.shuffle(indices)
     sub_indices = indices[:k]
@@ -113,9 +80,9 @@ def sample(ann_file, k):
 def train_test_split(ann_file, test_ratio, seed=0):
     ann_file = fmt_path(ann_file)
 
-    d = read_json(ann_file)
+    d = CocoAnnotations.from_file(ann_file, cache=False)
 
-    n = len(d['images'])
+    n = len(d)
     n_test = int(n * test_ratio)
     n_train = n - n_test
     indices = list(range(n))
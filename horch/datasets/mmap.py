@@ -0,0 +1,274 @@
+import json
+import os
+import struct
+import tempfile
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+from torch.utils.data import Dataset, DataLoader
+
+from horch.transforms.detection.boxlist import BoxList
+
+_MAGIC = b"HORCHMM1"
+_ALIGN = 64
+
+
+def _resize(img, target, max_size):
+    w, h = img.size
+    scale = max_size / max(w, h) if max_size else 1
+    if scale >= 1:
+        return img, target
+    size = max(int(round(w * scale)), 1), max(int(round(h * scale)), 1)
+    sx, sy = size[0] / w, size[1] / h
+    img = img.resize(size, Image.BILINEAR)
+    if isinstance(target, Image.Image):
+        target = target.resize(size, Image.NEAREST)
+    elif isinstance(target, BoxList):
+        boxes = target.boxes * np.array([sx, sy, sx, sy], dtype=target.boxes.dtype)
+        target = BoxList(boxes, target.labels, target.areas * (sx * sy), target.iscrowd, None, target.fields)
+    return img, target
+
+
+def _identity(x):
+    return x
+
+
+class _Decoded(Dataset):
+    # Decodes and resizes in DataLoader workers and returns arrays, which are cheap to pickle
+
+    def __init__(self, dataset, max_size):
+        self.dataset = dataset
+        self.max_size = max_size
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __getitem__(self, idx):
+        img, target = self.dataset[idx]
+        if isinstance(target, list):
+            target = BoxList.from_anns(target)
+        img, target = _resize(img.convert('RGB'), target, self.max_size)
+        if isinstance(target, Image.Image):
+            target = np.asarray(target, dtype=np.uint8)
+        return np.asarray(img, dtype=np.uint8), target
+
+
+def _kind(target):
+    if isinstance(target, BoxList):
+        return "detection"
+    elif isinstance(target, np.ndarray) and target.ndim == 2:
+        return "segmentation"
+    elif isinstance(target, (int, np.integer)):
+        return "classification"
+    raise TypeError("Not supported target: %s" % type(target))
+
+
+class _Writer:
+
+    def __init__(self, f):
+        self.f = f
+        self.arrays = {}
+
+    def _pad(self):
+        pos = self.f.tell()
+        if pos % _ALIGN:
+            self.f.write(b"\0" * (_ALIGN - pos % _ALIGN))
+        return self.f.tell()
+
+    def write_raw(self, data):
+        offset = self.f.tell()
+        self.f.write(data)
+        return offset
+
+    def write_array(self, name, a):
+        a = np.ascontiguousarray(a)
+        offset = self._pad()
+        self.f.write(a.tobytes())
+        self.arrays[name] = {"offset": offset, "dtype": a.dtype.str, "shape": a.shape}
+
+
+def build_mmap_cache(dataset, path, max_size=None, num_workers=0):
+    r"""
+    Decode a dataset once into a single file to be memory-mapped by `MMapDataset`.
+
+    Images are stored as packed uint8 RGB pixels with an offset and shape index, and targets
+    in array form: annotations of objects (lists of COCO-style dicts) as the columns of
+    `BoxList` (other keys, like `segmentation`, are not stored), segmentation masks as
+    uint8 pixels and class labels as integers.
+
+    Parameters
+    ----------
+    dataset : ``Dataset``
+        Dataset of (PIL image, target) without random transforms.
+    path : ``str``
+        File to write. It is written to a temporary file first and then renamed.
+    max_size : ``int``
+        If given, images whose longer side exceeds it are downscaled, and so are
+        their boxes and masks.
+    num_workers : ``int``
+        Number of processes decoding the images.
+    """
+    path = Path(path).expanduser().absolute()
+    loader = DataLoader(_Decoded(dataset, max_size), batch_size=None, num_workers=num_workers,
+                        collate_fn=_identity)
+
+    n = len(dataset)
+    image_offsets = np.zeros(n, dtype=np.int64)
+    image_shapes = np.zeros((n, 3), dtype=np.int32)
+    mask_offsets = np.zeros(n, dtype=np.int64)
+    box_counts = np.zeros(n, dtype=np.int64)
+    boxes, labels, areas, iscrowd, targets = [], [], [], [], []
+    kind = None
+    fields = ()
+
+    tmp = tempfile.NamedTemporaryFile(delete=False, dir=path.parent)
+    try:
+        w = _Writer(tmp.file)
+        w.write_raw(_MAGIC)
+        for i, (img, target) in enumerate(loader):
+            if kind is None:
+                kind = _kind(target)
+            image_offsets[i] = w.write_raw(img.tobytes())
+            image_shapes[i] = img.shape
+            if kind == "detection":
+                box_counts[i] = len(target)
+                boxes.append(target.boxes.astype(np.float32))
+                labels.append(target.labels)
+                areas.append(target.areas.astype(np.float32))
+                iscrowd.append(target.iscrowd)
+                fields = target.fields or fields
+            elif kind == "segmentation":
+                mask_offsets[i] = w.write_raw(target.tobytes())
+            else:
+                targets.append(int(target))
+
+        w.write_array("image_offsets", image_offsets)
+        w.write_array("image_shapes", image_shapes)
+        if kind == "detection":
+            w.write_array("box_offsets", np.concatenate([[0], np.cumsum(box_counts)]))
+            w.write_array("boxes", np.concatenate(boxes).reshape(-1, 4))
+            w.write_array("labels", np.concatenate(labels).astype(np.int64))
+            w.write_array("areas", np.concatenate(areas))
+            w.write_array("iscrowd", np.concatenate(iscrowd).astype(np.uint8))
+        elif kind == "segmentation":
+            w.write_array("mask_offsets", mask_offsets)
+        else:
+            w.write_array("targets", np.array(targets, dtype=np.int64))
+
+        header = json.dumps({
+            "kind": kind, "length": n, "max_size": max_size,
+            "fields": list(fields), "arrays": w.arrays,
+        }).encode()
+        header_offset = w.write_raw(header)
+        tmp.file.write(struct.pack("<Q", header_offset) + _MAGIC)
+    except BaseException:
+        tmp.close()
+        os.remove(tmp.name)
+        raise
+    else:
+        tmp.close()
+        os.replace(tmp.name, path)
+
+
+class MMapDataset(Dataset):
+    r"""
+    Dataset served from a file built by `build_mmap_cache`.
+
+    The file is memory-mapped, so samples are read without decoding and the pages are
+    shared through the page cache by all workers. Images and masks are views of the mapping
+    (read-only), and boxes are `BoxList` of views.
+
+    Parameters
+    ----------
+    path : ``str``
+        Path of the cache file.
+    transform : ``callable``
+        A function/transform that takes in an image and its target and returns a transformed version.
+    to_pil : ``bool``
+        Whether to return PIL images (copies) as the original datasets, otherwise read-only
+        (H, W, 3) uint8 arrays.
+    """
+
+    def __init__(self, path, transform=None, to_pil=True):
+        self.path = Path(path).expanduser().absolute()
+        self.transform = transform
+        self.to_pil = to_pil
+        with open(self.path, 'rb') as f:
+            f.seek(-16, os.SEEK_END)
+            header_offset, magic = struct.unpack("<Q8s", f.read(16))
+            if magic != _MAGIC:
+                raise ValueError("%s is not a horch mmap cache" % self.path)
+            end = f.seek(0, os.SEEK_END) - 16
+            f.seek(header_offset)
+            self.header = json.loads(f.read(end - header_offset).decode())
+        self.kind = self.header['kind']
+        self._mm = None
+
+    def _array(self, name):
+        info = self.header['arrays'][name]
+        dtype = np.dtype(info['dtype'])
+        shape = tuple(info['shape'])
+        nbytes = int(np.prod(shape)) * dtype.itemsize
+        return self._mm[info['offset']:info['offset'] + nbytes].view(dtype).reshape(shape)
+
+    def _open(self):
+        self._mm = np.memmap(self.path, dtype=np.uint8, mode='r')
+        self.image_offsets = self._array("image_offsets")
+        self.image_shapes = self._array("image_shapes")
+        if self.kind == "detection":
+            self.box_offsets = self._array("box_offsets")
+            self.boxes = self._array("boxes")
+            self.labels = self._array("labels")
+            self.areas = self._array("areas")
+            self.iscrowd = self._array("iscrowd")
+        elif self.kind == "segmentation":
+            self.mask_offsets = self._array("mask_offsets")
+        else:
+            self.targets = self._array("targets")
+
+    def __getstate__(self):
+        # The mapping is reopened in each worker instead of being pickled
+        state = {k: v for k, v in self.__dict__.items() if not isinstance(v, np.ndarray)}
+        state['_mm'] = None
+        return state
+
+    def get_image(self, index):
+        if self._mm is None:
+            self._open()
+        shape = tuple(self.image_shapes[index])
+        offset = self.image_offsets[index]
+        img = self._mm[offset:offset + int(np.prod(shape))].reshape(shape)
+        return Image.fromarray(img) if self.to_pil else img
+
+    def get_target(self, index):
+        if self._mm is None:
+            self._open()
+        if self.kind == "detection":
+            s = slice(self.box_offsets[index], self.box_offsets[index + 1])
+            return BoxList(self.boxes[s], self.labels[s], self.areas[s], self.iscrowd[s],
+                           fields=self.header['fields'])
+        elif self.kind == "segmentation":
+            h, w = self.image_shapes[index][:2]
+            offset = self.mask_offsets[index]
+            mask = self._mm[offset:offset + h * w].reshape(h, w)
+            return Image.fromarray(mask) if self.to_pil else mask
+        return int(self.targets[index])
+
+    def __getitem__(self, index):
+        img, target = self.get_image(index), self.get_target(index)
+        if self.transform is not None:
+            img, target = self.transform(img, target)
+        return img, target
+
+    def __len__(self):
+        return self.header['length']
+
+    def __repr__(self):
+        fmt_str = 'Dataset ' + self.__class__.__name__ + '\n'
+        fmt_str += '    Number of datapoints: {}\n'.format(self.__len__())
+        fmt_str += '    Path: {}\n'.format(self.path)
+        tmp = '    Transforms (if any): '
+        fmt_str += '{0}{1}\n'.format(
+            tmp, self.transform.__repr__().replace('\n', '\n' + ' ' * len(tmp)))
+        return fmt_str
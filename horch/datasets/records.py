@@ -0,0 +1,253 @@
+import io
+import pickle
+import random
+import struct
+import sys
+
+import numpy as np
+from PIL import Image
+import torch.utils.data
+from torch.utils.data import Dataset, IterableDataset, DataLoader
+
+from horch.io import save_json, read_json, fmt_path
+
+_LEN = struct.Struct("<I")
+_INDEX = "index.json"
+
+
+def _identity(x):
+    return x
+
+
+def _encode_image(img, format, quality):
+    if isinstance(img, np.ndarray):
+        img = Image.fromarray(img)
+    if format is None:
+        if img.format in ['JPEG', 'PNG']:
+            format = img.format
+        else:
+            # Images from `convert('RGB')` have no format, photos are stored as JPEG
+            format = 'JPEG' if img.mode in ['RGB', 'L'] else 'PNG'
+    buf = io.BytesIO()
+    img.save(buf, format, quality=quality)
+    return buf.getvalue()
+
+
+def _decode_image(data):
+    img = Image.open(io.BytesIO(data))
+    img.load()
+    return img
+
+
+def _has_transform(dataset):
+    # Wrappers like `Subset` forward `get_image_file` to the datasets they wrap
+    while dataset is not None:
+        if getattr(dataset, 'transform', None) is not None:
+            return True
+        dataset = getattr(dataset, 'dataset', None)
+    return False
+
+
+class _Encoded(Dataset):
+    # Encodes in DataLoader workers, so only bytes are sent back
+
+    def __init__(self, dataset, format, quality):
+        self.dataset = dataset
+        self.format = format
+        self.quality = quality
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def _image_file(self, idx):
+        # The original file is stored unchanged if the dataset returns it as is in RGB
+        get_image_file = getattr(self.dataset, 'get_image_file', None)
+        if self.format is None and get_image_file is not None and not _has_transform(self.dataset):
+            return get_image_file(idx)
+        return None
+
+    def __getitem__(self, idx):
+        path = self._image_file(idx)
+        if path is not None:
+            with open(path, 'rb') as f:
+                img = f.read()
+            target, mode = self.dataset.get_target(idx), 'RGB'
+        else:
+            img, target = self.dataset[idx]
+            img, mode = _encode_image(img, self.format, self.quality), None
+        if isinstance(target, Image.Image):
+            sample = (img, _encode_image(target, 'PNG', None), True, mode)
+        else:
+            sample = (img, target, False, mode)
+        return pickle.dumps(sample, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def write_records(dataset, root, shard_size=1 << 28, format=None, quality=95, num_workers=0):
+    r"""
+    Pack a dataset into shard files of length-prefixed encoded samples to be streamed
+    by `RecordDataset`.
+
+    Shards are named ``00000.rec``, ``00001.rec``, ... and listed in ``index.json`` with
+    their number of samples, in the order of the dataset.
+
+    Parameters
+    ----------
+    dataset : ``Dataset``
+        Dataset of (image, target) without random transforms. Images may be PIL images or
+        arrays, targets any picklable object; PIL targets (segmentation masks) are stored as PNG.
+    root : ``str``
+        Directory to write the shards and the index to.
+    shard_size : ``int``
+        A new shard is started once the current one exceeds this number of bytes.
+    format : ``str``
+        Format to encode the images with. If not given, the original files are stored
+        unchanged for datasets with `get_image_file` and `get_target` (e.g. `VOCDetection`,
+        `CocoDetection`) and no transform. Otherwise, PNG and JPEG images keep their format,
+        and other RGB or grayscale images are stored as JPEG and the rest as PNG.
+    quality : ``int``
+        Quality of JPEG encoding.
+    num_workers : ``int``
+        Number of processes loading and encoding the samples.
+    """
+    root = fmt_path(root)
+    root.mkdir(parents=True, exist_ok=True)
+    loader = DataLoader(_Encoded(dataset, format, quality), batch_size=None, num_workers=num_workers,
+                        collate_fn=_identity)
+
+    shards = []
+    f = None
+    try:
+        for data in loader:
+            if f is None or f.tell() >= shard_size:
+                if f is not None:
+                    f.close()
+                shards.append({"file": "%05d.rec" % len(shards), "length": 0})
+                f = open(root / shards[-1]["file"], 'wb')
+            f.write(_LEN.pack(len(data)))
+            f.write(data)
+            shards[-1]["length"] += 1
+    finally:
+        if f is not None:
+            f.close()
+    save_json(root / _INDEX, {"length": sum(s["length"] for s in shards), "shards": shards})
+
+
+def _worker_info():
+    # horch.dataloader needs zmq, so its worker module is only looked up if already in use
+    worker = sys.modules.get("horch.dataloader.worker")
+    info = worker.get_worker_info() if worker is not None else None
+    return info or torch.utils.data.get_worker_info()
+
+
+class RecordDataset(IterableDataset):
+    r"""
+    Streams the samples of shard files written by `write_records`.
+
+    Each shard is read sequentially from start to end. With multiple workers, shards are split
+    among them, so there should be at least as many shards as workers. The dataset can be
+    wrapped by `Subset` and `Fullset`, in which case samples are still read in shard order
+    and the others are skipped.
+
+    Parameters
+    ----------
+    root : ``str``
+        Directory of the shards and the index.
+    transform : ``callable``
+        A function/transform that takes in an image and its target and returns a transformed version.
+    shuffle : ``bool``
+        Whether to shuffle the order of shards each epoch and the samples in a buffer.
+    buffer_size : ``int``
+        Number of encoded samples held in the shuffle buffer.
+    """
+
+    def __init__(self, root, transform=None, shuffle=False, buffer_size=1024):
+        self.root = fmt_path(root)
+        self.transform = transform
+        self.shuffle = shuffle
+        self.buffer_size = buffer_size
+        index = read_json(self.root / _INDEX)
+        self.shards = index["shards"]
+        self.length = index["length"]
+        self._epoch = 0
+
+    def _read_shard(self, shard, selected=None):
+        with open(self.root / shard["file"], 'rb', buffering=1 << 20) as f:
+            for i in range(shard["length"]):
+                n, = _LEN.unpack(f.read(_LEN.size))
+                if selected is None or i in selected:
+                    yield f.read(n)
+                else:
+                    f.seek(n, io.SEEK_CUR)
+
+    def _shuffled(self, records, rng):
+        buffer = []
+        for data in records:
+            if len(buffer) < self.buffer_size:
+                buffer.append(data)
+                continue
+            i = rng.randrange(len(buffer))
+            yield buffer[i]
+            buffer[i] = data
+        rng.shuffle(buffer)
+        yield from buffer
+
+    def _decode(self, data):
+        img, target, is_image, mode = pickle.loads(data)
+        img = _decode_image(img)
+        if mode is not None and img.mode != mode:
+            img = img.convert(mode)
+        if is_image:
+            target = _decode_image(target)
+        if self.transform is not None:
+            img, target = self.transform(img, target)
+        return img, target
+
+    def iterate(self, indices=None):
+        r"""
+        Iterate over the samples at `indices` (all by default) of this worker's shards.
+        """
+        starts = np.cumsum([0] + [s["length"] for s in self.shards])
+        selected = [None] * len(self.shards)
+        if indices is not None:
+            indices = np.sort(np.asarray(indices))
+            for i in range(len(self.shards)):
+                lo, hi = np.searchsorted(indices, starts[i:i + 2])
+                selected[i] = set((indices[lo:hi] - starts[i]).tolist())
+
+        order = list(range(len(self.shards)))
+        info = _worker_info()
+        epoch = self._epoch
+        self._epoch += 1
+        if self.shuffle:
+            # Workers share the base seed, so they agree on the order of shards
+            base_seed = info.seed - info.id if info is not None else random.getrandbits(32)
+            random.Random(base_seed + epoch).shuffle(order)
+        if info is not None:
+            order = order[info.id::info.num_workers]
+
+        def records():
+            for i in order:
+                if selected[i] is None or selected[i]:
+                    yield from self._read_shard(self.shards[i], selected[i])
+
+        records = records()
+        if self.shuffle:
+            records = self._shuffled(records, random.Random())
+        for data in records:
+            yield self._decode(data)
+
+    def __iter__(self):
+        return self.iterate()
+
+    def __len__(self):
+        return self.length
+
+    def __repr__(self):
+        fmt_str = 'Dataset ' + self.__class__.__name__ + '\n'
+        fmt_str += '    Number of datapoints: {}\n'.format(self.__len__())
+        fmt_str += '    Number of shards: {}\n'.format(len(self.shards))
+        fmt_str += '    Root Location: {}\n'.format(self.root)
+        tmp = '    Transforms (if any): '
+        fmt_str += '{0}{1}\n'.format(
+            tmp, self.transform.__repr__().replace('\n', '\n' + ' ' * len(tmp)))
+        return fmt_str
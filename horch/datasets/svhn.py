@@ -1,5 +1,4 @@
 import re
-import json
 import tarfile
 from pathlib import Path
 
@@ -7,6 +6,7 @@ from PIL import Image
 from torch.utils.data import Dataset
 from torchvision.datasets.utils import download_url
 from horch.datasets.utils import download_google_drive
+from horch.datasets.annotations import CocoAnnotations
 
 SPLIT_FILES = {
     "train": {
@@ -61,25 +61,19 @@ class SVHNDetection(Dataset):
         if download:
             self.download()
 
-        with open(self.ann_file, 'r') as f:
-            self.data = json.load(f)
-
-        from hpycocotools.coco import COCO
-        self.coco = COCO(self.data, verbose=False)
-        self.ids = list(self.coco.imgs.keys())
+        self.annotations = CocoAnnotations.from_file(self.ann_file)
+        self.ids = self.annotations.image_ids
 
     def to_coco(self, indices=None):
         if indices is None:
-            return self.data
-        ids = [self.ids[i] for i in indices]
-        images = self.coco.loadImgs(ids)
-        ann_ids = self.coco.getAnnIds(ids)
-        annotations = self.coco.loadAnns(ann_ids)
-        return {
-            **self.data,
-            "images": images,
-            "annotations": annotations,
-        }
+            return self.annotations.to_coco()
+        return self.annotations.subset(indices).to_coco()
+
+    def get_image_file(self, index):
+        return self.img_dir / self.annotations.file_name(index)
+
+    def get_target(self, index):
+        return self.annotations.anns(index)
 
     def __getitem__(self, index):
         """
@@ -90,14 +84,8 @@ class SVHNDetection(Dataset):
             tuple: (image, anns) where target is a dictionary of the XML tree.
         """
 
-        coco = self.coco
-        img_id = self.ids[index]
-        ann_ids = coco.getAnnIds(imgIds=img_id)
-        target = coco.loadAnns(ann_ids)
-
-        path = coco.loadImgs([img_id])[0]['file_name']
-
-        img = Image.open(self.img_dir / path).convert('RGB')
+        target = self.get_target(index)
+        img = Image.open(self.get_image_file(index)).convert('RGB')
         if self.transform is not None:
             img, target = self.transform(img, target)
 
@@ -6,6 +6,14 @@ import numpy as np
 from torchvision.datasets.utils import check_integrity
 
 
+def getitems(dataset, indices):
+    r"""Loads samples at `indices` with one call to `dataset.__getitems__` if
+    the dataset supports batched loading, otherwise one by one."""
+    if hasattr(dataset, "__getitems__"):
+        return dataset.__getitems__(indices)
+    return [dataset[i] for i in indices]
+
+
 def download_google_drive(url_or_id, root, filename, md5=None):
     match = re.match(
         r"https://drive.google.com/open\?id=(.*)", url_or_id)
@@ -1,6 +1,4 @@
 import bisect
-import copy
-import json
 import os
 import re
 from pathlib import Path
@@ -8,11 +6,11 @@ from pathlib import Path
 import xmltodict
 from PIL import Image
 from horch.datasets import get_backend
-from toolz.curried import groupby
 from torch.utils.data import Dataset
 from torchvision.datasets.utils import download_url, check_integrity
 
-from horch.datasets.utils import download_google_drive
+from horch.datasets.utils import download_google_drive, getitems
+from horch.datasets.annotations import CocoAnnotations
 
 # https://github.com/pytorch/vision/blob/master/torchvision/datasets/voc.py
 
@@ -140,26 +138,20 @@ class VOCDetection(Dataset):
         if download:
             self.download()
 
-        from hpycocotools.coco import COCO
-        with open(self.ann_file, 'r') as f:
-            self.data = json.load(f)
-
-        self.coco = COCO(self.data, verbose=False)
-        self.ids = list(self.coco.imgs.keys())
+        self.annotations = CocoAnnotations.from_file(self.ann_file)
+        self.ids = self.annotations.image_ids
         self.transform = transform
 
     def to_coco(self, indices=None):
         if indices is None:
-            return self.data
-        ids = [self.ids[i] for i in indices]
-        images = self.coco.loadImgs(ids)
-        ann_ids = self.coco.getAnnIds(ids)
-        annotations = self.coco.loadAnns(ann_ids)
-        return {
-            **self.data,
-            "images": images,
-            "annotations": annotations,
-        }
+            return self.annotations.to_coco()
+        return self.annotations.subset(indices).to_coco()
+
+    def get_image_file(self, index):
+        return self.image_dir / self.annotations.file_name(index)
+
+    def get_target(self, index):
+        return self.annotations.anns(index)
 
     def __getitem__(self, index):
         """
@@ -168,14 +160,8 @@ class VOCDetection(Dataset):
         Returns:
             tuple: Tuple (image, target). target is the object returned by ``coco.loadAnns``.
         """
-        coco = self.coco
-        img_id = self.ids[index]
-        ann_ids = coco.getAnnIds(imgIds=img_id)
-        anns = coco.loadAnns(ann_ids)
-
-        path = coco.loadImgs([img_id])[0]['file_name']
-
-        img = Image.open(self.image_dir / path).convert('RGB')
+        anns = self.get_target(index)
+        img = Image.open(self.get_image_file(index)).convert('RGB')
 
         if self.transform is not None:
             img, anns = self.transform(img, anns)
@@ -348,8 +334,7 @@ class VOCDetectionConcat(Dataset):
         assert len(datasets) > 0, 'datasets should not be an empty iterable'
         self.datasets = list(datasets)
         self.cumulative_sizes = self.cumsum(self.datasets)
-        self._data = merge_coco(datasets)
-        self._img_anns = groupby(lambda x: x['image_id'], self._data['annotations'])
+        self.annotations = merge_annotations(self.datasets)
 
     def __len__(self):
         return self.cumulative_sizes[-1]
@@ -366,45 +351,44 @@ class VOCDetectionConcat(Dataset):
             sample_idx = idx - self.cumulative_sizes[dataset_idx - 1]
 
         img = self.datasets[dataset_idx][sample_idx][0]
-        anns = self._img_anns[idx]
+        anns = self.annotations.anns(idx)
         return img, anns
 
-    def to_coco(self):
-        return copy.deepcopy(self._data)
+    def __getitems__(self, indices):
+        indices = [len(self) + idx if idx < 0 else idx for idx in indices]
+        # Group indices by the dataset they belong to, so that each dataset
+        # loads its part of the batch at once.
+        groups = {}
+        for i, idx in enumerate(indices):
+            dataset_idx = bisect.bisect_right(self.cumulative_sizes, idx)
+            offset = 0 if dataset_idx == 0 else self.cumulative_sizes[dataset_idx - 1]
+            groups.setdefault(dataset_idx, []).append((i, idx - offset))
+        imgs = [None] * len(indices)
+        for dataset_idx, group in groups.items():
+            samples = getitems(self.datasets[dataset_idx], [sample_idx for _, sample_idx in group])
+            for (i, _), sample in zip(group, samples):
+                imgs[i] = sample[0]
+        return [(img, self.annotations.anns(idx)) for img, idx in zip(imgs, indices)]
+
+    def to_coco(self, indices=None):
+        if indices is None:
+            return self.annotations.to_coco()
+        return self.annotations.subset(indices).to_coco()
+
+
+def _annotations(dataset):
+    if hasattr(dataset, "annotations"):
+        return dataset.annotations
+    return CocoAnnotations.from_coco(dataset.to_coco())
+
+
+def merge_annotations(datasets):
+    r"""
+    Concatenate the annotations of datasets as `CocoAnnotations`, renumbering the ids of
+    images and annotations after the first dataset.
+    """
+    return CocoAnnotations.concat([_annotations(ds) for ds in datasets])
 
 
 def merge_coco(datasets):
-    all_annotations = [ds.to_coco() for ds in datasets]
-    for i in range(len(all_annotations) - 1):
-        assert all_annotations[i]['categories'] == all_annotations[i + 1]['categories']
-    images = all_annotations[0]['images']
-    annotations = all_annotations[0]['annotations']
-
-    image_id = images[-1]['id'] + 1
-    ann_id = annotations[-1]['id'] + 1
-    for d in all_annotations[1:]:
-        d_images = d['images']
-        n = len(d_images)
-        assert [img['id'] for img in d_images] == list(range(n))
-        img_anns = groupby(lambda x: x['image_id'], d['annotations'])
-        for i in range(n):
-            img = d_images[i]
-            anns = img_anns[img['id']]
-            img = {
-                **img,
-                'id': image_id,
-            }
-            for ann in anns:
-                annotations.append({
-                    **ann,
-                    'id': ann_id,
-                    'image_id': image_id
-                })
-                ann_id += 1
-            image_id += 1
-            images.append(img)
-    return {
-        **all_annotations[0],
-        'images': images,
-        'annotations': annotations
-    }
+    return merge_annotations(datasets).to_coco()
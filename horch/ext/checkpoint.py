@@ -1,9 +1,125 @@
+import atexit
+import copy
 import os
 import tempfile
+import threading
+from collections.abc import Mapping
+from queue import Queue
 
 import torch
 
 
+def snapshot(obj):
+    r"""
+    Copy tensors in nested dicts, lists and tuples to CPU memory and deep copy
+    everything else, so that the result can be serialized while training goes on.
+    """
+    if torch.is_tensor(obj):
+        t = obj.detach()
+        return t.cpu() if t.is_cuda else t.clone()
+    elif isinstance(obj, Mapping):
+        # A shallow copy keeps the type, attributes and e.g. the default_factory of defaultdict
+        try:
+            copied = copy.copy(obj)
+            for k, v in obj.items():
+                copied[k] = snapshot(v)
+        except TypeError:
+            copied = {k: snapshot(v) for k, v in obj.items()}
+        return copied
+    elif isinstance(obj, (list, tuple)) and not hasattr(obj, '_fields'):
+        return obj.__class__(snapshot(x) for x in obj)
+    else:
+        return copy.deepcopy(obj)
+
+
+def atomic_save(obj, path):
+    dirname = os.path.dirname(os.path.abspath(path))
+    tmp = tempfile.NamedTemporaryFile(delete=False, dir=dirname)
+    try:
+        torch.save(obj, tmp.file)
+    except BaseException:
+        tmp.close()
+        os.remove(tmp.name)
+        raise
+    else:
+        tmp.close()
+        os.replace(tmp.name, path)
+
+
+def _write_loop(q, writer):
+    while True:
+        task = q.get()
+        try:
+            if task is None:
+                return
+            if writer.error is None:
+                fn, args = task
+                fn(*args)
+        except BaseException as e:
+            writer.error = e
+        finally:
+            q.task_done()
+
+
+class AsyncWriter:
+    r"""
+    Runs checkpoint writes on a background thread in submission order.
+
+    Parameters
+    ----------
+    max_pending : int
+        Maximum number of writes waiting in the queue. `submit` blocks when it is full,
+        which bounds the memory held by snapshots.
+
+    Notes
+    -----
+    An exception raised by a write is re-raised as RuntimeError by the next call
+    to `submit`, `flush` or `check`, and later writes are skipped until then.
+    Pending writes are flushed at interpreter exit.
+    """
+
+    def __init__(self, max_pending=2):
+        self.error = None
+        self._queue = Queue(maxsize=max_pending)
+        self._thread = threading.Thread(target=_write_loop, args=(self._queue, self))
+        self._thread.daemon = True
+        self._thread.start()
+        atexit.register(self.close)
+
+    def check(self):
+        if self.error is not None:
+            e, self.error = self.error, None
+            raise RuntimeError("Asynchronous checkpoint writing failed") from e
+
+    def submit(self, fn, *args):
+        self.check()
+        if not self._thread.is_alive():
+            raise RuntimeError("AsyncWriter is closed")
+        self._queue.put((fn, args))
+
+    def save(self, obj, path):
+        r"""
+        Snapshot `obj` on the calling thread and save it atomically to `path` in the background.
+        """
+        self.submit(atomic_save, snapshot(obj), path)
+
+    def flush(self):
+        self._queue.join()
+        self.check()
+
+    def close(self):
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        atexit.unregister(self.close)
+        self.check()
+
+
+def _remove(paths):
+    for p in paths:
+        os.remove(p)
+
+
 class ModelCheckpoint(object):
     """ ModelCheckpoint handler can be used to periodically save objects to disk.
 
@@ -44,6 +160,9 @@ class ModelCheckpoint(object):
             If True, will create directory 'dirname' if it doesnt exist.
         save_as_state_dict (bool, optional):
             If True, will save only the `state_dict` of the objects specified, otherwise the whole object will be saved.
+        writer (AsyncWriter, optional):
+            If not None, objects are snapshotted to CPU memory and written (always atomically)
+            and pruned on the writer's background thread. Call `writer.flush()` to wait for them.
 
     Notes:
           This handler expects two arguments: an `Engine` object and a `dict`
@@ -82,7 +201,8 @@ class ModelCheckpoint(object):
                  n_saved=1,
                  atomic=True, require_empty=True,
                  create_dir=True,
-                 save_as_state_dict=False):
+                 save_as_state_dict=False,
+                 writer=None):
 
         self._dirname = os.path.expanduser(dirname)
         self._fname_prefix = filename_prefix
@@ -95,6 +215,7 @@ class ModelCheckpoint(object):
         self._saved = []  # list of tuples (priority, saved_objects)
         self._iteration = 0
         self._save_as_state_dict = save_as_state_dict
+        self._writer = writer
 
         if not (save_interval is None) ^ (score_function is None):
             raise ValueError("Exactly one of `save_interval`, or `score_function` "
@@ -125,7 +246,13 @@ class ModelCheckpoint(object):
                                  "".format(filename_prefix, dirname))
 
     def _save(self, obj, path):
-        if not self._atomic:
+        if self._writer is not None:
+            if self._save_as_state_dict:
+                if not hasattr(obj, "state_dict") or not callable(obj.state_dict):
+                    raise ValueError("Object should have `state_dict` method")
+                obj = obj.state_dict()
+            self._writer.save(obj, path)
+        elif not self._atomic:
             self._internal_save(obj, path)
         else:
             tmp = tempfile.NamedTemporaryFile(delete=False, dir=self._dirname)
@@ -183,5 +310,8 @@ class ModelCheckpoint(object):
 
         if len(self._saved) > self._n_saved:
             _, paths = self._saved.pop(0)
-            for p in paths:
-                os.remove(p)
+            if self._writer is not None:
+                # Queued after the writes, so the files exist when they are removed
+                self._writer.submit(_remove, paths)
+            else:
+                _remove(paths)
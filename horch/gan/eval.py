@@ -1,3 +1,5 @@
+import hashlib
+import os
 from collections import Sequence
 from math import ceil
 
@@ -6,13 +8,18 @@ from scipy import linalg
 
 import torch
 import torch.nn.functional as F
-from torch.utils.data import DataLoader, Dataset, TensorDataset
+from torch.utils.data import DataLoader, Dataset, TensorDataset, BatchSampler, SequentialSampler
+from torch.utils.data.dataloader import default_collate
 from torchvision.transforms import Compose, Resize, ToTensor
 
 from horch.common import CUDA
 from horch.train._utils import to_device
 
 
+def _is_uint8_batch(imgs):
+    return isinstance(imgs, np.ndarray) and imgs.ndim == 4 and imgs.dtype == np.uint8
+
+
 class _ImageDataset(Dataset):
 
     def __init__(self, imgs, transform=None):
@@ -25,6 +32,13 @@ class _ImageDataset(Dataset):
             img = self.transform(img)
         return img,
 
+    def __getitems__(self, items):
+        if _is_uint8_batch(self.imgs) and self.transform is None:
+            # Same as ToTensor, but on the whole batch of (N, H, W, C) uint8 images
+            x = torch.from_numpy(self.imgs[items]).permute(0, 3, 1, 2).float().div_(255)
+            return [(t,) for t in x]
+        return [self[i] for i in items]
+
     def __len__(self):
         return len(self.imgs)
 
@@ -40,7 +54,7 @@ def batchify(tensors, batch_size=32):
         yield batch
 
 
-def batch_apply(inputs, model, func=lambda x: x, batch_size=32, device=None):
+def _batch_outputs(inputs, model, func=lambda x: x, batch_size=32, device=None):
     device = device or ('cuda' if CUDA else 'cpu')
 
     model.eval()
@@ -51,6 +65,11 @@ def batch_apply(inputs, model, func=lambda x: x, batch_size=32, device=None):
 
     if isinstance(inputs, Sequence) and all(torch.is_tensor(t) for t in inputs):
         it = batchify(inputs, batch_size=batch_size)
+    elif _is_uint8_batch(inputs):
+        ds = _ImageDataset(inputs)
+        # torch's DataLoader never calls __getitems__, so batches are fetched here
+        sampler = BatchSampler(SequentialSampler(ds), batch_size, drop_last=False)
+        it = (default_collate(ds.__getitems__(indices)) for indices in sampler)
     else:
         transforms = Compose([
             ToTensor()
@@ -58,18 +77,24 @@ def batch_apply(inputs, model, func=lambda x: x, batch_size=32, device=None):
         ds = _ImageDataset(inputs, transforms)
         it = DataLoader(ds, batch_size=batch_size)
 
-    preds = []
     for batch in it:
         x = to_device(batch, device)
         if torch.is_tensor(x):
             x = (x,)
         with torch.no_grad():
-            p = func(model(*x))
-        preds.append(p)
+            yield func(model(*x))
+
+
+def batch_apply(inputs, model, func=lambda x: x, batch_size=32, device=None):
+    preds = list(_batch_outputs(inputs, model, func, batch_size, device))
     preds = torch.cat(preds, dim=0)
     return preds
 
 
+def _xlogx(p):
+    return p * p.clamp(min=1e-300).log()
+
+
 def inception_score(imgs, model, batch_size=32, device=None):
     r"""
     Parameters
@@ -78,20 +103,139 @@ def inception_score(imgs, model, batch_size=32, device=None):
         `imgs` could be a list of PIL Images or uint8 ndarray of shape (N, H, W, C)
         or a float tensor of shape (N, C, H, W)
     """
-    pyxs = batch_apply(imgs, model, lambda p: F.softmax(p, dim=1), batch_size, device)
-    py = torch.mean(pyxs, dim=0)
-    score = (pyxs * (pyxs / py).log_()).sum(dim=1).mean().exp().item()
+    # exp(E[KL(p(y|x) || p(y))]) = exp(E[sum p(y|x) log p(y|x)] - sum p(y) log p(y)),
+    # so only sums over batches are kept
+    n, neg_entropy, py = 0, 0, 0
+    for pyxs in _batch_outputs(imgs, model, lambda p: F.softmax(p.double(), dim=1), batch_size, device):
+        n += len(pyxs)
+        neg_entropy = neg_entropy + _xlogx(pyxs).sum()
+        py = py + pyxs.sum(dim=0)
+    py = py / n
+    score = (neg_entropy / n - _xlogx(py).sum()).exp().item()
     return score
 
 
+class RunningStatistics:
+    r"""
+    Mean and covariance of features accumulated batch by batch, with the parallel update of
+    Chan et al., so that features are never held all at once.
+
+    Sums are kept in float64 on the device of the first batch.
+    """
+
+    def __init__(self):
+        self.n = 0
+        self._mean = None
+        self._m2 = None
+
+    def update(self, x):
+        r"""
+        Parameters
+        ----------
+        x : torch.Tensor
+            (N, D) features of a batch.
+        """
+        x = x.detach().reshape(len(x), -1).double()
+        nb = len(x)
+        if nb == 0:
+            return
+        mean_b = x.mean(dim=0)
+        d = x - mean_b
+        m2_b = d.t() @ d
+        if self.n == 0:
+            self._mean, self._m2 = mean_b, m2_b
+        else:
+            n = self.n + nb
+            delta = mean_b.to(self._mean.device) - self._mean
+            self._mean += delta * (nb / n)
+            self._m2 += m2_b.to(self._m2.device) + (delta[:, None] * delta[None, :]) * (self.n * nb / n)
+        self.n += nb
+
+    @property
+    def mean(self):
+        return self._mean.cpu().numpy()
+
+    @property
+    def cov(self):
+        return (self._m2 / (self.n - 1)).cpu().numpy()
+
+
 def calculate_activation_statistics(imgs, model, batch_size=32, device=None):
-    preds = batch_apply(imgs, model, lambda x: x, batch_size, device).cpu().numpy()
-    mu = np.mean(preds, axis=0)
-    sigma = np.cov(preds, rowvar=False)
+    stats = RunningStatistics()
+    for preds in _batch_outputs(imgs, model, lambda x: x, batch_size, device):
+        stats.update(preds)
+    return stats.mean, stats.cov
+
+
+def _images_key(imgs):
+    h = hashlib.sha1()
+    if isinstance(imgs, np.ndarray) or torch.is_tensor(imgs):
+        x = imgs.cpu().numpy() if torch.is_tensor(imgs) else imgs
+        h.update(repr((x.shape, str(x.dtype))).encode())
+        h.update(np.ascontiguousarray(x).data)
+    else:
+        for img in imgs:
+            h.update(np.asarray(img).tobytes())
+    return h.hexdigest()
+
+
+def _model_key(model):
+    h = hashlib.sha1(type(model).__name__.encode())
+    for k, v in model.state_dict().items():
+        h.update(k.encode())
+        h.update(v.detach().cpu().numpy().tobytes())
+    return h.hexdigest()
+
+
+def cached_activation_statistics(imgs, model, cache_dir=None, key=None, batch_size=32, device=None):
+    r"""
+    `calculate_activation_statistics` of reference images, e.g., the training set, saved to
+    disk and loaded in the following calls.
+
+    Parameters
+    ----------
+    imgs : List[Image] or ndarray or tensor
+        Reference images, as in `calculate_activation_statistics`.
+    model : nn.Module
+        Feature extractor, e.g., `FIDInceptionV3`.
+    cache_dir : str
+        Directory of the cache, default to ``~/.cache/horch/fid``.
+    key : str
+        Identity of the images, e.g., the name, split and transform of the dataset. If not
+        given, it is computed from the pixels. The weights of `model` are always part of
+        the key.
+    """
+    cache_dir = os.path.expanduser(cache_dir or os.path.join("~", ".cache", "horch", "fid"))
+    images_key = key if key is not None else _images_key(imgs)
+    name = hashlib.sha1((images_key + _model_key(model)).encode()).hexdigest()
+    path = os.path.join(cache_dir, name + ".npz")
+    if os.path.exists(path):
+        with np.load(path) as f:
+            return f['mu'], f['sigma']
+    mu, sigma = calculate_activation_statistics(imgs, model, batch_size, device)
+    os.makedirs(cache_dir, exist_ok=True)
+    # Written to a temporary file first, so an interrupted save is never loaded
+    tmp = path + ".tmp.npz"
+    np.savez(tmp, mu=mu, sigma=sigma)
+    os.replace(tmp, path)
     return mu, sigma
 
 
-def calculate_frechet_distance(mu1, sigma1, mu2, sigma2, eps=1e-6):
+def trace_sqrt_product(sigma1, sigma2):
+    r"""
+    Tr(sqrt(sigma1 sigma2)) of two covariance matrices.
+
+    The eigenvalues of sigma1 sigma2 are those of sqrt(sigma1) sigma2 sqrt(sigma1), which is
+    symmetric, so two `eigh` are needed instead of a general matrix square root.
+    """
+    w, v = linalg.eigh(sigma1)
+    sqrt1 = (v * np.sqrt(np.clip(w, 0, None))) @ v.T
+    m = sqrt1 @ sigma2 @ sqrt1
+    ev = linalg.eigvalsh((m + m.T) / 2)
+    return np.sqrt(np.clip(ev, 0, None)).sum()
+
+
+def calculate_frechet_distance(mu1, sigma1, mu2, sigma2, eps=1e-6, method='eig'):
     """Numpy implementation of the Frechet Distance.
     The Frechet distance between two multivariate Gaussians X_1 ~ N(mu_1, C_1)
     and X_2 ~ N(mu_2, C_2) is
@@ -106,6 +250,7 @@ def calculate_frechet_distance(mu1, sigma1, mu2, sigma2, eps=1e-6):
     -- sigma1: The covariance matrix over activations for generated samples.
     -- sigma2: The covariance matrix over activations, precalculated on an
                representative data set.
+    -- method: 'eig' for `trace_sqrt_product`, or 'sqrtm' for scipy.linalg.sqrtm.
     Returns:
     --   : The Frechet Distance.
     """
@@ -117,6 +262,9 @@ def calculate_frechet_distance(mu1, sigma1, mu2, sigma2, eps=1e-6):
 
     diff = mu1 - mu2
 
+    if method == 'eig':
+        return diff.dot(diff) + np.trace(sigma1) + np.trace(sigma2) - 2 * trace_sqrt_product(sigma1, sigma2)
+
     # Product might be almost singular
     covmean, _ = linalg.sqrtm(sigma1.dot(sigma2), disp=False)
     if not np.isfinite(covmean).all():
@@ -0,0 +1,311 @@
+from math import sqrt
+
+import numpy as np
+import torch
+
+from horch.common import CUDA
+from horch.io import fmt_path, read_json, save_json
+
+__all__ = ["KNNIndex", "IVFIndex"]
+
+
+def _flatten(x):
+    if torch.is_tensor(x):
+        x = x.cpu().numpy()
+    x = np.asarray(x)
+    return x.reshape(len(x), -1)
+
+
+def _pairwise(q, x, metric, x_sq=None):
+    # (Q, N) distances, squared for l2, computed by one matrix multiplication
+    if metric == 'l2':
+        if x_sq is None:
+            x_sq = (x * x).sum(dim=1)
+        d = (q * q).sum(dim=1)[:, None] - 2 * (q @ x.t()) + x_sq[None, :]
+        return d.clamp_(min=0)
+    return torch.cdist(q, x, p=1)
+
+
+def _merge(best_d, best_i, d, ids, k):
+    d = torch.cat([best_d, d], dim=1)
+    i = torch.cat([best_i, ids[None, :].expand(len(d), -1)], dim=1)
+    k = min(k, d.size(1))
+    d, pos = d.topk(k, dim=1, largest=False)
+    return d, i.gather(1, pos)
+
+
+class KNNIndex:
+    r"""
+    Exact k-nearest-neighbor search, e.g., of generated samples in the training set to check
+    memorization of GANs.
+
+    The database is kept in its dtype (e.g., uint8 pixels) and converted to float32 in chunks
+    on `device`. L2 distances are computed by matrix multiplication with precomputed norms,
+    and the distances of the final neighbors are recomputed exactly.
+
+    Parameters
+    ----------
+    data : ndarray or tensor
+        (N, ...) images or features (e.g., from `FIDInceptionV3`), flattened.
+    metric : str
+        ``l1`` or ``l2``.
+    device : str
+        Device of the computation, default to cuda if available.
+    """
+
+    def __init__(self, data, metric='l2', device=None):
+        assert metric in ['l1', 'l2']
+        self.data = _flatten(data)
+        self.metric = metric
+        self.device = device or ('cuda' if CUDA else 'cpu')
+        self.sq_norms = None
+        self.ids = None
+
+    def __len__(self):
+        return len(self.data)
+
+    def _rows(self, start, end):
+        # Positions of `IVFIndex` are mapped to rows of the database by `ids`
+        rows = slice(start, end) if self.ids is None else self.ids[start:end]
+        x = np.ascontiguousarray(self.data[rows])
+        return torch.from_numpy(x).to(self.device).float()
+
+    def _sq_norms(self, chunk_size):
+        if self.sq_norms is None:
+            self.sq_norms = np.concatenate([
+                (self._rows(s, s + chunk_size) ** 2).sum(dim=1).cpu().numpy()
+                for s in range(0, len(self), chunk_size)] or [np.zeros(0, dtype=np.float32)])
+        return self.sq_norms
+
+    def _chunk_size(self, max_elements):
+        return max(max_elements // max(self.data.shape[1], 1), 1)
+
+    def _search_range(self, q, k, start, end, chunk_size, best_d, best_i):
+        sq_norms = self._sq_norms(chunk_size) if self.metric == 'l2' else None
+        for s in range(start, end, chunk_size):
+            e = min(s + chunk_size, end)
+            x_sq = torch.from_numpy(sq_norms[s:e]).to(self.device) if sq_norms is not None else None
+            d = _pairwise(q, self._rows(s, e), self.metric, x_sq)
+            ids = torch.arange(s, e, device=self.device)
+            best_d, best_i = _merge(best_d, best_i, d, ids, k)
+        return best_d, best_i
+
+    def _rerank(self, q, best_i):
+        # Exact distances, as the matrix multiplication loses precision for large norms
+        valid = best_i >= 0
+        if self.ids is not None:
+            best_i = torch.where(valid, torch.from_numpy(self.ids).to(self.device)[best_i.clamp(min=0)], best_i)
+        idx = best_i.clamp(min=0).cpu().numpy()
+        x = torch.from_numpy(self.data[idx.reshape(-1)].reshape(*idx.shape, -1)).to(self.device).float()
+        diff = q[:, None, :] - x
+        if self.metric == 'l2':
+            d = diff.pow(2).sum(dim=-1).sqrt()
+        else:
+            d = diff.abs().sum(dim=-1)
+        d = d.masked_fill(~valid, float('inf'))
+        d, order = d.sort(dim=1)
+        best_i = best_i.gather(1, order)
+        return best_i.cpu().numpy(), d.cpu().numpy()
+
+    def _init_best(self, n, k):
+        best_d = torch.full((n, 0), float('inf'), device=self.device)
+        best_i = torch.full((n, 0), -1, dtype=torch.long, device=self.device)
+        return best_d, best_i
+
+    def _pad(self, best_d, best_i, k):
+        n, m = best_d.shape
+        if m < k:
+            best_d = torch.cat([best_d, best_d.new_full((n, k - m), float('inf'))], dim=1)
+            best_i = torch.cat([best_i, best_i.new_full((n, k - m), -1)], dim=1)
+        return best_d, best_i
+
+    def _search_batch(self, q, k, chunk_size):
+        best_d, best_i = self._init_best(len(q), k)
+        return self._search_range(q, k, 0, len(self), chunk_size, best_d, best_i)
+
+    def search(self, queries, k=5, batch_size=256, max_elements=1 << 26):
+        r"""
+        Parameters
+        ----------
+        queries : ndarray or tensor
+            (Q, ...) queries of the same size as the data.
+        k : int
+            Number of neighbors.
+        batch_size : int
+            Number of queries processed at once.
+        max_elements : int
+            Maximal number of elements of a chunk of the database transferred at once.
+
+        Returns
+        -------
+        indices : ndarray
+            (Q, k) indices of the neighbors, sorted by distances, -1 if not found.
+        distances : ndarray
+            (Q, k) distances of the neighbors.
+        """
+        return self._search(queries, k, batch_size, max_elements)
+
+    def _search(self, queries, k, batch_size, max_elements, **options):
+        queries = _flatten(queries)
+        chunk_size = self._chunk_size(max_elements)
+        indices, distances = [], []
+        for s in range(0, len(queries), batch_size):
+            q = torch.from_numpy(np.ascontiguousarray(queries[s:s + batch_size])).to(self.device).float()
+            best_d, best_i = self._pad(*self._search_batch(q, k, chunk_size, **options), k)
+            i, d = self._rerank(q, best_i)
+            indices.append(i)
+            distances.append(d)
+        if not indices:
+            return np.zeros((0, k), dtype=np.int64), np.zeros((0, k), dtype=np.float32)
+        return np.concatenate(indices), np.concatenate(distances)
+
+    def _meta(self):
+        return {"type": type(self).__name__, "metric": self.metric}
+
+    def _arrays(self):
+        self._sq_norms(self._chunk_size(1 << 26))
+        arrays = {"data": self.data, "sq_norms": self.sq_norms}
+        if self.ids is not None:
+            arrays["ids"] = self.ids
+        return arrays
+
+    def save(self, root):
+        r"""
+        Save the index to the directory `root`, so that norms (and clusters of `IVFIndex`)
+        are computed only once.
+        """
+        root = fmt_path(root)
+        root.mkdir(parents=True, exist_ok=True)
+        if (root / "meta.json").exists():
+            (root / "meta.json").unlink()
+        meta = self._meta()
+        arrays = self._arrays()
+        for name, a in arrays.items():
+            np.save(root / (name + ".npy"), a)
+        meta["arrays"] = list(arrays)
+        # Written last, so an index interrupted while saving is never read
+        save_json(root / "meta.json", meta)
+
+    @staticmethod
+    def load(root, mmap=True, device=None):
+        r"""
+        Load an index saved by `save`. With `mmap`, the database is memory-mapped and only
+        read in chunks while searching.
+        """
+        root = fmt_path(root)
+        meta = read_json(root / "meta.json")
+        mmap_mode = 'r' if mmap else None
+        arrays = {name: np.load(root / (name + ".npy"), mmap_mode=mmap_mode) for name in meta["arrays"]}
+        cls = IVFIndex if meta["type"] == "IVFIndex" else KNNIndex
+        index = cls.__new__(cls)
+        index.metric = meta["metric"]
+        index.device = device or ('cuda' if CUDA else 'cpu')
+        index.data = arrays["data"]
+        index.sq_norms = np.asarray(arrays["sq_norms"])
+        index.ids = np.asarray(arrays["ids"]) if "ids" in arrays else None
+        if cls is IVFIndex:
+            index.centroids = np.asarray(arrays["centroids"])
+            index.offsets = np.asarray(arrays["offsets"])
+            index.nprobe = meta["nprobe"]
+        return index
+
+    def __repr__(self):
+        return "%s(num_items=%d, dim=%d, metric=%s)" % (
+            type(self).__name__, len(self), self.data.shape[1], self.metric)
+
+
+def _kmeans(x, num_clusters, iters, seed):
+    rng = np.random.RandomState(seed)
+    init = torch.from_numpy(rng.choice(len(x), num_clusters, replace=False)).to(x.device)
+    centroids = x[init].clone()
+    for _ in range(iters):
+        assign = _pairwise(x, centroids, 'l2').argmin(dim=1)
+        sums = torch.zeros_like(centroids).index_add_(0, assign, x)
+        counts = torch.bincount(assign, minlength=num_clusters)
+        nonempty = counts > 0
+        # Empty clusters keep their centroids
+        centroids[nonempty] = sums[nonempty] / counts[nonempty].to(x)[:, None]
+    return centroids
+
+
+class IVFIndex(KNNIndex):
+    r"""
+    Approximate k-nearest-neighbor search with an inverted file index, for databases of
+    millions of items.
+
+    Items are clustered by k-means on a sample. The database is not copied (it may be
+    memory-mapped), only the ids of the items sorted by cluster are kept, and the items of a
+    cluster are gathered while searching. A query is only compared with the items of the
+    `nprobe` clusters of the nearest centroids, so neighbors in other clusters may be missed.
+
+    Parameters
+    ----------
+    data : ndarray or tensor
+        (N, ...) images or features, flattened.
+    metric : str
+        ``l1`` or ``l2``. Clusters are always built with L2.
+    num_lists : int
+        Number of clusters, default to sqrt(N).
+    nprobe : int
+        Default number of clusters searched for every query.
+    iters : int
+        Iterations of k-means.
+    sample_size : int
+        Number of items sampled for k-means, default to 256 per cluster.
+    device : str
+        Device of the computation, default to cuda if available.
+    seed : int
+        Seed of the sampling of k-means.
+    """
+
+    def __init__(self, data, metric='l2', num_lists=None, nprobe=8, iters=10, sample_size=None,
+                 device=None, seed=0):
+        super().__init__(data, metric, device)
+        n = len(self.data)
+        num_lists = min(num_lists or max(int(sqrt(n)), 1), n)
+        sample_size = min(sample_size or num_lists * 256, n)
+        rng = np.random.RandomState(seed)
+        sample = np.sort(rng.choice(n, sample_size, replace=False))
+        x = torch.from_numpy(np.ascontiguousarray(self.data[sample])).to(self.device).float()
+        centroids = _kmeans(x, num_lists, iters, seed)
+
+        chunk_size = self._chunk_size(1 << 26)
+        assign = np.concatenate([
+            _pairwise(self._rows(s, s + chunk_size), centroids, 'l2').argmin(dim=1).cpu().numpy()
+            for s in range(0, n, chunk_size)])
+        order = np.argsort(assign, kind='stable')
+        self.offsets = np.zeros(num_lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assign, minlength=num_lists), out=self.offsets[1:])
+        # Ids are increasing within a cluster, so its items are read in the order of the database
+        self.ids = order
+        self.centroids = centroids.cpu().numpy()
+        self.nprobe = nprobe
+
+    def _search_batch(self, q, k, chunk_size, nprobe=None):
+        nprobe = min(nprobe or self.nprobe, len(self.centroids))
+        centroids = torch.from_numpy(self.centroids).to(self.device)
+        probes = _pairwise(q, centroids, 'l2').topk(nprobe, dim=1, largest=False)[1].cpu().numpy()
+        best_d, best_i = self._pad(*self._init_best(len(q), k), k)
+        for l in np.unique(probes).tolist():
+            rows = torch.from_numpy(np.flatnonzero((probes == l).any(axis=1))).to(self.device)
+            d, i = self._search_range(q[rows], k, self.offsets[l], self.offsets[l + 1], chunk_size,
+                                      best_d[rows], best_i[rows])
+            best_d[rows], best_i[rows] = d, i
+        return best_d, best_i
+
+    def search(self, queries, k=5, batch_size=256, max_elements=1 << 26, nprobe=None):
+        r"""
+        Same as `KNNIndex.search`, with `nprobe` overriding the default of the index.
+        """
+        return self._search(queries, k, batch_size, max_elements, nprobe=nprobe)
+
+    def _meta(self):
+        meta = super()._meta()
+        meta["nprobe"] = self.nprobe
+        return meta
+
+    def _arrays(self):
+        arrays = super()._arrays()
+        arrays["centroids"] = self.centroids
+        arrays["offsets"] = self.offsets
+        return arrays
@@ -1,7 +1,7 @@
-from math import ceil
-
 import numpy as np
 
+from horch.gan.knn import KNNIndex
+
 
 def l1_norm(x, xs):
     ds = np.linalg.norm(xs - x, ord=1, axis=1)
@@ -17,35 +17,30 @@ def knn(x, xs, k=5, batch_size=10000, dist='l2'):
     r"""
     Calculate k-nearest-neighbors.
 
+    For many queries, or to reuse the database, build a `horch.gan.knn.KNNIndex` (or
+    `IVFIndex`) once instead.
+
     Parameters
     ----------
     x : ndarray
-        Pixel array of the image.
+        Pixel array of the image, or a batch of them.
     xs : ndarray
         Pixel arrays of images.
     k : int
         Number of neighbors.
     batch_size : int
-        Mini-batch size.
-    dist : function
-        Function used to calculate the distance of two images.
+        Mini-batch size of `xs`.
+    dist : str
+        Distance of two images, ``l1`` or ``l2``.
     """
     assert dist in ['l1', 'l2']
-    if dist == 'l1':
-        dist = l1_norm
-    elif dist == 'l2':
-        dist = l2_norm
-
-    n = len(xs)
-    x = x.reshape(-1).astype(np.int8)
-    xs = xs.reshape(n, -1).astype(np.int8)
-    n_batches = ceil(n / batch_size)
-
-    dists = []
-    for i in range(n_batches):
-        start = i * batch_size
-        end = min(n, (i+1) * batch_size)
-        dists.append(dist(x, xs[start:end]))
-    dists = np.concatenate(dists)
-    indices = np.argpartition(dists, k)[:k]
-    return indices, dists[indices]
\ No newline at end of file
+    xs = np.asarray(xs)
+    x = np.asarray(x)
+    single = x.ndim != xs.ndim
+    if single:
+        x = x[None]
+    index = KNNIndex(xs, metric=dist)
+    indices, dists = index.search(x, k=k, max_elements=batch_size * index.data.shape[1])
+    if single:
+        return indices[0], dists[0]
+    return indices, dists
@@ -0,0 +1,271 @@
+from collections.abc import Sequence
+from functools import lru_cache
+
+import torch
+
+from horch.boxes import box_iou, encode
+
+__all__ = ["AnchorGenerator", "pad_boxes", "match_iou", "match_atss", "assign"]
+
+
+def _per_level(x, n):
+    if isinstance(x[0], Sequence):
+        assert len(x) == n, "Expect %d levels, got %d" % (n, len(x))
+        return tuple(tuple(v) for v in x)
+    return (tuple(x),) * n
+
+
+@lru_cache(maxsize=16)
+def _anchors(feature_sizes, strides, scales, ratios, octave_base):
+    levels = []
+    for (w, h), stride, level_scales, level_ratios in zip(feature_sizes, strides, scales, ratios):
+        sizes = torch.tensor([octave_base * stride * s for s in level_scales], dtype=torch.float64)
+        ratios_t = torch.tensor(level_ratios, dtype=torch.float64).sqrt()
+        # Ordered by ratio, then scale
+        aw = (ratios_t[:, None] * sizes[None, :]).flatten()
+        ah = (sizes[None, :] / ratios_t[:, None]).flatten()
+        cx = (torch.arange(w, dtype=torch.float64) + 0.5) * stride
+        cy = (torch.arange(h, dtype=torch.float64) + 0.5) * stride
+        # (W, H, A), the layout of predictions from `to_pred`
+        cx = cx[:, None, None].expand(w, h, len(aw))
+        cy = cy[None, :, None].expand(w, h, len(aw))
+        anchors = torch.stack([cx - aw / 2, cy - ah / 2, cx + aw / 2, cy + ah / 2], dim=-1)
+        levels.append(anchors.reshape(-1, 4))
+    return torch.cat(levels).float()
+
+
+class AnchorGenerator:
+    r"""
+    Generates anchors of feature maps of multiple levels, in the order of the predictions of
+    detection heads (`RetinaHead`, `SSDHead`, `ConvHead`) flattened and concatenated.
+
+    Anchors are computed once for each combination of feature sizes, strides, scales and
+    ratios, and cached (also per device). The returned tensors are shared and must not be
+    modified in place.
+
+    Parameters
+    ----------
+    strides : ``Sequence[int]``
+        Strides of the levels, e.g., ``(8, 16, 32, 64, 128)``.
+    scales : ``Sequence[float]``
+        Scales of anchors relative to ``octave_base * stride``, for all levels or a sequence
+        for every level.
+    ratios : ``Sequence[float]``
+        Aspect ratios (w / h), for all levels or a sequence for every level.
+    octave_base : ``float``
+        Size of anchors of scale 1, in units of strides.
+    """
+
+    def __init__(self, strides, scales=(1, 2 ** (1 / 3), 2 ** (2 / 3)), ratios=(0.5, 1, 2), octave_base=4):
+        self.strides = tuple(strides)
+        n = len(self.strides)
+        self.scales = _per_level(scales, n)
+        self.ratios = _per_level(ratios, n)
+        self.octave_base = octave_base
+        self._cache = {}
+
+    @property
+    def num_anchors(self):
+        r"""
+        Number of anchors per location of every level, as `num_anchors` of heads.
+        """
+        return tuple(len(s) * len(r) for s, r in zip(self.scales, self.ratios))
+
+    def num_anchors_per_level(self, feature_sizes):
+        return [w * h * a for (w, h), a in zip(feature_sizes, self.num_anchors)]
+
+    def __call__(self, feature_sizes, device='cpu'):
+        r"""
+        Parameters
+        ----------
+        feature_sizes : ``Sequence[Tuple[int, int]]``
+            Sizes (w, h) of the feature maps.
+        device : ``torch.device``
+            Device to put the anchors on.
+
+        Returns
+        -------
+        anchors : ``torch.Tensor``
+            (N, 4) anchors of [l, t, r, b].
+        """
+        feature_sizes = tuple(tuple(int(x) for x in s) for s in feature_sizes)
+        key = (feature_sizes, torch.device(device))
+        anchors = self._cache.get(key)
+        if anchors is None:
+            anchors = _anchors(feature_sizes, self.strides, self.scales, self.ratios, self.octave_base)
+            anchors = anchors.to(device)
+            self._cache[key] = anchors
+        return anchors
+
+    def __getstate__(self):
+        # Don't send cached tensors to DataLoader workers
+        state = self.__dict__.copy()
+        state['_cache'] = {}
+        return state
+
+    def __repr__(self):
+        return "AnchorGenerator(strides=%s, num_anchors=%s)" % (self.strides, self.num_anchors)
+
+
+def pad_boxes(boxes, labels=None):
+    r"""
+    Pad boxes of images to a batch.
+
+    Parameters
+    ----------
+    boxes : ``Sequence[torch.Tensor]``
+        (M_i, 4) boxes of every image.
+    labels : ``Sequence[torch.Tensor]``
+        (M_i,) labels of every image.
+
+    Returns
+    -------
+    boxes : ``torch.Tensor``
+        (B, M, 4) boxes, where M is the maximal M_i.
+    labels : ``torch.Tensor``
+        (B, M) labels, padded with 0. Only returned if `labels` is given.
+    mask : ``torch.Tensor``
+        (B, M) mask of real boxes.
+    """
+    b = len(boxes)
+    m = max([len(x) for x in boxes] + [1])
+    padded = boxes[0].new_zeros((b, m, 4))
+    mask = torch.zeros((b, m), dtype=torch.bool, device=padded.device)
+    padded_labels = torch.zeros((b, m), dtype=torch.long, device=padded.device)
+    for i, x in enumerate(boxes):
+        padded[i, :len(x)] = x
+        mask[i, :len(x)] = True
+        if labels is not None:
+            padded_labels[i, :len(x)] = labels[i]
+    if labels is not None:
+        return padded, padded_labels, mask
+    return padded, mask
+
+
+def _low_quality(matched, ious):
+    # Each gt is also matched to the anchors of its highest IoU, even if below the threshold
+    gt_max = ious.max(dim=2, keepdim=True)[0]
+    best = (ious == gt_max) & (gt_max > 0)
+    has = best.any(dim=1)
+    idx = (best.float() * ious).argmax(dim=1)
+    return torch.where(has, idx, matched)
+
+
+def match_iou(anchors, gt_boxes, mask, pos_thresh=0.5, neg_thresh=0.4, low_quality=True):
+    r"""
+    Match anchors to ground truth by IoU thresholds, for a batch at once.
+
+    Parameters
+    ----------
+    anchors : ``torch.Tensor``
+        (N, 4) anchors.
+    gt_boxes : ``torch.Tensor``
+        (B, M, 4) padded boxes of ground truth.
+    mask : ``torch.Tensor``
+        (B, M) mask of real boxes.
+    pos_thresh : ``float``
+        Anchors of IoU not less than it are positive.
+    neg_thresh : ``float``
+        Anchors of IoU less than it are negative, others are ignored.
+    low_quality : ``bool``
+        Whether to also match each ground truth to the anchors of its highest IoU.
+
+    Returns
+    -------
+    matched : ``torch.Tensor``
+        (B, N) index of the matched ground truth, -1 for negative and -2 for ignored anchors.
+    """
+    ious = box_iou(gt_boxes, anchors)
+    ious = ious.masked_fill(~mask[:, :, None], -1)
+    max_ious, matched = ious.max(dim=1)
+    matched = matched.masked_fill(max_ious < pos_thresh, -2)
+    matched = matched.masked_fill(max_ious < neg_thresh, -1)
+    if low_quality:
+        matched = _low_quality(matched, ious)
+    return matched
+
+
+def match_atss(anchors, gt_boxes, mask, num_anchors_per_level, topk=9):
+    r"""
+    Match anchors to ground truth by Adaptive Training Sample Selection, for a batch at once.
+
+    For each ground truth, the `topk` anchors closest to its center are selected on every
+    level, and those whose IoU is at least the mean plus the standard deviation of the IoUs of
+    the candidates and whose centers are inside it are positive.
+
+    Parameters
+    ----------
+    anchors : ``torch.Tensor``
+        (N, 4) anchors.
+    gt_boxes : ``torch.Tensor``
+        (B, M, 4) padded boxes of ground truth.
+    mask : ``torch.Tensor``
+        (B, M) mask of real boxes.
+    num_anchors_per_level : ``Sequence[int]``
+        Number of anchors of every level, from `AnchorGenerator.num_anchors_per_level`.
+    topk : ``int``
+        Number of candidates on each level.
+
+    Returns
+    -------
+    matched : ``torch.Tensor``
+        (B, N) index of the matched ground truth, or -1 for negative anchors.
+    """
+    ious = box_iou(gt_boxes, anchors)
+    anchor_centers = (anchors[:, :2] + anchors[:, 2:]) / 2
+    gt_centers = (gt_boxes[..., :2] + gt_boxes[..., 2:]) / 2
+    dists = (gt_centers[:, :, None, :] - anchor_centers[None, None, :, :]).pow(2).sum(dim=-1)
+
+    candidates = []
+    start = 0
+    for n in num_anchors_per_level:
+        k = min(topk, n)
+        idx = dists[:, :, start:start + n].topk(k, dim=2, largest=False)[1]
+        candidates.append(idx + start)
+        start += n
+    candidates = torch.cat(candidates, dim=2)
+
+    cand_ious = ious.gather(2, candidates)
+    thresh = cand_ious.mean(dim=2, keepdim=True) + cand_ious.std(dim=2, keepdim=True)
+    cx = anchor_centers[candidates, 0]
+    cy = anchor_centers[candidates, 1]
+    l, t, r, b = [gt_boxes[..., i:i + 1] for i in range(4)]
+    inside = (cx > l) & (cx < r) & (cy > t) & (cy < b)
+    positive = (cand_ious >= thresh) & inside & mask[:, :, None]
+
+    is_pos = torch.zeros_like(ious, dtype=torch.bool).scatter_(2, candidates, positive)
+    ious = ious.masked_fill(~is_pos, -1)
+    max_ious, matched = ious.max(dim=1)
+    return matched.masked_fill(max_ious < 0, -1)
+
+
+def assign(anchors, gt_boxes, gt_labels, matched, stds=(0.1, 0.1, 0.2, 0.2)):
+    r"""
+    Build targets of a batch from matched indices.
+
+    Parameters
+    ----------
+    anchors : ``torch.Tensor``
+        (N, 4) anchors.
+    gt_boxes : ``torch.Tensor``
+        (B, M, 4) padded boxes of ground truth.
+    gt_labels : ``torch.Tensor``
+        (B, M) labels of ground truth, starting from 1.
+    matched : ``torch.Tensor``
+        (B, N) result of `match_iou` or `match_atss`.
+    stds : ``Sequence[float]``
+        Standard deviations of `horch.boxes.encode`.
+
+    Returns
+    -------
+    loc_t : ``torch.Tensor``
+        (B, N, 4) encoded boxes, only meaningful for positive anchors.
+    cls_t : ``torch.Tensor``
+        (B, N) labels, 0 for negative and -1 for ignored anchors.
+    """
+    idx = matched.clamp(min=0)
+    boxes = gt_boxes.gather(1, idx[..., None].expand(*idx.shape, 4))
+    loc_t = encode(boxes, anchors, stds)
+    cls_t = gt_labels.gather(1, idx)
+    cls_t = cls_t.masked_fill(matched == -1, 0).masked_fill(matched == -2, -1)
+    return loc_t, cls_t
@@ -0,0 +1,279 @@
+import torch
+import torch.nn.functional as F
+
+from horch.boxes import box_iou, decode
+
+__all__ = ["nms", "batched_nms", "soft_nms", "matrix_nms", "postprocess"]
+
+
+def _greedy_nms(boxes, scores, iou_threshold):
+    order = scores.argsort(descending=True)
+    boxes = boxes[order]
+    suppressed = box_iou(boxes, boxes) > iou_threshold
+    keep = torch.ones(len(boxes), dtype=torch.bool, device=boxes.device)
+    for i in range(len(boxes)):
+        if keep[i]:
+            keep[i + 1:] &= ~suppressed[i, i + 1:]
+    return order[keep]
+
+
+def nms(boxes, scores, iou_threshold):
+    r"""
+    Greedy NMS of (N, 4) ``ltrb`` boxes.
+
+    The compiled kernel of torchvision is used if available, which is also the fast path
+    on CPU, otherwise a fallback computing the IoU matrix at once.
+
+    Returns
+    -------
+    keep : ``torch.Tensor``
+        Indices of kept boxes, sorted by decreasing scores.
+    """
+    try:
+        from torchvision.ops import nms as _nms
+    except ImportError:
+        return _greedy_nms(boxes, scores, iou_threshold)
+    return _nms(boxes, scores, iou_threshold)
+
+
+def _offset(boxes, idxs):
+    # Boxes of different groups never overlap after the offsets
+    if boxes.numel() == 0:
+        return boxes
+    offsets = idxs.to(boxes) * (boxes.max() - boxes.min() + 1)
+    return boxes + offsets[:, None]
+
+
+def batched_nms(boxes, scores, idxs, iou_threshold):
+    r"""
+    NMS performed independently for each group (e.g., class and image) in one call, by
+    offsetting boxes of different groups so that they never overlap.
+
+    Parameters
+    ----------
+    boxes : ``torch.Tensor``
+        (N, 4) boxes.
+    scores : ``torch.Tensor``
+        (N,) scores.
+    idxs : ``torch.Tensor``
+        (N,) group of every box.
+    iou_threshold : ``float``
+        Boxes of IoU larger than it with a box of higher score are discarded.
+    """
+    return nms(_offset(boxes, idxs), scores, iou_threshold)
+
+
+def soft_nms(boxes, scores, idxs, sigma=0.5, score_threshold=0.001):
+    r"""
+    Gaussian Soft-NMS, for each group in `idxs` independently.
+
+    Boxes are picked one at a time, so it is much slower than `batched_nms`.
+
+    Returns
+    -------
+    keep : ``torch.Tensor``
+        Indices of kept boxes, sorted by decreasing scores.
+    scores : ``torch.Tensor``
+        Decayed scores of the kept boxes.
+    """
+    boxes = _offset(boxes, idxs)
+    scores = scores.clone()
+    ious = box_iou(boxes, boxes)
+    alive = scores > score_threshold
+    keep = []
+    while alive.any():
+        i = torch.where(alive, scores, scores.new_tensor(-1.)).argmax()
+        keep.append(i)
+        alive[i] = False
+        scores = torch.where(alive, scores * torch.exp(-ious[i] ** 2 / sigma), scores)
+        alive &= scores > score_threshold
+    keep = torch.stack(keep) if keep else idxs.new_zeros(0)
+    return keep, scores[keep]
+
+
+def matrix_nms(boxes, scores, idxs, sigma=2.0, kernel='gaussian'):
+    r"""
+    Matrix NMS of SOLOv2, which decays the scores of all boxes in parallel.
+
+    Parameters
+    ----------
+    boxes : ``torch.Tensor``
+        (..., N, 4) boxes, sorted by decreasing scores.
+    scores : ``torch.Tensor``
+        (..., N) scores.
+    idxs : ``torch.Tensor``
+        (..., N) group (e.g., class) of every box.
+    sigma : ``float``
+        Parameter of the gaussian kernel.
+    kernel : ``str``
+        ``gaussian`` or ``linear``.
+
+    Returns
+    -------
+    scores : ``torch.Tensor``
+        (..., N) decayed scores.
+    """
+    n = boxes.size(-2)
+    ious = box_iou(boxes, boxes)
+    same = idxs[..., :, None] == idxs[..., None, :]
+    # ious[i, j] with a box i of higher score than j
+    ious = (ious * same.to(ious)).triu(diagonal=1)
+    compensate = ious.max(dim=-2)[0][..., :, None]
+    if kernel == 'gaussian':
+        decay = torch.exp(-sigma * (ious ** 2 - compensate ** 2))
+    elif kernel == 'linear':
+        decay = (1 - ious) / (1 - compensate).clamp(min=1e-6)
+    else:
+        raise ValueError("Not supported kernel: %s" % kernel)
+    return scores * decay.min(dim=-2)[0] if n != 0 else scores
+
+
+def _flatten(preds, c):
+    if torch.is_tensor(preds):
+        preds = [preds]
+    return [p.reshape(p.size(0), -1, c) for p in preds]
+
+
+def _topk_candidates(loc_preds, cls_preds, num_classes, topk, softmax):
+    loc_preds = _flatten(loc_preds, 4)
+    cls_preds = _flatten(cls_preds, num_classes)
+    scores, anchor_idxs, labels, locs = [], [], [], []
+    start = 0
+    for loc_p, cls_p in zip(loc_preds, cls_preds):
+        if softmax:
+            # Class 0 is background
+            p = F.softmax(cls_p, dim=-1)[..., 1:]
+        else:
+            p = cls_p.sigmoid()
+        b, n, c = p.size()
+        k = min(topk, n * c)
+        s, idx = p.reshape(b, -1).topk(k, dim=1)
+        anchor_idx = idx // c
+        scores.append(s)
+        labels.append(idx % c + 1)
+        locs.append(loc_p.gather(1, anchor_idx[..., None].expand(b, k, 4)))
+        anchor_idxs.append(anchor_idx + start)
+        start += n
+    return torch.cat(locs, 1), torch.cat(scores, 1), torch.cat(labels, 1), torch.cat(anchor_idxs, 1)
+
+
+def _pad(boxes, scores, labels, images, batch_size, max_dets):
+    # Rank of detections within their images, which must be sorted by decreasing scores
+    order = _stable_sort(images)
+    boxes, scores, labels, images = boxes[order], scores[order], labels[order], images[order]
+    counts = torch.bincount(images, minlength=batch_size)
+    starts = counts.cumsum(0) - counts
+    rank = torch.arange(len(images), device=images.device) - starts[images]
+    keep = rank < max_dets
+    images, rank = images[keep], rank[keep]
+
+    out_boxes = boxes.new_zeros((batch_size, max_dets, 4))
+    out_scores = scores.new_zeros((batch_size, max_dets))
+    out_labels = labels.new_full((batch_size, max_dets), -1)
+    out_boxes[images, rank] = boxes[keep]
+    out_scores[images, rank] = scores[keep]
+    out_labels[images, rank] = labels[keep]
+    return out_boxes, out_scores, out_labels, counts.clamp(max=max_dets)
+
+
+def _stable_sort(x):
+    # argsort keeping the order of equal elements
+    n = len(x)
+    key = x * n + torch.arange(n, device=x.device)
+    return key.argsort()
+
+
+def postprocess(loc_preds, cls_preds, anchors, num_classes, softmax=False, topk=1000,
+                score_threshold=0.05, iou_threshold=0.5, max_dets=100, method='nms',
+                stds=(0.1, 0.1, 0.2, 0.2), image_size=None, pre_nms_topk=500):
+    r"""
+    Decode raw predictions of detection heads to detections, for a whole batch at once.
+
+    Top-`topk` (anchor, class) pairs are selected on every level, and only their boxes are
+    decoded. Then class-aware NMS is performed for the whole batch at once.
+
+    ``soft`` and ``matrix`` compute IoUs between all candidates of an image, so only the
+    top-`pre_nms_topk` candidates of every image are kept for them, bounding the IoU matrices
+    to (B, pre_nms_topk, pre_nms_topk).
+
+    Parameters
+    ----------
+    loc_preds : ``Union[torch.Tensor, Sequence[torch.Tensor]]``
+        Location predictions of every level from heads, e.g., `RetinaHead`.
+    cls_preds : ``Union[torch.Tensor, Sequence[torch.Tensor]]``
+        Classification predictions of every level.
+    anchors : ``torch.Tensor``
+        (N, 4) anchors from `AnchorGenerator`.
+    num_classes : ``int``
+        Number of classes of `cls_preds`.
+    softmax : ``bool``
+        Whether class scores are from softmax with class 0 as background (SSD), otherwise
+        from sigmoid (RetinaNet).
+    topk : ``int``
+        Number of candidates per level.
+    score_threshold : ``float``
+        Candidates of lower scores are discarded.
+    iou_threshold : ``float``
+        IoU threshold of ``nms``.
+    max_dets : ``int``
+        Maximal number of detections per image.
+    method : ``str``
+        ``nms``, ``soft`` (Soft-NMS) or ``matrix`` (Matrix NMS).
+    stds : ``Sequence[float]``
+        Standard deviations of `horch.boxes.encode`.
+    image_size : ``Tuple[int, int]``
+        If given, boxes are clipped to the image of (w, h).
+    pre_nms_topk : ``int``
+        Maximal number of candidates per image before ``soft`` or ``matrix``.
+
+    Returns
+    -------
+    boxes : ``torch.Tensor``
+        (B, max_dets, 4) boxes of [l, t, r, b], padded with 0.
+    scores : ``torch.Tensor``
+        (B, max_dets) scores, padded with 0.
+    labels : ``torch.Tensor``
+        (B, max_dets) labels starting from 1, padded with -1.
+    num_dets : ``torch.Tensor``
+        (B,) number of detections of every image.
+    """
+    locs, scores, labels, anchor_idxs = _topk_candidates(loc_preds, cls_preds, num_classes, topk, softmax)
+    b, k = scores.size()
+    boxes = decode(locs, anchors[anchor_idxs], stds)
+    if image_size is not None:
+        w, h = image_size
+        boxes = torch.stack([boxes[..., 0].clamp(0, w), boxes[..., 1].clamp(0, h),
+                             boxes[..., 2].clamp(0, w), boxes[..., 3].clamp(0, h)], dim=-1)
+
+    if method in ['soft', 'matrix']:
+        k = min(pre_nms_topk, k)
+        scores, order = scores.topk(k, dim=1)
+        labels = labels.gather(1, order)
+        boxes = boxes.gather(1, order[..., None].expand(b, k, 4))
+    if method == 'matrix':
+        scores = matrix_nms(boxes, scores, labels)
+
+    images = torch.arange(b, device=scores.device)[:, None].expand(b, k).reshape(-1)
+    boxes, scores, labels = boxes.reshape(-1, 4), scores.reshape(-1), labels.reshape(-1)
+    valid = scores > score_threshold
+    boxes, scores, labels, images = boxes[valid], scores[valid], labels[valid], images[valid]
+
+    if method == 'nms':
+        groups = images * (num_classes + 1) + labels
+        keep = batched_nms(boxes, scores, groups, iou_threshold)
+    elif method == 'soft':
+        # One image at a time, so that IoUs are only computed within images
+        keep, kept_scores = [], []
+        for i in range(b):
+            idxs = torch.nonzero(images == i).flatten()
+            keep_i, scores_i = soft_nms(boxes[idxs], scores[idxs], labels[idxs], score_threshold=score_threshold)
+            keep.append(idxs[keep_i])
+            kept_scores.append(scores_i)
+        keep = torch.cat(keep)
+        scores = scores.clone()
+        scores[keep] = torch.cat(kept_scores)
+    elif method == 'matrix':
+        keep = scores.argsort(descending=True)
+    else:
+        raise ValueError("Not supported method: %s" % method)
+    return _pad(boxes[keep], scores[keep], labels[keep], images[keep], b, max_dets)
@@ -1,8 +1,15 @@
 import io
+import os
+import pickle
+import shutil
+import tempfile
+import warnings
 
 import zmq
+import numpy as np
 
 import torch
+from torch.multiprocessing.reductions import ForkingPickler
 
 
 def dumps(t):
@@ -17,26 +24,134 @@ def loads(s):
     return t
 
 
-def new_consumer():
-    context = zmq.Context()
+def dumps_shared(t):
+    # Tensor storages are moved to shared memory and only their handles
+    # (file descriptors or shm names) are pickled, so the message is a small
+    # header regardless of the size of the batch.
+    return ForkingPickler.dumps(t, pickle.HIGHEST_PROTOCOL)
+
+
+def loads_shared(s):
+    return pickle.loads(s)
+
+
+class _FramePickler(pickle.Pickler):
+    # Tensors and arrays are pickled as references to out-of-band frames,
+    # everything else goes into the header frame.
+
+    def __init__(self, file, frames):
+        super().__init__(file, pickle.HIGHEST_PROTOCOL)
+        self.frames = frames
+
+    def persistent_id(self, obj):
+        if torch.is_tensor(obj):
+            if obj.is_cuda or obj.is_sparse or obj.requires_grad or obj.dtype == torch.bfloat16:
+                return None
+            a = obj.contiguous().numpy()
+            self.frames.append(a)
+            return 'tensor', len(self.frames) - 1, a.dtype.str, a.shape
+        elif isinstance(obj, np.ndarray):
+            if obj.dtype.hasobject:
+                return None
+            a = np.ascontiguousarray(obj)
+            self.frames.append(a)
+            return 'ndarray', len(self.frames) - 1, a.dtype.str, a.shape
+        return None
+
+
+class _FrameUnpickler(pickle.Unpickler):
+
+    def __init__(self, file, frames):
+        super().__init__(file)
+        self.frames = frames
+
+    def persistent_load(self, pid):
+        kind, i, dtype, shape = pid
+        a = np.frombuffer(self.frames[i].buffer, dtype=dtype).reshape(shape)
+        if kind == 'tensor':
+            # The frame's memory is owned by the message and never reused,
+            # so the read-only flag of the buffer can be ignored.
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                return torch.from_numpy(a)
+        if not a.flags.writeable:
+            # Arrays were writable when sent with torch.save, keep it that way
+            a = a.copy()
+        return a
+
+
+def dumps_multipart(t):
+    frames = []
+    s = io.BytesIO()
+    _FramePickler(s, frames).dump(t)
+    return [s.getvalue()] + frames
+
+
+def loads_multipart(frames):
+    s = io.BytesIO(frames[0].bytes)
+    return _FrameUnpickler(s, frames[1:]).load()
+
+
+def default_transport():
+    if os.name == 'posix' and zmq.has('ipc'):
+        return 'ipc'
+    return 'tcp'
+
+
+def new_consumer(transport='tcp', context=None):
+    context = context or zmq.Context()
     socket = context.socket(zmq.PULL)
-    port = socket.bind_to_random_port("tcp://*")
-    return context, socket, port
+    if transport == 'tcp':
+        port = socket.bind_to_random_port("tcp://127.0.0.1")
+        addr = f'tcp://127.0.0.1:{port}'
+    elif transport == 'ipc':
+        addr = 'ipc://' + os.path.join(tempfile.mkdtemp(prefix='horch-'), 'socket')
+        socket.bind(addr)
+    elif transport == 'inproc':
+        addr = f'inproc://horch-{id(socket)}'
+        socket.bind(addr)
+    else:
+        raise ValueError("Not supported transport: %s" % transport)
+    return context, socket, addr
 
 
-def new_producer(port):
-    context = zmq.Context()
+def new_producer(addr, context=None):
+    if isinstance(addr, int):
+        addr = f'tcp://127.0.0.1:{addr}'
+    # inproc endpoints are only reachable from the context that bound them
+    context = context or zmq.Context()
     socket = context.socket(zmq.PUSH)
-    socket.connect(f'tcp://localhost:{port}')
+    socket.connect(addr)
     return socket
 
 
-def put(socket, data):
-    data = dumps(data)
+def close_consumer(socket, addr):
+    socket.close()
+    if addr.startswith('ipc://'):
+        shutil.rmtree(os.path.dirname(addr[len('ipc://'):]), ignore_errors=True)
+
+
+def put(socket, data, shared=False):
+    if shared:
+        data = dumps_shared(data)
+    else:
+        data = dumps(data)
     socket.send(data)
 
 
-def get(socket):
+def get(socket, shared=False):
     data = socket.recv()
-    data = loads(data)
+    if shared:
+        data = loads_shared(data)
+    else:
+        data = loads(data)
     return data
+
+
+def put_multipart(socket, data):
+    socket.send_multipart(dumps_multipart(data), copy=False)
+
+
+def get_multipart(socket):
+    frames = socket.recv_multipart(copy=False)
+    return loads_multipart(frames)
@@ -12,6 +12,7 @@ from torch.utils.tensorboard import SummaryWriter
 from horch.common import CUDA
 
 from horch.train.metrics import TrainLoss
+from horch.train._utils import autocast, create_grad_scaler
 from ignite.engine import Engine, Events
 from ignite.handlers import Checkpoint, DiskSaver
 from ignite.metrics import Accuracy, TopKCategoricalAccuracy, Loss
@@ -34,7 +35,11 @@ def _prepare_batch(batch, device=None):
 
 
 def create_darts_trainer(
-        model, criterion, optimizer_model, optimizer_arch, lr_scheduler, metrics, device, clip_grad_norm=5):
+        model, criterion, optimizer_model, optimizer_arch, lr_scheduler, metrics, device, clip_grad_norm=5,
+        amp=False, amp_dtype=None, scaler=None):
+    if scaler is None:
+        scaler = create_grad_scaler(device, amp, amp_dtype)
+
     def step(engine, batch):
         model.train()
 
@@ -45,22 +50,26 @@ def create_darts_trainer(
             p.requires_grad_(False)
         for p in model.arch_parameters():
             p.requires_grad_(True)
-        logits = model(input)
-        loss = criterion(logits, target)
-        loss.backward()
-        optimizer_arch.step()
+        with autocast(device, amp, amp_dtype):
+            logits = model(input)
+            loss = criterion(logits, target)
+        scaler.scale(loss).backward()
+        scaler.step(optimizer_arch)
 
         optimizer_model.zero_grad()
         for p in model.arch_parameters():
             p.requires_grad_(False)
         for p in model.model_parameters():
             p.requires_grad_(True)
-        logits_search = model(input_search)
-        loss_search = criterion(logits_search, target_search)
-        loss_search.backward()
+        with autocast(device, amp, amp_dtype):
+            logits_search = model(input_search)
+            loss_search = criterion(logits_search, target_search)
+        scaler.scale(loss_search).backward()
         if clip_grad_norm:
+            scaler.unscale_(optimizer_model)
             nn.utils.clip_grad_norm_(model.parameters(), clip_grad_norm)
-        optimizer_model.step()
+        scaler.step(optimizer_model)
+        scaler.update()
 
         lr_scheduler.step(engine.state.iteration / engine.state.epoch_length)
         return {
@@ -78,11 +87,11 @@ def create_darts_trainer(
     return engine
 
 
-def create_darts_evaluator(model, metrics, device):
+def create_darts_evaluator(model, metrics, device, amp=False, amp_dtype=None):
     def step(engine, batch):
         model.eval()
         input, target = _prepare_batch(batch, device)
-        with torch.no_grad():
+        with torch.no_grad(), autocast(device, amp, amp_dtype):
             output = model(input)
 
         return {
@@ -110,9 +119,13 @@ def log_metrics(engine, stage):
 class DARTSTrainer:
 
     def __init__(self, model, criterion, optimizer_model, optimizer_arch, lr_scheduler,
-                 metrics=None, test_metrics=None, save_path="checkpoints", device=None):
+                 metrics=None, test_metrics=None, save_path="checkpoints", device=None,
+                 amp=False, amp_dtype=None):
         self.device = device or ('cuda' if CUDA else 'cpu')
         model.to(self.device)
+        self.amp = amp
+        self.amp_dtype = amp_dtype
+        self.scaler = create_grad_scaler(self.device, amp, amp_dtype)
 
         self.model = model
         self.criterion = criterion
@@ -141,9 +154,12 @@ class DARTSTrainer:
                                              DiskSaver(self.save_path, create_dir=True, require_empty=False))
 
     def to_save(self):
-        return {'train_engine': self.train_engine, 'eval_engine': self.eval_engine,
-                'model': self.model, 'optimizer_model': self.optimizer_model, 'optimizer_arch': self.optimizer_arch,
-                'lr_scheduler': self.lr_scheduler}
+        to_save = {'train_engine': self.train_engine, 'eval_engine': self.eval_engine,
+                   'model': self.model, 'optimizer_model': self.optimizer_model, 'optimizer_arch': self.optimizer_arch,
+                   'lr_scheduler': self.lr_scheduler}
+        if self.scaler.is_enabled():
+            to_save['scaler'] = self.scaler
+        return to_save
 
     def resume(self):
         d = Path(self.save_path)
@@ -159,13 +175,14 @@ class DARTSTrainer:
     def _create_train_engine(self):
         engine = create_darts_trainer(
             self.model, self.criterion, self.optimizer_model, self.optimizer_arch,
-            self.lr_scheduler, self.metrics, self.device)
+            self.lr_scheduler, self.metrics, self.device,
+            amp=self.amp, amp_dtype=self.amp_dtype, scaler=self.scaler)
         engine.add_event_handler(
             Events.EPOCH_COMPLETED, log_metrics(stage='train'))
         return engine
 
     def _create_eval_engine(self):
-        engine = create_darts_evaluator(self.model, self.test_metrics, self.device)
+        engine = create_darts_evaluator(self.model, self.test_metrics, self.device, self.amp, self.amp_dtype)
         engine.add_event_handler(
             Events.EPOCH_COMPLETED, log_metrics(stage='valid'))
         return engine
@@ -7,6 +7,7 @@ from toolz import curry
 
 from horch import cuda
 from horch.ops import dims, unsqueeze
+from horch.boxes import aligned_box_iou
 
 
 def inverse_sigmoid(x):
@@ -33,23 +34,26 @@ def focal_loss2(input, target, gamma=2, beta=1, alpha=0.25, eps=1e-6, reduction=
         pos_weight=input.new_tensor(alpha)) / gamma
 
 
-def iou_loss(prediction, ground_truth, reduction='mean'):
-    l_p = prediction[..., 0]
-    t_p = prediction[..., 1]
-    r_p = prediction[..., 2]
-    b_p = prediction[..., 3]
-    l_t = ground_truth[..., 0]
-    t_t = ground_truth[..., 1]
-    r_t = ground_truth[..., 2]
-    b_t = ground_truth[..., 3]
-
-    area_p = (t_p + b_p) * (l_p + r_p)
-    area_t = (t_t + b_t) * (l_t + r_t)
-    inter_h = torch.min(t_p, t_t) + torch.min(b_p, b_t)
-    inter_w = torch.min(l_p, l_t) + torch.min(r_p, r_t)
-    inter = inter_h * inter_w
-    iou = inter / (area_p + area_t - inter)
-    loss = -torch.log(iou)
+def iou_loss(prediction, ground_truth, mode='iou', reduction='mean'):
+    r"""
+    Parameters
+    ----------
+    prediction : torch.Tensor
+        (..., 4) distances from points to the [left, top, right, bottom] sides of boxes.
+    ground_truth : torch.Tensor
+        (..., 4) distances of the target boxes.
+    mode : str
+        `iou` for -log(IoU), or `giou`, `diou` and `ciou` for 1 - the variant of IoU.
+    reduction : str
+        `sum` or `mean`
+    """
+    # Boxes relative to the points
+    sign = prediction.new_tensor([-1, -1, 1, 1])
+    iou = aligned_box_iou(prediction * sign, ground_truth * sign, mode)
+    if mode == 'iou':
+        loss = -torch.log(iou)
+    else:
+        loss = 1 - iou
     if reduction == 'sum':
         return loss.sum()
     elif reduction == 'mean':
@@ -23,7 +23,8 @@ class ByMetric:
             trainer.save_path, trainer.name,
             score_name=save_metric, patience=self.patience,
             score_function=score_function,
-            save_as_state_dict=True, require_empty=False)
+            save_as_state_dict=True, require_empty=False,
+            writer=trainer.checkpoint_writer)
         checkpoint_handler._iteration = trainer.epochs()
         return checkpoint_handler
 
@@ -35,6 +36,7 @@ class PerEpochs:
 
     def parse(self, trainer):
         checkpoint_handler = ModelCheckpoint(
-            trainer.save_path, trainer.name, self.epochs, save_as_state_dict=True, require_empty=False)
+            trainer.save_path, trainer.name, self.epochs, save_as_state_dict=True, require_empty=False,
+            writer=trainer.checkpoint_writer)
         checkpoint_handler._iteration = trainer.epochs()
         return checkpoint_handler
@@ -36,6 +36,27 @@ def _prepare_batch(batch, device=None):
     return to_device(x, device), to_device(y, device)
 
 
+def autocast(device=None, enabled=True, dtype=None):
+    """Native mixed precision context for `device`. Defaults to float16 on CUDA
+    and bfloat16 on CPU.
+
+    """
+    device_type = torch.device(device or 'cpu').type
+    if dtype is None:
+        dtype = torch.float16 if device_type == 'cuda' else torch.bfloat16
+    return torch.autocast(device_type, dtype=dtype, enabled=enabled)
+
+
+def create_grad_scaler(device=None, enabled=True, dtype=None):
+    """GradScaler for `autocast`. Loss scaling is only needed for float16 on CUDA,
+    otherwise the returned scaler is disabled and passes everything through.
+
+    """
+    device_type = torch.device(device or 'cpu').type
+    enabled = enabled and device_type == 'cuda' and dtype in [None, torch.float16]
+    return torch.cuda.amp.GradScaler(enabled=enabled)
+
+
 def cancel_event(engine, event_name, f):
     if engine.has_event_handler(f, event_name):
         handlers = engine._event_handlers[event_name]
@@ -17,21 +17,25 @@ from ignite.engine import Events
 from ignite.handlers import Timer, ModelCheckpoint
 
 from horch.common import CUDA
+from horch.ext.checkpoint import AsyncWriter, snapshot, atomic_save
 from horch.ops import one_hot
 from horch.models.utils import unfreeze, freeze
 from horch.train.engine import Engine
 from horch.train.trainer import _trainer_callback_wrap, _terminate_on_iterations
-from horch.train._utils import _prepare_batch, set_lr, send_weixin, cancel_event, to_device
+from horch.train._utils import _prepare_batch, set_lr, send_weixin, cancel_event, to_device, autocast, \
+    create_grad_scaler
 
 
 def create_gan_trainer(
         G, D, criterionG, criterionD, optimizerG, optimizerD, make_latent=None, metrics=None,
-        device=None, prepare_batch=_prepare_batch):
+        device=None, prepare_batch=_prepare_batch, amp=False, amp_dtype=None, scaler=None):
     if metrics is None:
         metrics = {}
     if device:
         G.to(device)
         D.to(device)
+    if scaler is None:
+        scaler = create_grad_scaler(device, amp, amp_dtype)
     if make_latent is None:
         make_latent = lambda b: torch.randn(b, G.in_channels)
 
@@ -45,31 +49,34 @@ def create_gan_trainer(
         D.train()
         optimizerD.zero_grad()
 
-        real_p = D(real_x)
+        with autocast(device, amp, amp_dtype):
+            real_p = D(real_x)
 
-        lat = make_latent(batch_size)
-        lat = to_device(lat, device)
-        with torch.no_grad():
-            fake_x = G(lat)
-        fake_p = D(fake_x)
-        lossD = criterionD(real_p, fake_p)
-        lossD.backward()
-        optimizerD.step()
+            lat = make_latent(batch_size)
+            lat = to_device(lat, device)
+            with torch.no_grad():
+                fake_x = G(lat)
+            fake_p = D(fake_x)
+            lossD = criterionD(real_p, fake_p)
+        scaler.scale(lossD).backward()
+        scaler.step(optimizerD)
 
         freeze(D)
         G.train()
         optimizerG.zero_grad()
 
-        lat = make_latent(batch_size)
-        lat = to_device(lat, device)
-        fake_p = D(G(lat))
-        lossG = criterionG(fake_p)
-        lossG.backward()
-        optimizerG.step()
+        with autocast(device, amp, amp_dtype):
+            lat = make_latent(batch_size)
+            lat = to_device(lat, device)
+            fake_p = D(G(lat))
+            lossG = criterionG(fake_p)
+        scaler.scale(lossG).backward()
+        scaler.step(optimizerG)
+        scaler.update()
 
         output = {
-            "lossD": lossD.item(),
-            "lossG": lossG.item(),
+            "lossD": lossD.detach(),
+            "lossG": lossG.detach(),
             "batch_size": batch_size,
         }
         return output
@@ -83,12 +90,14 @@ def create_gan_trainer(
 
 def create_infogan_trainer(
         G, D, criterionG, criterionD, optimizerG, optimizerD, make_latent, metrics=None,
-        device=None, prepare_batch=_prepare_batch):
+        device=None, prepare_batch=_prepare_batch, amp=False, amp_dtype=None, scaler=None):
     if metrics is None:
         metrics = {}
     if device:
         G.to(device)
         D.to(device)
+    if scaler is None:
+        scaler = create_grad_scaler(device, amp, amp_dtype)
 
     def _update(engine, batch):
         inputs, _ = prepare_batch(batch, device=device)
@@ -103,16 +112,17 @@ def create_infogan_trainer(
         D.d_head.train()
         optimizerD.zero_grad()
 
-        real_p = D(real_x)
+        with autocast(device, amp, amp_dtype):
+            real_p = D(real_x)
 
-        lat = make_latent(batch_size)
-        lat = to_device(lat, device)
-        # with torch.no_grad():
-        fake_x = G(lat)
-        fake_p = D(fake_x.detach())
-        lossD = criterionD(real_p, fake_p)
-        lossD.backward()
-        optimizerD.step()
+            lat = make_latent(batch_size)
+            lat = to_device(lat, device)
+            # with torch.no_grad():
+            fake_x = G(lat)
+            fake_p = D(fake_x.detach())
+            lossD = criterionD(real_p, fake_p)
+        scaler.scale(lossD).backward()
+        scaler.step(optimizerD)
 
         D.q = True
         freeze(D.features)
@@ -121,16 +131,18 @@ def create_infogan_trainer(
         D.q_head.train()
         optimizerG.zero_grad()
 
-        # lat = make_latent(batch_size)
-        # lat = to_device(lat, device)
-        fake_p, lat_p = D(fake_x)
-        lossG = criterionG(fake_p, lat_p, lat)
-        lossG.backward()
-        optimizerG.step()
+        with autocast(device, amp, amp_dtype):
+            # lat = make_latent(batch_size)
+            # lat = to_device(lat, device)
+            fake_p, lat_p = D(fake_x)
+            lossG = criterionG(fake_p, lat_p, lat)
+        scaler.scale(lossG).backward()
+        scaler.step(optimizerG)
+        scaler.update()
 
         output = {
-            "lossD": lossD.item(),
-            "lossG": lossG.item(),
+            "lossD": lossD.detach(),
+            "lossG": lossG.detach(),
             "batch_size": batch_size,
         }
         return output
@@ -144,12 +156,14 @@ def create_infogan_trainer(
 
 def create_acgan_trainer(
         G, D, criterionG, criterionD, optimizerG, optimizerD, make_latent, metrics=None,
-        device=None, prepare_batch=_prepare_batch):
+        device=None, prepare_batch=_prepare_batch, amp=False, amp_dtype=None, scaler=None):
     if metrics is None:
         metrics = {}
     if device:
         G.to(device)
         D.to(device)
+    if scaler is None:
+        scaler = create_grad_scaler(device, amp, amp_dtype)
 
     num_classes = D.out_channels - 1
     lat_dim = G.in_channels - num_classes
@@ -168,39 +182,42 @@ def create_acgan_trainer(
         D.train()
         optimizerD.zero_grad()
 
-        real_p = D(real_x)
-        real_cp = real_p[:, 1:]
-        real_p = real_p[:, 0]
-
-        lat = make_latent(batch_size)
-        lat = to_device(lat, device)
-        z = torch.cat([lat, one_hot(labels, num_classes)], dim=1)
-        with torch.no_grad():
-            fake_x = G(z)
-        fake_p = D(fake_x)
-        fake_cp = fake_p[:, 1:]
-        fake_p = fake_p[:, 0]
-        lossD = criterionD(real_p, fake_p, real_cp, fake_cp, labels)
-        lossD.backward()
-        optimizerD.step()
+        with autocast(device, amp, amp_dtype):
+            real_p = D(real_x)
+            real_cp = real_p[:, 1:]
+            real_p = real_p[:, 0]
+
+            lat = make_latent(batch_size)
+            lat = to_device(lat, device)
+            z = torch.cat([lat, one_hot(labels, num_classes)], dim=1)
+            with torch.no_grad():
+                fake_x = G(z)
+            fake_p = D(fake_x)
+            fake_cp = fake_p[:, 1:]
+            fake_p = fake_p[:, 0]
+            lossD = criterionD(real_p, fake_p, real_cp, fake_cp, labels)
+        scaler.scale(lossD).backward()
+        scaler.step(optimizerD)
 
         freeze(D)
         G.train()
         optimizerG.zero_grad()
 
-        lat = make_latent(batch_size)
-        lat = to_device(lat, device)
-        z = torch.cat([lat, one_hot(labels, num_classes)], dim=1)
-        fake_p = D(G(z))
-        fake_cp = fake_p[:, 1:]
-        fake_p = fake_p[:, 0]
-        lossG = criterionG(fake_p, fake_cp, labels)
-        lossG.backward()
-        optimizerG.step()
+        with autocast(device, amp, amp_dtype):
+            lat = make_latent(batch_size)
+            lat = to_device(lat, device)
+            z = torch.cat([lat, one_hot(labels, num_classes)], dim=1)
+            fake_p = D(G(z))
+            fake_cp = fake_p[:, 1:]
+            fake_p = fake_p[:, 0]
+            lossG = criterionG(fake_p, fake_cp, labels)
+        scaler.scale(lossG).backward()
+        scaler.step(optimizerG)
+        scaler.update()
 
         output = {
-            "lossD": lossD.item(),
-            "lossG": lossG.item(),
+            "lossD": lossD.detach(),
+            "lossG": lossG.detach(),
             "batch_size": batch_size,
         }
         return output
@@ -214,12 +231,14 @@ def create_acgan_trainer(
 
 def create_cgan_trainer(
         G, D, criterionG, criterionD, optimizerG, optimizerD, make_latent=None, metrics=None,
-        device=None, prepare_batch=_prepare_batch):
+        device=None, prepare_batch=_prepare_batch, amp=False, amp_dtype=None, scaler=None):
     if metrics is None:
         metrics = {}
     if device:
         G.to(device)
         D.to(device)
+    if scaler is None:
+        scaler = create_grad_scaler(device, amp, amp_dtype)
     num_classes = D.out_channels - 1
     lat_dim = G.in_channels - num_classes
 
@@ -237,32 +256,35 @@ def create_cgan_trainer(
         D.train()
         optimizerD.zero_grad()
 
-        real_p = D(real_x, labels)
+        with autocast(device, amp, amp_dtype):
+            real_p = D(real_x, labels)
 
-        lat = make_latent(batch_size)
-        lat = to_device(lat, device)
-        with torch.no_grad():
-            fake_x = G(lat, labels)
-        fake_p = D(fake_x, labels)
-        lossD = criterionD(real_p, fake_p)
-        lossD.backward()
-        optimizerD.step()
+            lat = make_latent(batch_size)
+            lat = to_device(lat, device)
+            with torch.no_grad():
+                fake_x = G(lat, labels)
+            fake_p = D(fake_x, labels)
+            lossD = criterionD(real_p, fake_p)
+        scaler.scale(lossD).backward()
+        scaler.step(optimizerD)
 
         freeze(D)
         # D.eval()
         G.train()
         optimizerG.zero_grad()
 
-        lat = make_latent(batch_size)
-        lat = to_device(lat, device)
-        fake_p = D(G(lat, labels), labels)
-        lossG = criterionG(fake_p)
-        lossG.backward()
-        optimizerG.step()
+        with autocast(device, amp, amp_dtype):
+            lat = make_latent(batch_size)
+            lat = to_device(lat, device)
+            fake_p = D(G(lat, labels), labels)
+            lossG = criterionG(fake_p)
+        scaler.scale(lossG).backward()
+        scaler.step(optimizerG)
+        scaler.update()
 
         output = {
-            "lossD": lossD.item(),
-            "lossG": lossG.item(),
+            "lossD": lossD.detach(),
+            "lossG": lossG.detach(),
             "batch_size": batch_size,
         }
         return output
@@ -277,7 +299,8 @@ def create_cgan_trainer(
 class GANTrainer:
 
     def __init__(self, G, D, criterionG, criterionD, optimizerG, optimizerD, lr_schedulerG=None, lr_schedulerD=None,
-                 make_latent=None, metrics=None, save_path=".", name="GAN", gan_type='gan'):
+                 make_latent=None, metrics=None, save_path=".", name="GAN", gan_type='gan',
+                 amp=False, amp_dtype=None, async_save=False):
 
         self.G = G
         self.D = D
@@ -293,11 +316,17 @@ class GANTrainer:
         root = Path(save_path).expanduser().absolute()
         self.save_path = root / 'gan_trainer' / self.name
 
+        self.checkpoint_writer = AsyncWriter() if async_save else None
+
         self.metric_history = defaultdict(list)
         self.device = 'cuda' if CUDA else 'cpu'
         self._timer = Timer()
         self._iterations = 0
 
+        self.amp = amp
+        self.amp_dtype = amp_dtype
+        self.scaler = create_grad_scaler(self.device, amp, amp_dtype)
+
         self.G.to(self.device)
         self.D.to(self.device)
 
@@ -351,7 +380,8 @@ class GANTrainer:
 
         engine = self.create_fn(
             self.G, self.D, self.criterionG, self.criterionD, self.optimizerG, self.optimizerD,
-            self.make_latent, self.metrics, self.device)
+            self.make_latent, self.metrics, self.device,
+            amp=self.amp, amp_dtype=self.amp_dtype, scaler=self.scaler)
         self._attach_timer(engine)
 
         engine.add_event_handler(
@@ -366,6 +396,7 @@ class GANTrainer:
 
         # Run
         engine.run(it, max_iter)
+        self.flush()
 
         # Return history
         return self.metric_history
@@ -381,6 +412,7 @@ class GANTrainer:
             "criterionD": self.criterionD.state_dict(),
             "lr_schedulerG": None,
             "lr_schedulerD": None,
+            "scaler": self.scaler.state_dict(),
             "metric_history": self.metric_history,
         }
         if self.lr_schedulerG:
@@ -404,9 +436,20 @@ class GANTrainer:
             self.lr_schedulerG.load_state_dict(lr_schedulerG)
         if self.lr_schedulerD and lr_schedulerD:
             self.lr_schedulerD.load_state_dict(lr_schedulerD)
+        scaler_state = state_dict.get("scaler")
+        if scaler_state:
+            self.scaler.load_state_dict(scaler_state)
         self.metric_history = metric_history
 
     def save(self, remove_prev=True):
+        if self.checkpoint_writer:
+            self.checkpoint_writer.submit(self._save, snapshot(self.state_dict()), remove_prev)
+        else:
+            self._save(self.state_dict(), remove_prev)
+
+    def _save(self, state_dict, remove_prev):
+        # May run on the writer thread, where self.iterations() can be ahead
+        iterations = state_dict["iterations"]
         d = self.save_path
         d.mkdir(parents=True, exist_ok=True)
 
@@ -417,15 +460,20 @@ class GANTrainer:
                 fp = max(saves, key=lambda f: f.stat().st_mtime)
                 p = "%s_trainer_(?P<iters>[0-9]+).pth" % self.name
                 iters = int(re.match(p, fp.name).group('iters'))
-                if self.iterations() > iters:
+                if iterations > iters:
                     fp.unlink()
 
-        filename = "%s_trainer_%d.pth" % (self.name, self.iterations())
+        filename = "%s_trainer_%d.pth" % (self.name, iterations)
         fp = d / filename
-        torch.save(self.state_dict(), fp)
+        atomic_save(state_dict, fp)
         print("Save trainer as %s" % fp)
 
+    def flush(self):
+        if self.checkpoint_writer:
+            self.checkpoint_writer.flush()
+
     def load(self):
+        self.flush()
         d = self.save_path
         pattern = "%s_trainer*.pth" % self.name
         saves = list(d.glob(pattern))
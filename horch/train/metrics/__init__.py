@@ -6,27 +6,58 @@ from ignite.exceptions import NotComputableError
 from ignite.metrics.metric import Metric
 
 
-class Average(Metric):
+def _materialize(x):
+    if torch.is_tensor(x):
+        return x.item() if x.dim() == 0 else x.tolist()
+    return x
+
+
+class Accumulator(Metric):
+    r"""
+    Base of metrics which sum values over batches.
+
+    Tensors are summed on their device and kept as tensors, so that updates never wait for
+    the device. Values are only transferred in `compute`, with `value`.
+    """
+
+    def reset(self):
+        self._sums = {}
+
+    def add(self, name, val):
+        if torch.is_tensor(val):
+            val = val.detach()
+            if val.is_floating_point():
+                val = val.double()
+        s = self._sums.get(name)
+        self._sums[name] = val if s is None else s + val
+
+    def sum(self, name):
+        return self._sums.get(name, 0)
+
+    def value(self, name):
+        return _materialize(self.sum(name))
+
+
+class Average(Accumulator):
 
     def __init__(self, output_transform):
-        super().__init__(output_transform)
         self._num_examples = 0
-        self._sum = 0
+        super().__init__(output_transform)
 
     def reset(self):
+        super().reset()
         self._num_examples = 0
-        self._sum = 0
 
     def update(self, output):
         val, n = output
-        self._sum += val * n
+        self.add("sum", val * n)
         self._num_examples += n
 
     def compute(self):
         if self._num_examples == 0:
             raise NotComputableError(
                 'Metric must have at least one example before it can be computed')
-        return self._sum / self._num_examples
+        return _materialize(self.sum("sum") / self._num_examples)
 
 
 class TrainLoss(Average):
@@ -54,5 +85,5 @@ class Loss(Average):
 
     def output_transform(self, output):
         y_pred, y_true, batch_size = get(["y_pred", "y_true", "batch_size"], output)
-        loss = self.criterion(y_pred, y_true).item()
+        loss = self.criterion(y_pred, y_true)
         return loss, batch_size
\ No newline at end of file
@@ -22,11 +22,16 @@ def topk_accuracy(y_true, y_pred, k=5):
     k : int
         Default: 5
     """
-    num_examples = np.prod(y_true.size())
+    accuracy, num_examples = _topk_accuracy(y_true, y_pred, k)
+    return accuracy.item(), num_examples
+
+
+def _topk_accuracy(y_true, y_pred, k):
+    # Accuracy as a tensor on the device of predictions
+    num_examples = int(np.prod(y_true.size()))
     topk_pred = torch.topk(y_pred, k=k, dim=1)[1]
-    num_corrects = torch.sum(topk_pred == y_true.unsqueeze(1)).item()
-    accuracy = num_corrects / num_examples
-    return accuracy, num_examples
+    num_corrects = torch.sum(topk_pred == y_true.unsqueeze(1))
+    return num_corrects.double() / num_examples, num_examples
 
 
 class TopKAccuracy(Average):
@@ -44,7 +49,7 @@ class TopKAccuracy(Average):
 
     def output_transform(self, output):
         y_true, y_pred = get(["y_true", "y_pred"], output)
-        return topk_accuracy(y_true, y_pred, k=self.k)
+        return _topk_accuracy(y_true, y_pred, k=self.k)
 
 
 class Accuracy(IgniteAccuracy):
@@ -0,0 +1,196 @@
+from collections import defaultdict
+
+import numpy as np
+import torch
+
+from ignite.exceptions import NotComputableError
+from ignite.metrics import Metric
+
+from horch.boxes import box_iou, box_area, ltwh_to_ltrb
+from horch.datasets.annotations import CocoAnnotations
+
+
+def _match(ious, crowd, thresholds):
+    r"""
+    Greedy matching of COCO for all IoU thresholds at once.
+
+    Parameters
+    ----------
+    ious : (D, G) IoUs of detections sorted by decreasing scores and ground truth.
+    crowd : (G,) whether ground truth is crowd, which is ignored and may be matched many times.
+    thresholds : (T,) IoU thresholds.
+
+    Returns
+    -------
+    matched : (T, D) whether detections are true positives.
+    ignored : (T, D) whether detections are matched to crowd ground truth.
+    """
+    t, (d, g) = len(thresholds), ious.shape
+    matched = np.zeros((t, d), dtype=bool)
+    ignored = np.zeros((t, d), dtype=bool)
+    gt_taken = np.zeros((t, g), dtype=bool)
+    rows = np.arange(t)
+    for i in range(d):
+        candidates = (ious[i] >= thresholds[:, None]) & ~gt_taken
+        normal = np.where(candidates & ~crowd, ious[i], -1)
+        j = normal.argmax(axis=1)
+        hit = normal[rows, j] >= 0
+        matched[hit, i] = True
+        gt_taken[rows[hit], j[hit]] = True
+        crowded = np.where(candidates & crowd & ~hit[:, None], ious[i], -1)
+        ignored[:, i] = crowded.max(axis=1) >= 0
+    return matched, ignored
+
+
+def _average_precision(matched, num_gts, recall_thresholds):
+    if len(matched) == 0:
+        return 0, 0
+    tp = np.cumsum(matched, axis=-1)
+    fp = np.cumsum(~matched, axis=-1)
+    recall = tp / num_gts
+    precision = tp / np.maximum(tp + fp, np.finfo(np.float64).eps)
+    # Precision envelope, then sampled at recall thresholds
+    precision = np.maximum.accumulate(precision[::-1])[::-1]
+    idx = np.searchsorted(recall, recall_thresholds, side='left')
+    sampled = np.where(idx < len(precision), precision[np.minimum(idx, len(precision) - 1)], 0)
+    return sampled.mean(), recall[-1]
+
+
+class CocoAveragePrecision(Metric):
+    r"""
+    COCO-style mAP of detections, evaluated while batches arrive.
+
+    Detections of every image are matched to its ground truth when they arrive, for all IoU
+    thresholds at once, so only scores and match flags are kept until `compute`, which
+    follows the protocol of pycocotools (area range "all").
+
+    Parameters
+    ----------
+    annotations : ``Union[CocoAnnotations, dict, Dataset]``
+        Ground truth, as `CocoAnnotations`, a COCO dict, or a dataset with `annotations`
+        or `to_coco`. Images must come in the same order.
+    metric : ``str``
+        Value returned by `compute`, one of ``AP`` (AP@[.5:.95]), ``AP50``, ``AP75`` and
+        ``AR`` (AR@max_dets). All of them are available in `stats` after `compute`.
+    max_dets : ``int``
+        Maximal number of detections per image and class.
+    label_to_category : ``Union[Sequence[int], Dict[int, int]]``
+        Mapping from predicted labels to `category_id`, identity by default.
+    output_transform : ``callable``
+        Returns (boxes, scores, labels, num_dets) from the output of the engine, like the
+        result of `horch.models.detection.postprocess.postprocess`, with (B, K, 4) boxes of
+        [l, t, r, b] in the coordinates of the annotations, and optionally the indices of
+        the images as the fifth element. Defaults to ``output["y_pred"]``.
+    """
+
+    def __init__(self, annotations, metric='AP', max_dets=100, label_to_category=None, output_transform=None):
+        if not isinstance(annotations, CocoAnnotations):
+            if hasattr(annotations, 'annotations'):
+                annotations = annotations.annotations
+            else:
+                if hasattr(annotations, 'to_coco'):
+                    annotations = annotations.to_coco()
+                annotations = CocoAnnotations.from_coco(annotations)
+        self.annotations = annotations
+        self.metric = metric
+        self.max_dets = max_dets
+        self.label_to_category = label_to_category
+        self.iou_thresholds = np.linspace(0.5, 0.95, 10)
+        self.recall_thresholds = np.linspace(0, 1, 101)
+        self.stats = None
+        super().__init__(output_transform or self.output_transform)
+
+    @staticmethod
+    def output_transform(output):
+        return output["y_pred"]
+
+    def reset(self):
+        self._next_image = 0
+        self._scores = defaultdict(list)
+        self._matched = defaultdict(list)
+        self._ignored = defaultdict(list)
+        self._num_gts = defaultdict(int)
+
+    def _to_categories(self, labels):
+        if self.label_to_category is None:
+            return labels
+        mapping = self.label_to_category
+        if isinstance(mapping, dict):
+            return np.array([mapping[l] for l in labels.tolist()], dtype=np.int64)
+        return np.asarray(mapping)[labels]
+
+    def _update_image(self, index, boxes, scores, labels):
+        ann = self.annotations
+        s, e = ann.ann_offsets[index], ann.ann_offsets[index + 1]
+        gt_boxes = ltwh_to_ltrb(np.asarray(ann.bboxes[s:e], dtype=np.float64))
+        gt_labels = np.asarray(ann.category_ids[s:e])
+        gt_crowd = np.asarray(ann.iscrowd[s:e]).astype(bool)
+        for c in np.union1d(np.unique(labels), np.unique(gt_labels)).tolist():
+            g = gt_labels == c
+            self._num_gts[c] += int((~gt_crowd[g]).sum())
+            d = np.flatnonzero(labels == c)
+            if len(d) == 0:
+                continue
+            d = d[np.argsort(-scores[d], kind='mergesort')][:self.max_dets]
+            if not g.any():
+                # False positives of a class absent from the image
+                matched = ignored = np.zeros((len(self.iou_thresholds), len(d)), dtype=bool)
+            else:
+                ious = box_iou(boxes[d], gt_boxes[g])
+                crowd = gt_crowd[g]
+                if crowd.any():
+                    # IoU with crowd is the fraction of the detection inside it
+                    dt_areas = box_area(boxes[d])[:, None]
+                    inter = ious * (dt_areas + box_area(gt_boxes[g])[None, :]) / (1 + ious)
+                    ious[:, crowd] = (inter / np.maximum(dt_areas, 1e-12))[:, crowd]
+                matched, ignored = _match(ious, crowd, self.iou_thresholds)
+            self._scores[c].append(scores[d])
+            self._matched[c].append(matched)
+            self._ignored[c].append(ignored)
+
+    def update(self, output):
+        boxes, scores, labels, num_dets = output[:4]
+        boxes, scores, labels, num_dets = [
+            x.detach().cpu().numpy() if torch.is_tensor(x) else np.asarray(x)
+            for x in (boxes, scores, labels, num_dets)]
+        if len(output) > 4:
+            indices = np.asarray(output[4].cpu() if torch.is_tensor(output[4]) else output[4])
+        else:
+            indices = np.arange(self._next_image, self._next_image + len(boxes))
+        self._next_image = int(indices.max(initial=self._next_image - 1)) + 1
+        for i, index in enumerate(indices.tolist()):
+            n = int(num_dets[i])
+            self._update_image(index, boxes[i, :n].astype(np.float64), scores[i, :n],
+                               self._to_categories(labels[i, :n].astype(np.int64)))
+
+    def compute(self):
+        if self._next_image == 0:
+            raise NotComputableError(
+                'Metric must have at least one example before it can be computed')
+        t = len(self.iou_thresholds)
+        aps, ars = [], []
+        for c, num_gts in self._num_gts.items():
+            if num_gts == 0:
+                continue
+            if c in self._scores:
+                scores = np.concatenate(self._scores[c])
+                order = np.argsort(-scores, kind='mergesort')
+                matched = np.concatenate(self._matched[c], axis=1)[:, order]
+                ignored = np.concatenate(self._ignored[c], axis=1)[:, order]
+            else:
+                matched = ignored = np.zeros((t, 0), dtype=bool)
+            ap, ar = np.zeros(t), np.zeros(t)
+            for k in range(t):
+                ap[k], ar[k] = _average_precision(matched[k][~ignored[k]], num_gts, self.recall_thresholds)
+            aps.append(ap)
+            ars.append(ar)
+        if not aps:
+            raise NotComputableError('No ground truth to evaluate')
+        aps, ars = np.stack(aps), np.stack(ars)
+        self.stats = {
+            "AP": aps.mean(),
+            "AP50": aps[:, 0].mean(),
+            "AP75": aps[:, 5].mean(),
+            "AR": ars.mean(),
+        }
+        return float(self.stats[self.metric])
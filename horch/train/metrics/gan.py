@@ -1,26 +1,14 @@
 import torch
 from ignite.engine import Events
-from ignite.metrics import Metric
 from toolz.curried import get
 
+from horch.train.metrics import Average
 
-class IAverage(Metric):
-    def __init__(self, output_transform):
-        super().__init__(output_transform)
-        self._num_examples = 0
-        self._sum = 0
 
-    def reset(self):
-        self._num_examples = 0
-        self._sum = 0
-
-    def update(self, output):
-        val, n = output
-        self._sum += val * n
-        self._num_examples += n
-
-    def compute(self):
-        return self._sum / self._num_examples
+class IAverage(Average):
+    r"""
+    `Average` updated at every iteration but only computed when asked, e.g., by `completed`.
+    """
 
     @torch.no_grad()
     def iteration_completed(self, engine):
@@ -28,10 +16,7 @@ class IAverage(Metric):
         self.update(output)
 
     def completed(self, engine, name):
-        result = self.compute()
-        if torch.is_tensor(result) and len(result.shape) == 0:
-            result = result.item()
-        engine.state.metrics[name] = result
+        engine.state.metrics[name] = self.compute()
 
     def attach(self, engine, name):
         if not engine.has_event_handler(self.iteration_completed, Events.ITERATION_COMPLETED):
@@ -1,15 +1,43 @@
-from PIL import Image
 from toolz.curried import get
 
 import numpy as np
 
 import torch
+import torch.distributed as dist
+from ignite.exceptions import NotComputableError
 from ignite.metrics import Metric
 
-from horch.train.metrics import Average
+from horch.train.metrics import Accumulator
 
 
-class MeanIoU(Metric):
+def _all_reduce(t):
+    # Sum over processes for distributed evaluation, on a copy so compute can be called again
+    if dist.is_available() and dist.is_initialized():
+        t = t.clone()
+        dist.all_reduce(t)
+    return t
+
+
+def _as_tensor(y, device):
+    if torch.is_tensor(y):
+        return y.to(device)
+    return torch.from_numpy(np.stack([np.asarray(img) for img in y])).to(device)
+
+
+class ConfusionMatrix(Metric):
+    r"""
+    Confusion matrix of semantic segmentation, accumulated on the device of predictions.
+
+    Every batch is counted by one `torch.bincount`, and the matrix is only transferred
+    (and summed over processes if distributed) in `compute`.
+
+    Parameters
+    ----------
+    num_classes : int
+        Number of classes.
+    ignore_index : int
+        Label of pixels to ignore. Labels out of [0, num_classes) are always ignored.
+    """
 
     def __init__(self, num_classes, ignore_index=None):
         self.num_classes = num_classes
@@ -17,34 +45,36 @@ class MeanIoU(Metric):
         super().__init__(self.output_transform)
 
     def reset(self):
-        self.total_cm = np.zeros(self.num_classes, self.num_classes)
-
-    def update(self, output):
-        cm = output
-        self.total_cm += cm
+        self.total_cm = None
 
     def output_transform(self, output):
-        y_true, y_pred = get(["y_true", "y_pred"], output)
-        c = self.num_classes
+        return get(["y_true", "y_pred"], output)
 
-        if isinstance(y_true, Image.Image):
-            y_true = [np.array(img) for img in y_true]
-        elif torch.is_tensor(y_true):
-            y_true = y_true.cpu().byte().numpy()
-
-        y_pred = y_pred.argmax(dim=1)
-        y_pred = y_pred.cpu().byte().numpy()
-
-        y_pred = y_pred.reshape(-1)
-        y_true = y_true.reshape(-1)
+    def update(self, output):
+        y_true, y_pred = output
+        c = self.num_classes
+        if y_pred.dim() == 4:
+            y_pred = y_pred.argmax(dim=1)
+        y_true = _as_tensor(y_true, y_pred.device).reshape(-1).long()
+        y_pred = y_pred.reshape(-1).long()
 
+        mask = (y_true >= 0) & (y_true < c)
         if self.ignore_index is not None:
-            mask = np.not_equal(y_true, self.ignore_index)
-            y_pred = np.where(mask, y_pred, c)
-            y_true = np.where(mask, y_true, c)
+            mask &= y_true != self.ignore_index
+        cm = torch.bincount(y_true[mask] * c + y_pred[mask], minlength=c * c).view(c, c)
+        if self.total_cm is None:
+            self.total_cm = cm
+        else:
+            self.total_cm += cm
 
-        current_cm = confusion_matrix(y_true, y_pred, self.num_classes + 1)[:c, :c]
-        return current_cm
+    def confusion_matrix(self):
+        if self.total_cm is None:
+            raise NotComputableError(
+                'Metric must have at least one example before it can be computed')
+        return _all_reduce(self.total_cm).cpu().double()
+
+    def compute(self):
+        return self.confusion_matrix()
 
 
 def confusion_matrix(y_true, y_pred, num_classes):
@@ -52,31 +82,100 @@ def confusion_matrix(y_true, y_pred, num_classes):
     return np.reshape(np.bincount(y_true * c + y_pred, minlength=c * c), (c, c))
 
 
-class PixelAccuracy(Average):
+def class_iou(cm):
+    tp = cm.diag()
+    return tp / (cm.sum(0) + cm.sum(1) - tp)
+
+
+def class_dice(cm):
+    tp = cm.diag()
+    return 2 * tp / (cm.sum(0) + cm.sum(1))
+
+
+def _nanmean(x):
+    valid = ~torch.isnan(x)
+    return (x[valid].sum() / valid.sum()).item()
+
+
+class MeanIoU(ConfusionMatrix):
+    r"""
+    Mean of IoUs of classes present in labels or predictions.
+    """
+
+    def compute(self):
+        return _nanmean(class_iou(self.confusion_matrix()))
+
+
+class ClassIoU(ConfusionMatrix):
+    r"""
+    IoU of every class, NaN for classes absent in both labels and predictions.
+    """
+
+    def compute(self):
+        return class_iou(self.confusion_matrix()).tolist()
+
+
+class FrequencyWeightedIoU(ConfusionMatrix):
+
+    def compute(self):
+        cm = self.confusion_matrix()
+        freq = cm.sum(1) / cm.sum()
+        iou = class_iou(cm)
+        valid = freq > 0
+        return (freq[valid] * iou[valid]).sum().item()
+
+
+class MeanDice(ConfusionMatrix):
+
+    def compute(self):
+        return _nanmean(class_dice(self.confusion_matrix()))
+
+
+class PixelAccuracy(Metric):
+    r"""
+    Fraction of correctly classified pixels, excluding ignored ones.
+
+    Counts are accumulated on the device of predictions and only transferred in `compute`.
+    With a confusion matrix, it also equals ``cm.diag().sum() / cm.sum()``.
+    """
 
     def __init__(self, ignore_index=255):
         self.ignore_index = ignore_index
         super().__init__(self.output_transform)
 
+    def reset(self):
+        self._correct = 0
+        self._total = 0
+
     def output_transform(self, output):
-        y_true, y_pred, batch_size = get(
-            ["y_true", "y_pred", "batch_size"], output)
+        return get(["y_true", "y_pred"], output)
 
-        y_pred = y_pred.argmax(dim=1)
+    def update(self, output):
+        y_true, y_pred = output
+        if y_pred.dim() == 4:
+            y_pred = y_pred.argmax(dim=1)
+        y_true = _as_tensor(y_true, y_pred.device)
+        correct = y_true == y_pred
+        if self.ignore_index is not None:
+            valid = y_true != self.ignore_index
+            correct &= valid
+            self._total += valid.sum()
+        else:
+            self._total += torch.tensor(correct.numel(), device=correct.device)
+        self._correct += correct.sum()
 
-        accs = []
-        for i in range(batch_size):
-            y = y_true[i]
-            p = y_pred[i]
-            tp = (y == p).sum()
-            if self.ignore_index is not None:
-                tp += (y == self.ignore_index).sum()
-            accs.append(tp.cpu().item() / np.prod(y.shape))
-        acc = np.mean(accs)
-        return acc, batch_size
+    def compute(self):
+        if not torch.is_tensor(self._total):
+            raise NotComputableError(
+                'Metric must have at least one example before it can be computed')
+        correct, total = _all_reduce(torch.stack([self._correct, self._total]).double()).tolist()
+        if total == 0:
+            raise NotComputableError(
+                'Metric must have at least one example before it can be computed')
+        return correct / total
 
 
-class F1Score(Metric):
+class F1Score(Accumulator):
     r"""
     """
 
@@ -87,20 +186,16 @@ class F1Score(Metric):
         self.from_logits = from_logits
         super().__init__(self.output_transform)
 
-    def reset(self):
-        self.tp = 0
-        self.fp = 0
-        self.fn = 0
-
     def update(self, output):
         tp, fp, fn = output
-        self.tp += tp
-        self.fp += fp
-        self.fn += fn
+        self.add("tp", tp)
+        self.add("fp", fp)
+        self.add("fn", fn)
 
     def compute(self):
-        p = self.tp / (self.tp + self.fp + self.eps)
-        r = self.tp / (self.tp + self.fn + self.eps)
+        tp, fp, fn = self.value("tp"), self.value("fp"), self.value("fn")
+        p = tp / (tp + fp + self.eps)
+        r = tp / (tp + fn + self.eps)
 
         f1 = 2 * p * r / (p + r + self.eps)
         return f1
@@ -127,7 +222,7 @@ class F1Score(Metric):
             w = torch.ones_like(y)
         else:
             w = (y != self.ignore_index).long()
-        tp = torch.sum(p * y * w).item()
-        fp = torch.sum((1 - p) * y * w).item()
-        fn = torch.sum(p * (1 - y) * w).item()
+        tp = torch.sum(p * y * w)
+        fp = torch.sum((1 - p) * y * w)
+        fn = torch.sum(p * (1 - y) * w)
         return tp, fp, fn
\ No newline at end of file
@@ -0,0 +1,191 @@
+import itertools
+import threading
+from collections.abc import Sequence, Mapping
+from queue import Queue, Empty, Full
+
+import torch
+
+from horch.common import ProtectedSeq
+
+
+def _apply(f, t):
+    if torch.is_tensor(t):
+        return f(t)
+    elif isinstance(t, ProtectedSeq):
+        return t
+    elif isinstance(t, Sequence) and not isinstance(t, str):
+        return t.__class__(_apply(f, x) for x in t)
+    elif isinstance(t, Mapping):
+        return t.__class__((k, _apply(f, v)) for k, v in t.items())
+    else:
+        return t
+
+
+class _End:
+    pass
+
+
+class _ExceptionHolder:
+
+    def __init__(self, exc):
+        self.exc = exc
+
+
+# The queue is polled in short intervals so that the thread notices `stop` quickly
+POLL_INTERVAL = 0.1
+
+
+def _put(q, item, stop):
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=POLL_INTERVAL)
+            return True
+        except Full:
+            continue
+    return False
+
+
+def _load_loop(it, q, stop):
+    try:
+        for batch in it:
+            if not _put(q, batch, stop):
+                return
+    except Exception as e:
+        _put(q, _ExceptionHolder(e), stop)
+    else:
+        _put(q, _End(), stop)
+
+
+class _BackgroundIter:
+
+    def __init__(self, loader, num_buffers):
+        self.queue = Queue(maxsize=num_buffers)
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=_load_loop, args=(iter(loader), self.queue, self.stop))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def close(self):
+        # Unblocks the thread, which then drops the loader iterator and its batches
+        self.stop.set()
+        self.thread.join()
+        while True:
+            try:
+                self.queue.get_nowait()
+            except Empty:
+                break
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        batch = self.queue.get()
+        if isinstance(batch, _End):
+            raise StopIteration
+        elif isinstance(batch, _ExceptionHolder):
+            raise batch.exc
+        return batch
+
+
+class DataPrefetcher:
+    r"""
+    Wraps a data loader and prepares the next batches while the current one
+    is being consumed.
+
+    Batches are loaded by a background thread into a queue of `num_buffers`
+    batches. If `device` is a CUDA device, tensors are also staged through
+    reusable page-locked buffers and copied to the device with
+    ``non_blocking=True`` on a side stream, so that the next host-to-device copy
+    overlaps with the current step. Otherwise it is a pure CPU double-buffering
+    prefetcher.
+
+    Parameters
+    ----------
+    loader : Iterable
+        Data loader to prefetch from.
+    device : str or torch.device
+        Device to put batches on.
+    num_buffers : int
+        Number of batches loaded in advance.
+    """
+
+    def __init__(self, loader, device=None, num_buffers=2):
+        self.loader = loader
+        self.device = torch.device(device or 'cpu')
+        self.num_buffers = num_buffers
+        self._cuda = self.device.type == 'cuda' and torch.cuda.is_available()
+        self._pinned = [{} for _ in range(num_buffers)]
+        self._events = [None] * num_buffers
+        self._it = None
+
+    def __len__(self):
+        return len(self.loader)
+
+    def _stage(self, batch, slot, stream):
+        buffers = self._pinned[slot]
+        # The last copy from this slot's buffers must be done before reusing them
+        if self._events[slot] is not None:
+            self._events[slot].synchronize()
+        counter = itertools.count()
+
+        def copy(t):
+            if t.is_cuda:
+                return t
+            i = next(counter)
+            buf = buffers.get(i)
+            if buf is None or buf.shape != t.shape or buf.dtype != t.dtype:
+                buf = torch.empty_like(t, device='cpu').pin_memory()
+                buffers[i] = buf
+            buf.copy_(t)
+            return buf.to(self.device, non_blocking=True)
+
+        with torch.cuda.stream(stream):
+            batch = _apply(copy, batch)
+            event = torch.cuda.Event()
+            event.record(stream)
+        self._events[slot] = event
+        return batch
+
+    def _cuda_iter(self, it):
+        stream = torch.cuda.Stream(self.device)
+        slot = 0
+        try:
+            staged = self._stage(next(it), slot, stream)
+        except StopIteration:
+            return
+        while True:
+            current_stream = torch.cuda.current_stream(self.device)
+            current_stream.wait_stream(stream)
+            # Memory of the batch is allocated on the side stream, make sure it
+            # isn't reused before the consumer is done with it.
+            _apply(lambda t: t.record_stream(current_stream), staged)
+            current = staged
+            try:
+                batch = next(it)
+            except StopIteration:
+                yield current
+                return
+            slot = (slot + 1) % self.num_buffers
+            staged = self._stage(batch, slot, stream)
+            yield current
+
+    def __iter__(self):
+        self.close()
+        it = self._it = _BackgroundIter(self.loader, self.num_buffers)
+        if self._cuda:
+            return self._cuda_iter(it)
+        return it
+
+    def close(self):
+        r"""
+        Stops the background thread of the current iteration, e.g., when it is stopped
+        early, and releases the loader iterator and the pinned buffers.
+        """
+        if self._it is not None:
+            self._it.close()
+            self._it = None
+        for event in self._events:
+            if event is not None:
+                event.synchronize()
+        self._pinned = [{} for _ in range(self.num_buffers)]
+        self._events = [None] * self.num_buffers
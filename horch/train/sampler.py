@@ -1,6 +1,8 @@
+import itertools
 from math import inf
 
 from torch.utils.data.sampler import Sampler, RandomSampler, BatchSampler, SequentialSampler
+from torch.utils.data.distributed import DistributedSampler
 
 
 class IterationBasedBatchSampler(Sampler):
@@ -66,3 +68,46 @@ class IterSampler(Sampler):
 
     def __len__(self):
         return self.num_iterations
+
+
+class DistributedIterSampler(Sampler):
+    """
+    Like IterSampler, but each process only samples its own shard of the dataset.
+    The order of batches is determined by the number of passes over the dataset,
+    so it resumes exactly from `start_iter`.
+
+    Arguments:
+        num_replicas (int, optional): Number of processes participating in
+            distributed training. Default to the world size.
+        rank (int, optional): Rank of the current process. Default to the
+            current rank.
+    """
+
+    def __init__(self, data_source, batch_size, shuffle=True, drop_last=False, num_iterations=inf, start_iter=0,
+                 num_replicas=None, rank=None):
+        super().__init__(data_source)
+        sampler = DistributedSampler(data_source, num_replicas=num_replicas, rank=rank, shuffle=shuffle)
+        self.data_source = data_source
+        self.num_iterations = num_iterations
+        self.batch_sampler = BatchSampler(sampler, batch_size=batch_size, drop_last=drop_last)
+        if len(self.batch_sampler) == 0:
+            raise ValueError("No batch in the shard of %d samples with batch_size=%d and drop_last, "
+                             "the dataset of %d samples is too small for %d replicas"
+                             % (len(sampler), batch_size, len(data_source), sampler.num_replicas))
+        self.start_iter = start_iter
+
+    def __iter__(self):
+        iteration = self.start_iter
+        epoch, offset = divmod(iteration, len(self.batch_sampler))
+        while iteration < self.num_iterations:
+            self.batch_sampler.sampler.set_epoch(epoch)
+            for batch in itertools.islice(self.batch_sampler, offset, None):
+                if iteration >= self.num_iterations:
+                    return
+                iteration += 1
+                yield batch
+            epoch += 1
+            offset = 0
+
+    def __len__(self):
+        return self.num_iterations
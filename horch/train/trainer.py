@@ -6,15 +6,19 @@ from pathlib import Path
 from toolz.curried import get, keyfilter
 
 import torch
+import torch.distributed as dist
+from torch.nn.parallel import DistributedDataParallel
 
 from ignite.engine import Engine, Events, _prepare_batch
 from ignite.handlers import Timer
 from tensorboardX import SummaryWriter
 
 from horch.common import CUDA
+from horch.ext.checkpoint import AsyncWriter
 from horch.train.metrics import TrainLoss, Loss
-from horch.train._utils import set_lr
-from torch.nn.utils import clip_grad_value_
+from horch.train._utils import set_lr, autocast, create_grad_scaler
+from horch.train.prefetch import DataPrefetcher
+from torch.nn.utils import clip_grad_value_, clip_grad_norm_
 from torch.utils.data import DataLoader
 from typing import Sequence, Dict
 
@@ -27,7 +31,8 @@ def set_training(model):
 
 
 def create_supervised_evaluator(model, metrics=None,
-                                device=None, prepare_batch=_prepare_batch):
+                                device=None, prepare_batch=_prepare_batch, non_blocking=False,
+                                amp=False, amp_dtype=None):
     if metrics is None:
         metrics = {}
     if device:
@@ -36,8 +41,9 @@ def create_supervised_evaluator(model, metrics=None,
     def _inference(engine, batch):
         model.eval()
         with torch.no_grad():
-            x, y_true = prepare_batch(batch, device=device)
-            y_pred = model(x)
+            x, y_true = prepare_batch(batch, device=device, non_blocking=non_blocking)
+            with autocast(device, amp, amp_dtype):
+                y_pred = model(x)
             output = {
                 "y_pred": y_pred,
                 "y_true": y_true,
@@ -57,31 +63,72 @@ def create_supervised_trainer(
         model, criterion, optimizer, metrics=None,
         device=None, prepare_batch=_prepare_batch,
         grad_clip_value=None, accumulation_steps=1,
-        fp16=False):
+        fp16=False, non_blocking=False, amp=False, amp_dtype=None, scaler=None,
+        grad_clip_norm=None, batch_transform=None):
+    r"""
+    With `accumulation_steps` > 1, each batch is a micro-batch: its loss is divided by
+    `accumulation_steps`, gradients are clipped and the optimizer steps only once every
+    `accumulation_steps` iterations, and gradient reduction of models with `no_sync`
+    (DistributedDataParallel) is skipped on the other micro-steps.
+
+    The loss in the output is a detached tensor, so no device sync happens until
+    metrics are computed.
+
+    `batch_transform` is a transform of `(x, y_true)` applied to each batch on `device`
+    after it is prepared, e.g. from `horch.transforms.batch`.
+    """
     if metrics is None:
         metrics = {}
     if device:
         model.to(device)
+    if scaler is None:
+        scaler = create_grad_scaler(device, amp, amp_dtype)
 
-    def _update(engine, batch):
-        set_training(model)
-        x, y_true = prepare_batch(batch, device=device)
-        y_pred = model(x)
-        loss = criterion(y_pred, y_true)
+    def _backward(loss):
         if fp16:
-            from apex import amp
-            with amp.scale_loss(loss, optimizer) as scaled_loss:
+            from apex import amp as apex_amp
+            with apex_amp.scale_loss(loss, optimizer) as scaled_loss:
                 scaled_loss.backward()
         else:
-            loss.backward()
-        if engine.state.iteration % accumulation_steps == 0:
-            optimizer.step()
-            optimizer.zero_grad()
+            scaler.scale(loss).backward()
+
+    def _clip_grad():
+        if fp16:
+            from apex import amp as apex_amp
+            params = apex_amp.master_params(optimizer)
+        else:
+            scaler.unscale_(optimizer)
+            params = model.parameters()
         if grad_clip_value:
-            clip_grad_value_(model.parameters(), grad_clip_value)
+            clip_grad_value_(params, grad_clip_value)
+        else:
+            clip_grad_norm_(params, grad_clip_norm)
+
+    def _update(engine, batch):
+        set_training(model)
+        x, y_true = prepare_batch(batch, device=device, non_blocking=non_blocking)
+        if batch_transform is not None:
+            with torch.no_grad():
+                x, y_true = batch_transform(x, y_true)
+        final_step = engine.state.iteration % accumulation_steps == 0
+        with autocast(device, amp, amp_dtype):
+            y_pred = model(x)
+            loss = criterion(y_pred, y_true)
+        micro_loss = loss / accumulation_steps if accumulation_steps > 1 else loss
+        if final_step or not hasattr(model, "no_sync"):
+            _backward(micro_loss)
+        else:
+            with model.no_sync():
+                _backward(micro_loss)
+        if final_step:
+            if grad_clip_value or grad_clip_norm:
+                _clip_grad()
+            scaler.step(optimizer)
+            scaler.update()
+            optimizer.zero_grad()
         outs = {
             "y_true": y_true,
-            "loss": loss.item(),
+            "loss": loss.detach(),
             "batch_size": x.size(0),
             "y_pred": y_pred.detach(),
         }
@@ -104,40 +151,96 @@ def _evaluate(engine, evaluator, val_loader, per_epochs):
         evaluator.run(val_loader)
 
 
+def _all_reduce_metrics(engine, device):
+    # Average metrics over processes. Exact for averages when every process
+    # sees the same number of examples, like with DistributedSampler.
+    world_size = dist.get_world_size()
+    for name, val in engine.state.metrics.items():
+        t = torch.tensor(val, dtype=torch.float64, device=device)
+        dist.all_reduce(t)
+        t /= world_size
+        engine.state.metrics[name] = t.item() if isinstance(val, float) else t.tolist()
+
+
+def _set_epoch(engine, sampler, trainer):
+    sampler.set_epoch(trainer.epochs())
+
+
+class _DummyWriter:
+
+    def __getattr__(self, item):
+        return lambda *args, **kwargs: None
+
+
 class Trainer:
 
     def __init__(self, model, criterion, optimizer, lr_scheduler=None,
-                 metrics=None, test_metrics=None, save_path=".", name="Net", fp16=False):
-
+                 metrics=None, test_metrics=None, save_path=".", name="Net", fp16=False,
+                 amp=False, amp_dtype=None, distributed=False, async_save=False):
+        r"""
+        fp16 : bool
+            Mixed precision through apex.amp at opt_level O1.
+        amp : bool
+            Native mixed precision with torch.autocast and GradScaler, which also works
+            on CPU. Mutually exclusive with `fp16`.
+        amp_dtype : torch.dtype
+            Autocast dtype. Defaults to float16 on CUDA and bfloat16 on CPU.
+        distributed : bool
+            Train with DistributedDataParallel in an initialized process group (gloo on CPU,
+            nccl on the current CUDA device). Metrics are averaged over processes and only
+            rank 0 writes logs and checkpoints. Data loaders should be sharded, e.g. with
+            DistributedSampler or DistributedIterSampler.
+        async_save : bool
+            Snapshot checkpoints to CPU memory and write them on a background thread
+            instead of blocking training. Pending writes are flushed at the end of `fit`.
+        """
+        assert not (fp16 and amp), "fp16 (apex) and amp (native) can't be used together"
+        assert not distributed or dist.is_initialized(), "Process group must be initialized for distributed"
         self.fp16 = fp16
-        self.device = 'cuda' if CUDA else 'cpu'
+        self.amp = amp
+        self.amp_dtype = amp_dtype
+        self.distributed = distributed
+        self.rank = dist.get_rank() if distributed else 0
+        if distributed and CUDA:
+            self.device = 'cuda:%d' % torch.cuda.current_device()
+        else:
+            self.device = 'cuda' if CUDA else 'cpu'
         model.to(self.device)
         if self.fp16:
-            from apex import amp
-            model, optimizer = amp.initialize(model, optimizer, opt_level="O1", verbosity=0)
+            from apex import amp as apex_amp
+            model, optimizer = apex_amp.initialize(model, optimizer, opt_level="O1", verbosity=0)
+        self.scaler = create_grad_scaler(self.device, amp, amp_dtype)
 
         self.model = model
+        # The wrapper is only used for training, evaluation and checkpoints use the module
+        if distributed:
+            self.ddp_model = DistributedDataParallel(
+                model, device_ids=[torch.cuda.current_device()] if CUDA else None)
+        else:
+            self.ddp_model = model
         self.criterion = criterion
         self.optimizer = optimizer
         self.lr_scheduler = lr_scheduler
         self.metrics = metrics or {}
         self.test_metrics = test_metrics
         if test_metrics is None:
-            self.test_metrics = metrics.copy()
-            if 'loss' in metrics and isinstance(metrics['loss'], TrainLoss):
+            self.test_metrics = self.metrics.copy()
+            if 'loss' in self.metrics and isinstance(self.metrics['loss'], TrainLoss):
                 self.test_metrics['loss'] = Loss(criterion=criterion)
         self.save_path = os.path.join(save_path, 'trainer')
         self.name = name
 
         current_time = datetime.now().strftime('%b%d_%H-%M-%S')
         log_dir = os.path.join(save_path, 'runs', self.name, current_time)
-        self.writer = SummaryWriter(log_dir)
+        self.writer = SummaryWriter(log_dir) if self.rank == 0 else _DummyWriter()
+
+        self.checkpoint_writer = AsyncWriter() if async_save else None
 
         self.metric_history = defaultdict(list)
         self._timer = Timer()
         self._epochs = 0
 
-        self._verbose = True
+        self._verbose = self.rank == 0
 
     def _print(self, msg):
         if self._verbose:
@@ -195,37 +298,55 @@ class Trainer:
             self.metric_history["val_" + name].append(val)
         self._print(msg)
 
-    def fit(self, train_loader, epochs=1, val_loader=None, save=None, iterations=None, callbacks=(), grad_clip_value=None, lr_step_on_iter=False, accumulation_steps=1):
+    def fit(self, train_loader, epochs=1, val_loader=None, save=None, iterations=None, callbacks=(), grad_clip_value=None, lr_step_on_iter=False, accumulation_steps=1, prefetch=False, grad_clip_norm=None, batch_transform=None):
+        r"""
+        prefetch : bool
+            If True, the next batches are loaded in a background thread and, on CUDA,
+            copied to the device through pinned buffers while the current step runs.
+        """
+        sampler = getattr(train_loader, "sampler", None)
+        if prefetch:
+            train_loader = DataPrefetcher(train_loader, self.device)
 
         engine = create_supervised_trainer(
-            self.model, self.criterion, self.optimizer,
-            self.metrics, self.device, grad_clip_value=grad_clip_value,
-            accumulation_steps=accumulation_steps, fp16=self.fp16)
+            self.ddp_model, self.criterion, self.optimizer,
+            self.metrics, self.device, grad_clip_value=grad_clip_value, grad_clip_norm=grad_clip_norm,
+            accumulation_steps=accumulation_steps, fp16=self.fp16, non_blocking=CUDA,
+            amp=self.amp, amp_dtype=self.amp_dtype, scaler=self.scaler, batch_transform=batch_transform)
         self._attach_timer(engine)
 
         engine.add_event_handler(
             Events.ITERATION_COMPLETED, self._lr_scheduler_step, lr_step_on_iter)
 
         engine.add_event_handler(Events.EPOCH_STARTED, self._log_epochs, epochs)
+        if hasattr(sampler, "set_epoch"):
+            engine.add_event_handler(Events.EPOCH_STARTED, _set_epoch, sampler, self)
 
         if val_loader is not None:
             if isinstance(val_loader, tuple):
                 val_loader, eval_per_epochs = val_loader
             else:
                 eval_per_epochs = 1
+            if prefetch:
+                val_loader = DataPrefetcher(val_loader, self.device)
             evaluator = create_supervised_evaluator(
-                self.model, self.test_metrics, self.device)
+                self.model, self.test_metrics, self.device, non_blocking=CUDA,
+                amp=self.amp, amp_dtype=self.amp_dtype)
+            if self.distributed:
+                evaluator.add_event_handler(Events.COMPLETED, _all_reduce_metrics, self.device)
             engine.add_event_handler(
                 Events.EPOCH_COMPLETED, _evaluate, evaluator, val_loader, eval_per_epochs)
 
         engine.add_event_handler(Events.EPOCH_COMPLETED, self._increment_epoch)
+        if self.distributed:
+            engine.add_event_handler(Events.EPOCH_COMPLETED, _all_reduce_metrics, self.device)
         engine.add_event_handler(Events.EPOCH_COMPLETED, self._log_results)
         if val_loader is not None:
             engine.add_event_handler(
                 Events.EPOCH_COMPLETED, self._log_val_results, evaluator, eval_per_epochs)
 
         # Set checkpoint
-        if save:
+        if save and self.rank == 0:
             checkpoint_handler = save.parse(self)
             engine.add_event_handler(
                 Events.EPOCH_COMPLETED, checkpoint_handler, {"trainer": self})
@@ -240,7 +361,14 @@ class Trainer:
             epochs = 1000
 
         # Run
-        engine.run(train_loader, epochs)
+        try:
+            engine.run(train_loader, epochs)
+        finally:
+            # Background threads may still be blocked on full queues if stopped early
+            for loader in [train_loader, val_loader]:
+                if isinstance(loader, DataPrefetcher):
+                    loader.close()
+        self.flush()
 
         # Return history
         hist = {metric: hist[-epochs:]
@@ -249,12 +377,13 @@ class Trainer:
             hist = keyfilter(lambda k: not k.startswith("val_"), hist)
         return hist
 
-    def fit1(self, train_loader, epochs, validate=None, save=None, callbacks=(), grad_clip_value=None, lr_step_on_iter=False):
+    def fit1(self, train_loader, epochs, validate=None, save=None, callbacks=(), grad_clip_value=None, lr_step_on_iter=False, grad_clip_norm=None, batch_transform=None):
         validate = ValSet.parse(validate, self)
 
         engine = create_supervised_trainer(
-            self.model, self.criterion, self.optimizer,
-            self.metrics, self.device, grad_clip_value=grad_clip_value)
+            self.ddp_model, self.criterion, self.optimizer,
+            self.metrics, self.device, grad_clip_value=grad_clip_value, grad_clip_norm=grad_clip_norm,
+            amp=self.amp, amp_dtype=self.amp_dtype, scaler=self.scaler, batch_transform=batch_transform)
         self._attach_timer(engine)
 
         engine.add_event_handler(
@@ -273,7 +402,7 @@ class Trainer:
             Events.EPOCH_COMPLETED, _trainer_callback_wrap(validate.log_results))
 
         # Set checkpoint
-        if save:
+        if save and self.rank == 0:
             checkpoint_handler = save.parse(self)
             engine.add_event_handler(
                 Events.EPOCH_COMPLETED, checkpoint_handler, {"trainer": self})
@@ -283,6 +412,7 @@ class Trainer:
                 Events.EPOCH_COMPLETED, _trainer_callback_wrap(callback), self)
 
         engine.run(train_loader, epochs)
+        self.flush()
 
         # Return history
         hist = {metric: hist[-epochs:]
@@ -296,13 +426,14 @@ class Trainer:
             "optimizer": self.optimizer.state_dict(),
             "lr_scheduler": None,
             "amp": None,
+            "scaler": self.scaler.state_dict(),
             "metric_history": self.metric_history,
         }
         if self.lr_scheduler:
             s["lr_scheduler"] = self.lr_scheduler.state_dict()
         if self.fp16:
-            from apex import amp
-            s["amp"] = amp.state_dict()
+            from apex import amp as apex_amp
+            s["amp"] = apex_amp.state_dict()
         return s
 
     def load_state_dict(self, state_dict):
@@ -314,19 +445,32 @@ class Trainer:
         if self.lr_scheduler and lr_scheduler:
             self.lr_scheduler.load_state_dict(lr_scheduler)
         if self.fp16 and amp_state is not None:
-            from apex import amp
-            amp.load_state_dict(amp_state)
+            from apex import amp as apex_amp
+            apex_amp.load_state_dict(amp_state)
+        scaler_state = state_dict.get("scaler")
+        if scaler_state:
+            self.scaler.load_state_dict(scaler_state)
         self.metric_history = metric_history
 
     def save(self):
+        if self.rank != 0:
+            return
         d = Path(self.save_path)
         d.mkdir(parents=True, exist_ok=True)
         filename = "%s_trainer_%d.pth" % (self.name, self.epochs())
         fp = d / filename
-        torch.save(self.state_dict(), fp)
+        if self.checkpoint_writer:
+            self.checkpoint_writer.save(self.state_dict(), fp)
+        else:
+            torch.save(self.state_dict(), fp)
         self._print("Save trainer as %s" % fp)
 
+    def flush(self):
+        if self.checkpoint_writer:
+            self.checkpoint_writer.flush()
+
     def load(self):
+        self.flush()
         d = Path(self.save_path)
         pattern = "%s_trainer*.pth" % self.name
         saves = list(d.glob(pattern))
@@ -343,7 +487,7 @@ class Trainer:
         if evaluate_metrics is None:
             evaluate_metrics = self.test_metrics
         evaluator = create_supervised_evaluator(
-            self.model, evaluate_metrics, self.device)
+            self.model, evaluate_metrics, self.device, amp=self.amp, amp_dtype=self.amp_dtype)
         return evaluator.run(test_loader).metrics
 
     def set_lr(self, lr):
@@ -402,7 +546,9 @@ class ValSet:
         else:
             raise ValueError("Invalid metrics, got %s" % self.metrics)
         self.evaluator = create_supervised_evaluator(
-            trainer.model, metrics, trainer.device)
+            trainer.model, metrics, trainer.device, amp=trainer.amp, amp_dtype=trainer.amp_dtype)
+        if trainer.distributed:
+            self.evaluator.add_event_handler(Events.COMPLETED, _all_reduce_metrics, trainer.device)
         self.trainer = trainer
 
     def evaluate(self):
@@ -0,0 +1,580 @@
+r"""
+Augmentations of collated batches.
+
+The transforms here take an (N, C, H, W) float tensor in [0, 1] (after ToTensor and before
+Normalize) and its target, draw random parameters per sample and apply them with batched
+torch ops, on the device of the batch. They follow the `JointTransform` protocol, and the
+target may be masks (N, H, W), boxes (a sequence or ProtectedSeq of BoxList, or of (K, 4)
+[l, t, r, b] tensors), or anything else, which is returned unchanged.
+"""
+import math
+import numbers
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from horch.common import ProtectedSeq
+from horch.transforms import JointTransform
+from horch.transforms.detection.boxlist import BoxList
+
+
+def _pixel_to_normalized(h, w, device):
+    return torch.tensor([[2 / w, 0, -1], [0, 2 / h, -1], [0, 0, 1]], device=device)
+
+
+def _sample(input, matrix, mode, fill):
+    n, c, h, w = input.shape
+    norm = _pixel_to_normalized(h, w, input.device)
+    theta = (norm @ matrix.to(input.device, torch.float32) @ torch.inverse(norm))[:, :2]
+    grid = F.affine_grid(theta, [n, c + 1, h, w], align_corners=False)
+    x = torch.cat([input, input.new_ones(n, 1, h, w)], dim=1)
+    x = F.grid_sample(x, grid, mode=mode, padding_mode='zeros', align_corners=False)
+    x, m = x[:, :-1], x[:, -1:]
+    fill = torch.as_tensor(fill, dtype=x.dtype, device=x.device).view(1, -1, 1, 1)
+    return x + (1 - m) * fill
+
+
+def warp_affine(input, matrix, fill=0, mode='bilinear'):
+    r"""
+    Warp images with per-sample affine transforms.
+
+    Parameters
+    ----------
+    input : ``torch.Tensor``
+        Images of shape (N, C, H, W).
+    matrix : ``torch.Tensor``
+        Matrices of shape (N, 3, 3) mapping pixel coordinates of the output to the input.
+    fill : ``Union[Number, Sequence[Number]]``
+        Value of the output pixels mapped from outside the input, per channel if a sequence.
+    mode : ``str``
+        Interpolation mode of `grid_sample`.
+    """
+    return _sample(input, matrix, mode, fill)
+
+
+def warp_mask(mask, matrix, fill=0):
+    r"""
+    Warp label masks of shape (N, H, W) with nearest interpolation. See `warp_affine`.
+    """
+    x = _sample(mask.unsqueeze(1).float(), matrix, 'nearest', fill)
+    return x.squeeze(1).round().to(mask.dtype)
+
+
+def _warp_boxes(boxes, matrix, size):
+    # Boxes of [l, t, r, b] are mapped to the box enclosing their transformed corners
+    w, h = size
+    l, t, r, b = boxes.unbind(1)
+    xs = torch.stack([l, r, l, r], dim=1)
+    ys = torch.stack([t, t, b, b], dim=1)
+    m = matrix.to(boxes.device, boxes.dtype)
+    nx = m[0, 0] * xs + m[0, 1] * ys + m[0, 2]
+    ny = m[1, 0] * xs + m[1, 1] * ys + m[1, 2]
+    return torch.stack([
+        nx.min(dim=1)[0].clamp(0, w), ny.min(dim=1)[0].clamp(0, h),
+        nx.max(dim=1)[0].clamp(0, w), ny.max(dim=1)[0].clamp(0, h),
+    ], dim=1)
+
+
+def _warp_boxlist(boxes, matrix, size):
+    ltwh = torch.from_numpy(boxes.boxes).double()
+    ltrb = torch.cat([ltwh[:, :2], ltwh[:, :2] + ltwh[:, 2:]], dim=1)
+    ltrb = _warp_boxes(ltrb, matrix.double(), size)
+    wh = ltrb[:, 2:] - ltrb[:, :2]
+    ltwh = torch.cat([ltrb[:, :2], wh], dim=1).numpy().astype(boxes.boxes.dtype)
+    keep = (wh > 0).all(dim=1).numpy()
+    return boxes.with_boxes(ltwh).select(keep)
+
+
+def _is_mask(target, input):
+    return torch.is_tensor(target) and target.dim() == 3 and target.shape[-2:] == input.shape[-2:]
+
+
+def _is_boxes(target):
+    return isinstance(target, list) and len(target) != 0 and (
+            isinstance(target[0], BoxList) or
+            (torch.is_tensor(target[0]) and target[0].dim() == 2 and target[0].size(1) == 4))
+
+
+def _unwrap(target):
+    if isinstance(target, ProtectedSeq):
+        return list(target.seq), True
+    if isinstance(target, tuple) and len(target) != 0 and isinstance(target[0], BoxList):
+        return list(target), False
+    return target, False
+
+
+def _wrap(target, protected):
+    return ProtectedSeq(target) if protected else target
+
+
+def _index(target, input, idx):
+    if _is_mask(target, input):
+        return target[idx.to(target.device)]
+    elif _is_boxes(target):
+        return [target[i] for i in idx.tolist()]
+    return target
+
+
+def _assign(target, input, idx, value):
+    if _is_mask(target, input):
+        target = target.clone()
+        target[idx.to(target.device)] = value
+    elif _is_boxes(target):
+        target = list(target)
+        for i, v in zip(idx.tolist(), value):
+            target[i] = v
+    return target
+
+
+def _warp_target(target, input, matrix, fill):
+    if _is_mask(target, input):
+        return warp_mask(target, matrix, fill)
+    elif _is_boxes(target):
+        # Boxes are mapped forward, the matrices map the output to the input
+        forward = torch.inverse(matrix.double().cpu())
+        size = input.shape[-1], input.shape[-2]
+        return [
+            _warp_boxlist(b, m, size) if isinstance(b, BoxList) else _warp_boxes(b, m, size)
+            for b, m in zip(target, forward)
+        ]
+    return target
+
+
+def _translation(x, y):
+    m = torch.eye(3).repeat(len(x), 1, 1)
+    m[:, 0, 2] = x
+    m[:, 1, 2] = y
+    return m
+
+
+def _rotation(angles, h, w):
+    # Counter-clockwise around the center for positive angles, like PIL's rotate
+    theta = -angles * math.pi / 180
+    m = torch.eye(3).repeat(len(angles), 1, 1)
+    m[:, 0, 0] = theta.cos()
+    m[:, 0, 1] = theta.sin()
+    m[:, 1, 0] = -theta.sin()
+    m[:, 1, 1] = theta.cos()
+    return _translation(torch.full_like(angles, w / 2), torch.full_like(angles, h / 2)) @ m @ \
+        _translation(torch.full_like(angles, -w / 2), torch.full_like(angles, -h / 2))
+
+
+def _random_signs(n):
+    return torch.randint(2, (n,)).float() * 2 - 1
+
+
+def _factor(x, magnitude, signs):
+    return (1 + magnitude * signs).to(x.device, x.dtype).view(-1, 1, 1, 1)
+
+
+def _blend(degenerate, x, factor):
+    return (degenerate + factor * (x - degenerate)).clamp(0, 1)
+
+
+def _grayscale(x):
+    if x.size(1) == 3:
+        r, g, b = x.unbind(1)
+        return (0.299 * r + 0.587 * g + 0.114 * b).unsqueeze(1)
+    return x
+
+
+def _quantize(x):
+    return (x * 255).round().long().clamp(0, 255)
+
+
+def _shear_x(x, magnitude, signs):
+    m = torch.eye(3).repeat(len(x), 1, 1)
+    m[:, 0, 1] = magnitude * signs
+    return m
+
+
+def _shear_y(x, magnitude, signs):
+    m = torch.eye(3).repeat(len(x), 1, 1)
+    m[:, 1, 0] = magnitude * signs
+    return m
+
+
+def _translate_x(x, magnitude, signs):
+    return _translation(magnitude * x.size(3) * signs, torch.zeros(len(x)))
+
+
+def _translate_y(x, magnitude, signs):
+    return _translation(torch.zeros(len(x)), magnitude * x.size(2) * signs)
+
+
+def _rotate(x, magnitude, signs):
+    return _rotation(torch.full((len(x),), float(magnitude)), x.size(2), x.size(3))
+
+
+def _color(x, magnitude, signs):
+    return _blend(_grayscale(x), x, _factor(x, magnitude, signs))
+
+
+def _contrast(x, magnitude, signs):
+    mean = _grayscale(x).mean(dim=(1, 2, 3), keepdim=True)
+    return _blend(mean, x, _factor(x, magnitude, signs))
+
+
+def _brightness(x, magnitude, signs):
+    return _blend(torch.zeros_like(x), x, _factor(x, magnitude, signs))
+
+
+def _sharpness(x, magnitude, signs):
+    # PIL's SMOOTH filter, which leaves the border pixels unchanged
+    c = x.size(1)
+    kernel = x.new_tensor([[1, 1, 1], [1, 5, 1], [1, 1, 1]]) / 13
+    degenerate = x.clone()
+    degenerate[..., 1:-1, 1:-1] = F.conv2d(x, kernel.expand(c, 1, 3, 3), groups=c)
+    return _blend(degenerate, x, _factor(x, magnitude, signs))
+
+
+def _posterize(x, magnitude, signs):
+    shift = 8 - int(magnitude)
+    return ((_quantize(x) >> shift) << shift).to(x.dtype) / 255
+
+
+def _solarize(x, magnitude, signs):
+    return torch.where(_quantize(x) >= magnitude, 1 - x, x)
+
+
+def _autocontrast(x, magnitude, signs):
+    flat = x.flatten(2)
+    lo = flat.min(dim=2)[0][..., None, None]
+    hi = flat.max(dim=2)[0][..., None, None]
+    scale = torch.where(hi > lo, 1 / (hi - lo), torch.ones_like(hi))
+    lo = torch.where(hi > lo, lo, torch.zeros_like(lo))
+    return ((x - lo) * scale).clamp(0, 1)
+
+
+def _equalize(x, magnitude, signs):
+    # Per-channel histogram equalization with the lookup table of PIL's ImageOps.equalize
+    q = _quantize(x).flatten(2)
+    hist = torch.zeros(*q.shape[:2], 256, dtype=torch.long, device=x.device)
+    hist.scatter_add_(2, q, torch.ones_like(q))
+    bins = torch.arange(256, device=x.device)
+    last_bin = (bins * (hist != 0).long()).max(dim=2, keepdim=True)[0]
+    step = (q.size(2) - hist.gather(2, last_bin)) // 255
+    lut = (step // 2 + hist.cumsum(2) - hist) // step.clamp(min=1)
+    lut = lut.clamp(max=255)
+    out = lut.gather(2, q).to(x.dtype).view_as(x) / 255
+    return torch.where((step == 0).unsqueeze(-1), x, out)
+
+
+def _invert(x, magnitude, signs):
+    return 1 - x
+
+
+# name: (function, geometric)
+_OPS = {
+    "shearX": (_shear_x, True),
+    "shearY": (_shear_y, True),
+    "translateX": (_translate_x, True),
+    "translateY": (_translate_y, True),
+    "rotate": (_rotate, True),
+    "color": (_color, False),
+    "posterize": (_posterize, False),
+    "solarize": (_solarize, False),
+    "contrast": (_contrast, False),
+    "sharpness": (_sharpness, False),
+    "brightness": (_brightness, False),
+    "autocontrast": (_autocontrast, False),
+    "equalize": (_equalize, False),
+    "invert": (_invert, False),
+}
+
+
+def _fill_value(fillcolor, c):
+    fill = np.broadcast_to(np.asarray(fillcolor, dtype=np.float32) / 255, (c,))
+    return tuple(fill.tolist())
+
+
+class AutoAugment(JointTransform):
+    """
+    Apply an AutoAugment policy of `horch.transforms.ext` to a batch, choosing one sub-policy
+    per sample.
+
+    Parameters
+    ----------
+    policy : ``Union[ImageNetPolicy, CIFAR10Policy, SVHNPolicy]``
+        Policy whose sub-policies are applied.
+    mask_fill : ``int``
+        Label of mask pixels mapped from outside the image by geometric operations.
+
+    Examples
+    --------
+        >>> transform = AutoAugment(CIFAR10Policy())
+        >>> x, y = transform(x, y)
+    """
+
+    def __init__(self, policy, mask_fill=0):
+        super().__init__()
+        self.policy = policy
+        self.mask_fill = mask_fill
+
+    def _apply(self, x, target, p, name, magnitude, fillcolor):
+        idx = (torch.rand(len(x)) < p).nonzero().flatten()
+        if len(idx) == 0:
+            return x, target
+        didx = idx.to(x.device)
+        sub = x[didx]
+        fn, geometric = _OPS[name]
+        magnitude = float(magnitude)
+        signs = _random_signs(len(idx))
+        if geometric:
+            matrix = fn(sub, magnitude, signs)
+            fill = _fill_value(128 if name == 'rotate' else fillcolor, x.size(1))
+            sub = warp_affine(sub, matrix, fill)
+            sub_target = _warp_target(_index(target, x, idx), sub, matrix, self.mask_fill)
+            target = _assign(target, x, idx, sub_target)
+        else:
+            sub = fn(sub, magnitude, signs)
+        x = x.index_copy(0, didx, sub)
+        return x, target
+
+    def __call__(self, input, target=None):
+        target, protected = _unwrap(target)
+        policies = self.policy.policies
+        choices = torch.randint(len(policies), (input.size(0),))
+        output = input.clone()
+        for i, sp in enumerate(policies):
+            idx = (choices == i).nonzero().flatten()
+            if len(idx) == 0:
+                continue
+            x = input[idx.to(input.device)]
+            t = _index(target, input, idx)
+            x, t = self._apply(x, t, sp.p1, sp.name1, sp.magnitude1, sp.fillcolor)
+            x, t = self._apply(x, t, sp.p2, sp.name2, sp.magnitude2, sp.fillcolor)
+            output[idx.to(input.device)] = x
+            target = _assign(target, input, idx, t)
+        return output, _wrap(target, protected)
+
+    def __repr__(self):
+        return self.__class__.__name__ + '(policy={0})'.format(self.policy)
+
+
+class RandomRotation(JointTransform):
+    """
+    Rotate each image by a random angle around its center.
+
+    Parameters
+    ----------
+    degrees : ``Union[Number, Sequence[Number]]``
+        Range of degrees to select from. If a number, the range is (-degrees, +degrees).
+    fill : ``Union[Number, Sequence[Number]]``
+        Value of pixels mapped from outside the image.
+    mask_fill : ``int``
+        Label of mask pixels mapped from outside the image.
+    """
+
+    def __init__(self, degrees, fill=0, mask_fill=0):
+        super().__init__()
+        if isinstance(degrees, numbers.Number):
+            if degrees < 0:
+                raise ValueError("If degrees is a single number, it must be positive.")
+            degrees = (-degrees, degrees)
+        self.degrees = degrees
+        self.fill = fill
+        self.mask_fill = mask_fill
+
+    def __call__(self, input, target=None):
+        target, protected = _unwrap(target)
+        n, c, h, w = input.shape
+        angles = torch.empty(n).uniform_(*self.degrees)
+        matrix = _rotation(angles, h, w)
+        output = warp_affine(input, matrix, self.fill)
+        target = _warp_target(target, input, matrix, self.mask_fill)
+        return output, _wrap(target, protected)
+
+    def __repr__(self):
+        return self.__class__.__name__ + '(degrees={0})'.format(self.degrees)
+
+
+class Cutout(JointTransform):
+    """Randomly mask out one or more patches from each image.
+
+    Args:
+        n_holes (int): Number of patches to cut out of each image.
+        length (int): The length (in pixels) of each square patch.
+    """
+
+    def __init__(self, n_holes, length):
+        super().__init__()
+        self.n_holes = n_holes
+        self.length = length
+
+    def __call__(self, input, target=None):
+        n, c, h, w = input.shape
+        device = input.device
+        y = torch.randint(h, (n, self.n_holes, 1, 1), device=device)
+        x = torch.randint(w, (n, self.n_holes, 1, 1), device=device)
+        y1, y2 = (y - self.length // 2).clamp(0, h), (y + self.length // 2).clamp(0, h)
+        x1, x2 = (x - self.length // 2).clamp(0, w), (x + self.length // 2).clamp(0, w)
+        rows = torch.arange(h, device=device).view(1, 1, h, 1)
+        cols = torch.arange(w, device=device).view(1, 1, 1, w)
+        holes = ((rows >= y1) & (rows < y2) & (cols >= x1) & (cols < x2)).any(dim=1)
+        return input * (~holes).unsqueeze(1).to(input.dtype), target
+
+    def __repr__(self):
+        return self.__class__.__name__ + '(n_holes={0}, length={1})'.format(self.n_holes, self.length)
+
+
+class RandomErasing(JointTransform):
+    """ Randomly selects a rectangle region in each image and erases its pixels.
+        'Random Erasing Data Augmentation' by Zhong et al.
+        See https://arxiv.org/pdf/1708.04896.pdf
+    Args:
+         p: probability that the random erasing operation will be performed.
+         scale: range of proportion of erased area against input image.
+         ratio: range of aspect ratio of erased area.
+         value: erasing value. Default is 0. If a single int, it is used to
+            erase all pixels. If a tuple of length 3, it is used to erase
+            R, G, B channels respectively.
+            If a str of 'random', erasing each pixel with random values.
+         erase_label: whether to erase the region of masks with `value` too, which must be a number.
+    """
+
+    def __init__(self, p=0.5, scale=(0.02, 0.33), ratio=(0.3, 3.3), value=0, erase_label=False, max_attempts=10):
+        super().__init__()
+        assert isinstance(value, (numbers.Number, str, tuple, list))
+        assert not erase_label or isinstance(value, numbers.Number)
+        self.p = p
+        self.scale = scale
+        self.ratio = ratio
+        self.value = value
+        self.erase_label = erase_label
+        self.max_attempts = max_attempts
+
+    def get_params(self, input):
+        # Like the per-sample version, the first of `max_attempts` random regions which fits is used
+        n, c, h, w = input.shape
+        k = self.max_attempts
+        erase_area = torch.empty(n, k).uniform_(*self.scale) * (h * w)
+        aspect_ratio = torch.empty(n, k).uniform_(*self.ratio)
+        eh = (erase_area * aspect_ratio).sqrt().round().long()
+        ew = (erase_area / aspect_ratio).sqrt().round().long()
+        fits = (eh < h) & (ew < w)
+        first = (fits.long() * torch.arange(k, 0, -1)).max(dim=1, keepdim=True)[1]
+        valid = fits.any(dim=1) & (torch.rand(n) < self.p)
+        eh = eh.gather(1, first).squeeze(1)
+        ew = ew.gather(1, first).squeeze(1)
+        i = (torch.rand(n) * (h - eh + 1).float()).long()
+        j = (torch.rand(n) * (w - ew + 1).float()).long()
+        rows = torch.arange(h).view(1, h, 1)
+        cols = torch.arange(w).view(1, 1, w)
+        region = (rows >= i.view(-1, 1, 1)) & (rows < (i + eh).view(-1, 1, 1)) & \
+                 (cols >= j.view(-1, 1, 1)) & (cols < (j + ew).view(-1, 1, 1))
+        return (region & valid.view(-1, 1, 1)).to(input.device)
+
+    def __call__(self, input, target=None):
+        region = self.get_params(input)
+        if isinstance(self.value, str):
+            value = torch.empty_like(input).normal_()
+        else:
+            value = torch.as_tensor(self.value, dtype=input.dtype, device=input.device).view(1, -1, 1, 1)
+        output = torch.where(region.unsqueeze(1), value, input)
+        if self.erase_label and _is_mask(target, input):
+            target = target.masked_fill(region, self.value)
+        return output, target
+
+    def __repr__(self):
+        return self.__class__.__name__ + '(p={0}, scale={1}, ratio={2}, value={3})'.format(
+            self.p, self.scale, self.ratio, self.value)
+
+
+def _gaussian_kernel(sigma, device):
+    # Truncated at 4 sigma like scipy.ndimage.gaussian_filter
+    radius = max(int(4 * sigma + 0.5), 1)
+    x = torch.arange(-radius, radius + 1, dtype=torch.float32, device=device)
+    k = torch.exp(-x ** 2 / (2 * sigma ** 2))
+    return k / k.sum()
+
+
+def elastic_grid(n, h, w, alpha, sigma, device=None):
+    r"""
+    Sampling grids for `grid_sample` of random elastic deformations as described in [Simard2003]_.
+
+    The random displacement fields are drawn and smoothed with a separable gaussian filter
+    at a resolution reduced by up to sigma / 4, and then upsampled bilinearly, which is
+    much cheaper than filtering at full resolution for large sigma. The fields are scaled
+    to keep the magnitude of the full resolution version.
+
+    Parameters
+    ----------
+    n : ``int``
+        Number of grids.
+    h : ``int``
+        Height of the images.
+    w : ``int``
+        Width of the images.
+    alpha : ``Union[float, torch.Tensor]``
+        Scale of the displacements in pixels, per sample if a tensor of shape (N,).
+    sigma : ``float``
+        Standard deviation of the gaussian filter in pixels.
+    device : ``torch.device``
+        Device of the grids.
+
+    .. [Simard2003] Simard, Steinkraus and Platt, "Best Practices for
+       Convolutional Neural Networks applied to Visual Document Analysis", in
+       Proc. of the International Conference on Document Analysis and
+       Recognition, 2003.
+    """
+    factor = max(int(sigma / 4), 1)
+    lh, lw = math.ceil(h / factor), math.ceil(w / factor)
+    kernel = _gaussian_kernel(sigma / factor, device)
+    r = len(kernel) // 2
+    field = torch.rand(n, 2, lh, lw, device=device) * 2 - 1
+    field = F.conv2d(field, kernel.view(1, 1, 1, -1).expand(2, 1, 1, -1), padding=(0, r), groups=2)
+    field = F.conv2d(field, kernel.view(1, 1, -1, 1).expand(2, 1, -1, 1), padding=(r, 0), groups=2)
+    if factor > 1:
+        field = F.interpolate(field, size=(h, w), mode='bilinear', align_corners=False)
+    alpha = torch.as_tensor(alpha, dtype=torch.float32, device=device).view(-1, 1, 1, 1)
+    # Displacements in pixels to normalized coordinates
+    scale = torch.tensor([2 / w, 2 / h], device=device).view(1, 2, 1, 1)
+    field = field * (alpha / factor) * scale
+    theta = torch.eye(2, 3, device=device).expand(n, 2, 3)
+    grid = F.affine_grid(theta, [n, 1, h, w], align_corners=False)
+    return grid + field.permute(0, 2, 3, 1)
+
+
+def elastic_transform(input, target=None, alpha=100, sigma=10):
+    r"""
+    Elastic deformation of images (N, C, H, W) and optionally masks (N, H, W) with the same
+    random fields. Images are interpolated bilinearly and masks by nearest neighbor.
+    See `elastic_grid`.
+    """
+    n, c, h, w = input.shape
+    grid = elastic_grid(n, h, w, alpha, sigma, input.device)
+    output = F.grid_sample(input, grid, mode='bilinear', padding_mode='reflection', align_corners=False)
+    if _is_mask(target, input):
+        mask = F.grid_sample(target.unsqueeze(1).float(), grid, mode='nearest',
+                             padding_mode='reflection', align_corners=False)
+        target = mask.squeeze(1).round().to(target.dtype)
+    return output, target
+
+
+class ElasticTransform(JointTransform):
+    """
+    Elastic deformation of each image and its mask with different random fields.
+
+    Parameters
+    ----------
+    alpha : ``Union[float, Tuple[int, int]]``
+        Scale of the displacements in pixels, sampled per image if a range.
+    sigma : ``float``
+        Standard deviation of the gaussian filter of the displacements in pixels.
+    """
+
+    def __init__(self, alpha=100, sigma=10):
+        super().__init__()
+        self.alpha = alpha
+        self.sigma = sigma
+
+    def __call__(self, input, target=None):
+        alpha = self.alpha
+        if isinstance(alpha, tuple):
+            alpha = torch.randint(alpha[0], alpha[1] + 1, (input.size(0),)).float()
+        return elastic_transform(input, target, alpha, self.sigma)
+
+    def __repr__(self):
+        return self.__class__.__name__ + '(alpha={0}, sigma={1})'.format(self.alpha, self.sigma)
@@ -10,24 +10,8 @@ from torchvision.transforms import ColorJitter
 
 from horch.transforms import JointTransform, Compose, InputTransform, RandomChoice, RandomApply, UseOriginal
 from horch.transforms.detection import functional as HF
-
-
-class BoxList:
-    def __init__(self, boxes):
-        super().__init__()
-        self.boxes = boxes
-
-    def __len__(self):
-        return len(self.boxes)
-
-    def __getitem__(self, item):
-        return self.boxes[item]
-
-    def __iter__(self):
-        return iter(self.boxes)
-
-    def __repr__(self):
-        return repr(self.boxes)
+from horch.transforms.detection.boxlist import BoxList
+from horch.transforms.detection.affine import AffineImage
 
 
 class ToTensor(JointTransform):
@@ -36,7 +20,7 @@ class ToTensor(JointTransform):
         super().__init__()
 
     def __call__(self, img, anns):
-        return VF.to_tensor(img), BoxList(anns)
+        return VF.to_tensor(img), BoxList.from_anns(anns)
 
 
 class SubtractMeans(JointTransform):
@@ -70,13 +54,17 @@ class RandomExpand(JointTransform):
         self.mean = mean
 
     def __call__(self, img, anns):
+        anns = BoxList.from_anns(anns)
         width, height = img.size
         ratio = random.uniform(*self.ratios)
         left = random.uniform(0, width * ratio - width)
         top = random.uniform(0, height * ratio - height)
-        expand_image = Image.new(
-            img.mode, (int(width * ratio), int(height * ratio)), self.mean)
-        expand_image.paste(img, (int(left), int(top)))
+        if isinstance(img, AffineImage):
+            expand_image = img.expand(int(left), int(top), (int(width * ratio), int(height * ratio)), self.mean)
+        else:
+            expand_image = Image.new(
+                img.mode, (int(width * ratio), int(height * ratio)), self.mean)
+            expand_image.paste(img, (int(left), int(top)))
 
         new_anns = HF.move(anns, left, top)
         if len(new_anns) == 0:
@@ -115,6 +103,7 @@ class RandomSampleCrop(JointTransform):
         self.max_ar = max_ar
 
     def __call__(self, img, anns):
+        anns = BoxList.from_anns(anns)
         min_iou = random.choice(self.min_ious)
         returns = HF.random_sample_crop(anns, img.size, min_iou, self.min_ar, self.max_ar)
         if returns is None:
@@ -218,11 +207,15 @@ class RandomResizedCrop(JointTransform):
         return i, j, h, w
 
     def __call__(self, img, anns):
+        anns = BoxList.from_anns(anns)
         i, j, h, w = self.get_params(img, self.scale, self.ratio)
         new_anns = HF.resized_crop(anns, j, i, w, h, self.size, self.min_area_frac)
         if len(new_anns) == 0:
             return img, anns
-        img = VF.resized_crop(img, i, j, h, w, self.size[::-1], self.interpolation)
+        if isinstance(img, AffineImage):
+            img = img.crop((j, i, j + w, i + h)).resize(self.size)
+        else:
+            img = VF.resized_crop(img, i, j, h, w, self.size[::-1], self.interpolation)
         return img, new_anns
 
     def __repr__(self):
@@ -253,9 +246,13 @@ class Resize(JointTransform):
         self.size = size
 
     def __call__(self, img, anns):
+        anns = BoxList.from_anns(anns)
         if img.size == self.size:
             return img, anns
 
+        if isinstance(img, AffineImage):
+            return img.resize(_resized_size(img.size, self.size)), HF.resize(anns, img.size, self.size)
+
         anns = HF.resize(anns, img.size, self.size)
         if isinstance(self.size, Tuple):
             size = self.size[::-1]
@@ -268,6 +265,56 @@ class Resize(JointTransform):
         return self.__class__.__name__ + "(size=%s)" % (self.size,)
 
 
+def _resized_size(size, output_size):
+    # Same as `torchvision.transforms.functional.resize`
+    w, h = size
+    if not isinstance(output_size, int):
+        return output_size
+    if w < h:
+        return output_size, int(output_size * h / w)
+    return int(output_size * w / h), output_size
+
+
+class Affine(JointTransform):
+    """
+    Start a fused geometric pipeline. The following crops, resizes, flips and expansions
+    of the image only accumulate an affine transform, until `Warp` resamples it once
+    to the output size. Bounding boxes are transformed as usual.
+    """
+
+    def __init__(self):
+        super().__init__()
+
+    def __call__(self, img, anns):
+        return AffineImage(img), anns
+
+    def __repr__(self):
+        return self.__class__.__name__ + "()"
+
+
+class Warp(JointTransform):
+    """
+    Resample the image of a fused geometric pipeline started by `Affine`.
+
+    Parameters
+    ----------
+    interpolation:
+        Default: PIL.Image.BILINEAR
+    """
+
+    def __init__(self, interpolation=Image.BILINEAR):
+        super().__init__()
+        self.interpolation = interpolation
+
+    def __call__(self, img, anns):
+        if isinstance(img, AffineImage):
+            img = img.warp(self.interpolation)
+        return img, anns
+
+    def __repr__(self):
+        return self.__class__.__name__ + "()"
+
+
 class CenterCrop(JointTransform):
     """
     Crops the given PIL Image at the center and transform the bounding boxes.
@@ -284,12 +331,19 @@ class CenterCrop(JointTransform):
         self.size = size
 
     def __call__(self, img, anns):
+        anns = BoxList.from_anns(anns)
         if isinstance(self.size, Tuple):
             size = self.size[::-1]
         else:
             size = self.size
-        img = VF.center_crop(img, size)
-        anns = HF.center_crop(anns, self.size)
+        anns = HF.center_crop(anns, img.size, self.size)
+        if isinstance(img, AffineImage):
+            w, h = img.size
+            tw, th = size[::-1] if isinstance(size, Tuple) else (size, size)
+            l, t = int(round((w - tw) / 2.)), int(round((h - th) / 2.))
+            img = img.crop((l, t, l + tw, t + th))
+        else:
+            img = VF.center_crop(img, size)
         return img, anns
 
     def __repr__(self):
@@ -302,7 +356,7 @@ class ToPercentCoords(JointTransform):
         super().__init__()
 
     def __call__(self, img, anns):
-        return img, HF.to_percent_coords(anns, img.size)
+        return img, HF.to_percent_coords(BoxList.from_anns(anns), img.size)
 
     def __repr__(self):
         return self.__class__.__name__ + "()"
@@ -314,7 +368,7 @@ class ToAbsoluteCoords(JointTransform):
         super().__init__()
 
     def __call__(self, img, anns):
-        return img, HF.to_absolute_coords(anns, img.size)
+        return img, HF.to_absolute_coords(BoxList.from_anns(anns), img.size)
 
     def __repr__(self):
         return self.__class__.__name__ + "()"
@@ -332,8 +386,9 @@ class RandomHorizontalFlip(JointTransform):
         self.p = p
 
     def __call__(self, img, anns):
+        anns = BoxList.from_anns(anns)
         if random.random() < self.p:
-            img = VF.hflip(img)
+            img = img.hflip() if isinstance(img, AffineImage) else VF.hflip(img)
             anns = HF.hflip(anns, img.size)
             return img, anns
         return img, anns
@@ -354,8 +409,9 @@ class RandomVerticalFlip(JointTransform):
         self.p = p
 
     def __call__(self, img, anns):
+        anns = BoxList.from_anns(anns)
         if random.random() < self.p:
-            img = VF.vflip(img)
+            img = img.vflip() if isinstance(img, AffineImage) else VF.vflip(img)
             anns = HF.vflip(anns, img.size)
             return img, anns
         return img, anns
@@ -364,7 +420,14 @@ class RandomVerticalFlip(JointTransform):
         return self.__class__.__name__ + '(p={})'.format(self.p)
 
 
-def SSDTransform(size, mean=0, color_jitter=True, expand=(1, 4)):
+def SSDTransform(size, mean=0, color_jitter=True, expand=(1, 4), fused=False):
+    r"""
+    Parameters
+    ----------
+    fused : ``bool``
+        Whether to fuse expanding, cropping, flipping and resizing into one affine warp
+        of the image, which avoids materializing the expanded and intermediate images.
+    """
     transforms = []
     if color_jitter:
         transforms.append(
@@ -373,6 +436,8 @@ def SSDTransform(size, mean=0, color_jitter=True, expand=(1, 4)):
                 saturation=0.5, hue=18 / 255,
             )
         )
+    if fused:
+        transforms.append(Affine())
     transforms += [
         RandomApply([
             RandomExpand(expand, mean=mean),
@@ -381,4 +446,6 @@ def SSDTransform(size, mean=0, color_jitter=True, expand=(1, 4)):
         RandomHorizontalFlip(),
         Resize(size)
     ]
+    if fused:
+        transforms.append(Warp())
     return Compose(transforms)
@@ -0,0 +1,83 @@
+import math
+
+import numpy as np
+from PIL import Image
+
+__all__ = ["AffineImage"]
+
+
+class AffineImage:
+    r"""
+    A PIL Image with pending geometric transforms.
+
+    Crops, resizes, flips and expansions only update a 3x3 matrix mapping coordinates of the
+    source image to the output, and the size of the output window. The pixels are resampled
+    once by `warp`.
+
+    Parameters
+    ----------
+    img : ``Image``
+        Source image.
+    matrix : ``np.ndarray``
+        Affine matrix from source to output coordinates.
+    size : ``Tuple[int, int]``
+        Output size (w, h).
+    fill : ``Union[int, Tuple[int, ...]]``
+        Color of the output pixels mapped from outside the source image.
+    """
+
+    def __init__(self, img, matrix=None, size=None, fill=0):
+        self.img = img
+        self.matrix = np.eye(3) if matrix is None else matrix
+        self.size = img.size if size is None else size
+        self.fill = fill
+
+    @property
+    def mode(self):
+        return self.img.mode
+
+    def _apply(self, m, size, fill=None):
+        return AffineImage(self.img, m @ self.matrix, size, self.fill if fill is None else fill)
+
+    def crop(self, box):
+        # Rounded like `Image.crop`, so that sizes are the same as without fusing
+        l, t, r, b = (int(round(x)) for x in box)
+        m = np.array([[1, 0, -l], [0, 1, -t], [0, 0, 1]], dtype=np.float64)
+        return self._apply(m, (r - l, b - t))
+
+    def expand(self, left, top, size, fill):
+        m = np.array([[1, 0, left], [0, 1, top], [0, 0, 1]], dtype=np.float64)
+        return self._apply(m, size, fill)
+
+    def resize(self, size):
+        w, h = self.size
+        ow, oh = size
+        return self._apply(np.diag([ow / w, oh / h, 1.]), size)
+
+    def hflip(self):
+        w, h = self.size
+        m = np.array([[-1, 0, w], [0, 1, 0], [0, 0, 1]], dtype=np.float64)
+        return self._apply(m, self.size)
+
+    def vflip(self):
+        w, h = self.size
+        m = np.array([[1, 0, 0], [0, -1, h], [0, 0, 1]], dtype=np.float64)
+        return self._apply(m, self.size)
+
+    def warp(self, resample=Image.BILINEAR):
+        img = self.img
+        m = self.matrix
+        # Bilinear sampling aliases on large reductions, so box-filter the source first
+        scale = max(math.hypot(m[0, 0], m[1, 0]), math.hypot(m[0, 1], m[1, 1]))
+        factor = int(1 / scale)
+        if factor >= 2:
+            w, h = img.size
+            rw, rh = max(w // factor, 1), max(h // factor, 1)
+            img = img.resize((rw, rh), Image.BOX)
+            m = m @ np.diag([w / rw, h / rh, 1.])
+        size = tuple(max(int(round(x)), 1) for x in self.size)
+        data = tuple(np.linalg.inv(m)[:2].ravel())
+        return img.transform(size, Image.AFFINE, data, resample, fillcolor=self.fill)
+
+    def __repr__(self):
+        return "AffineImage(size=%s)" % (tuple(self.size),)
@@ -0,0 +1,117 @@
+from typing import List, Dict
+
+import numpy as np
+
+__all__ = ["BoxList"]
+
+_FIELDS = ("category_id", "area", "iscrowd")
+
+
+class BoxList:
+    r"""
+    Annotations of the objects in an image stored as arrays.
+
+    Parameters
+    ----------
+    boxes : ``np.ndarray``
+        Bounding boxes of [l, t, w, h] with shape (N, 4).
+    labels : ``np.ndarray``
+        Category ids with shape (N,).
+    areas : ``np.ndarray``
+        Areas with shape (N,).
+    iscrowd : ``np.ndarray``
+        Crowd flags with shape (N,).
+    extras : ``np.ndarray``
+        Object array of dicts holding the other keys of each annotation (e.g. `segmentation`).
+    fields : ``Sequence[str]``
+        Keys among `category_id`, `area` and `iscrowd` present in the original annotations,
+        used by `to_anns`.
+
+    Notes
+    -----
+    Transforms return new instances and never modify arrays in place, so that unchanged
+    arrays can be shared between instances.
+    """
+
+    def __init__(self, boxes, labels=None, areas=None, iscrowd=None, extras=None, fields=_FIELDS):
+        boxes = np.asarray(boxes)
+        if boxes.dtype.kind != 'f':
+            boxes = boxes.astype(np.float32)
+        self.boxes = boxes.reshape(-1, 4)
+        n = len(self.boxes)
+        if labels is None:
+            labels = np.zeros(n, dtype=np.int64)
+        if areas is None:
+            areas = self.boxes[:, 2] * self.boxes[:, 3]
+        if iscrowd is None:
+            iscrowd = np.zeros(n, dtype=np.uint8)
+        self.labels = labels
+        self.areas = areas
+        self.iscrowd = iscrowd
+        self.extras = extras
+        self.fields = tuple(fields)
+
+    @staticmethod
+    def from_anns(anns: List[Dict], dtype=np.float32):
+        r"""
+        Create from COCO-style annotations, which contain at least `bbox` of [l, t, w, h].
+        Coordinates are stored as `dtype`, use ``np.float64`` for an exact round trip.
+        """
+        if isinstance(anns, BoxList):
+            return anns
+        n = len(anns)
+        # Annotations may come from different sources, only keys present in all are fields
+        fields = tuple(k for k in _FIELDS if n != 0 and all(k in ann for ann in anns))
+        boxes = np.array([ann['bbox'] for ann in anns], dtype=dtype).reshape(n, 4)
+        labels = np.array([ann.get('category_id', 0) for ann in anns], dtype=np.int64)
+        areas = boxes[:, 2] * boxes[:, 3]
+        if any('area' in ann for ann in anns):
+            areas = np.array([ann.get('area', a) for ann, a in zip(anns, areas.tolist())], dtype=dtype)
+        iscrowd = np.array([ann.get('iscrowd', 0) for ann in anns], dtype=np.uint8)
+        extras = None
+        if any(len(ann) != len(fields) + 1 for ann in anns):
+            extras = np.empty(n, dtype=object)
+            for i, ann in enumerate(anns):
+                extras[i] = {k: v for k, v in ann.items() if k != 'bbox' and k not in _FIELDS}
+        return BoxList(boxes, labels, areas, iscrowd, extras, fields)
+
+    def to_anns(self) -> List[Dict]:
+        boxes = self.boxes.tolist()
+        columns = {
+            "category_id": self.labels.tolist(),
+            "area": self.areas.tolist(),
+            "iscrowd": self.iscrowd.tolist(),
+        }
+        anns = []
+        for i in range(len(self)):
+            ann = dict(self.extras[i]) if self.extras is not None else {}
+            ann['bbox'] = boxes[i]
+            for k in self.fields:
+                ann[k] = columns[k][i]
+            anns.append(ann)
+        return anns
+
+    def with_boxes(self, boxes):
+        return BoxList(boxes, self.labels, self.areas, self.iscrowd, self.extras, self.fields)
+
+    def select(self, indices):
+        r"""
+        Select objects by indices or a boolean mask.
+        """
+        extras = self.extras[indices] if self.extras is not None else None
+        return BoxList(self.boxes[indices], self.labels[indices], self.areas[indices],
+                       self.iscrowd[indices], extras, self.fields)
+
+    def __len__(self):
+        return len(self.boxes)
+
+    def __getitem__(self, item):
+        if isinstance(item, (int, np.integer)):
+            return self.select([item]).to_anns()[0]
+        return self.select(item)
+
+    def __iter__(self):
+        return iter(self.to_anns())
+
+    def __repr__(self):
+        return "BoxList(num_boxes=%d)" % len(self)
@@ -4,17 +4,34 @@ import random
 
 import numpy as np
 from toolz import curry
-from toolz.curried import get
 
 from horch.common import tuplify
+from horch.boxes import aligned_box_iou
+from horch.transforms.detection.boxlist import BoxList
 
 __all__ = [
     "resize", "resized_crop", "center_crop", "drop_boundary_bboxes",
     "to_absolute_coords", "to_percent_coords", "hflip", "hflip2",
-    "vflip", "vflip2", "random_sample_crop", "move"
+    "vflip", "vflip2", "random_sample_crop", "move", "crop"
 ]
 
 
+def _as_boxlist(anns):
+    # Lists of dicts are converted in float64 so that they come back unchanged
+    if isinstance(anns, BoxList):
+        return anns, False
+    return BoxList.from_anns(anns, np.float64), True
+
+
+def _return(boxes, to_list):
+    return boxes.to_anns() if to_list else boxes
+
+
+def _transform_boxes(anns, f):
+    b, to_list = _as_boxlist(anns)
+    return _return(b.with_boxes(f(b.boxes)), to_list)
+
+
 def iou_1m(box, boxes):
     r"""
     Calculates one-to-many ious.
@@ -31,22 +48,8 @@ def iou_1m(box, boxes):
     ious : ``array_like``
         IoUs between the box and boxes.
     """
-    xi1 = np.maximum(boxes[..., 0], box[0])
-    yi1 = np.maximum(boxes[..., 1], box[1])
-    xi2 = np.minimum(boxes[..., 2], box[2])
-    yi2 = np.minimum(boxes[..., 3], box[3])
-    xdiff = xi2 - xi1
-    ydiff = yi2 - yi1
-    inter_area = xdiff * ydiff
-    box_area = (box[2] - box[0]) * (box[3] - box[1])
-    boxes_area = (boxes[..., 2] - boxes[..., 0]) * \
-        (boxes[..., 3] - boxes[..., 1])
-    union_area = boxes_area + box_area - inter_area
-
-    iou = inter_area / union_area
-    iou[xdiff < 0] = 0
-    iou[ydiff < 0] = 0
-    return iou
+    boxes = np.asarray(boxes)
+    return aligned_box_iou(np.asarray(box, dtype=boxes.dtype), boxes)
 
 
 def random_sample_crop(anns, size, min_iou, min_ar, max_ar, max_attemps=50):
@@ -60,7 +63,7 @@ def random_sample_crop(anns, size, min_iou, min_ar, max_ar, max_attemps=50):
 
     Parameters
     ----------
-    anns : ``List[Dict]``
+    anns : ``Union[List[Dict], BoxList]``
         Sequences of annotation of objects, containing `bbox` of [l, t, w, h].
     size : ``Sequence[int]``
         Size of the original image.
@@ -74,8 +77,10 @@ def random_sample_crop(anns, size, min_iou, min_ar, max_ar, max_attemps=50):
         Maximum attemps to try.
     """
     width, height = size
-    bboxes = np.stack([ann['bbox'] for ann in anns])
+    bl, to_list = _as_boxlist(anns)
+    bboxes = bl.boxes.copy()
     bboxes[:, 2:] += bboxes[:, :2]
+    centers = (bboxes[:, :2] + bboxes[:, 2:]) / 2.0
     for _ in range(max_attemps):
         w = random.uniform(0.3 * width, width)
         h = random.uniform(0.3 * height, height)
@@ -93,14 +98,12 @@ def random_sample_crop(anns, size, min_iou, min_ar, max_ar, max_attemps=50):
         if ious.min() < min_iou:
             continue
 
-        centers = (bboxes[:, :2] + bboxes[:, 2:]) / 2.0
         mask = (l < centers[:, 0]) & (centers[:, 0] < r) & (
                 t < centers[:, 1]) & (centers[:, 1] < b)
 
         if not mask.any():
             continue
-        indices = np.nonzero(mask)[0].tolist()
-        return get(indices, anns), l, t, w, h
+        return _return(bl.select(mask), to_list), l, t, w, h
     return None
 
 
@@ -121,20 +124,17 @@ def drop_boundary_bboxes(anns, size):
 
     Parameters
     ----------
-    anns : ``List[Dict]``
+    anns : ``Union[List[Dict], BoxList]``
         Sequences of annotation of objects, containing `bbox` of [l, t, w, h].
     size : ``Sequence[int]``
         Size of the original image.
     """
     width, height = size
-    new_anns = []
-    for ann in anns:
-        l, t, w, h = ann['bbox']
-        x = (l + w) / 2.
-        y = (t + h) / 2.
-        if 0 <= x <= width and 0 <= y <= height:
-            new_anns.append({**ann, "bbox": [l, t, w, h]})
-    return new_anns
+    b, to_list = _as_boxlist(anns)
+    x = b.boxes[:, 0] + b.boxes[:, 2] / 2.
+    y = b.boxes[:, 1] + b.boxes[:, 3] / 2.
+    mask = (0 <= x) & (x <= width) & (0 <= y) & (y <= height)
+    return _return(b.select(mask), to_list)
 
 
 @curry
@@ -144,7 +144,7 @@ def center_crop(anns, size, output_size):
 
     Parameters
     ----------
-    anns : ``List[Dict]``
+    anns : ``Union[List[Dict], BoxList]``
         Sequences of annotation of objects, containing `bbox` of [l, t, w, h].
     size : ``Sequence[int]``
         Size of the original image.
@@ -155,10 +155,10 @@ def center_crop(anns, size, output_size):
     output_size = tuplify(output_size, 2)
     output_size = tuple(int(x) for x in output_size)
     w, h = size
-    th, tw = output_size
+    tw, th = output_size
     upper = int(round((h - th) / 2.))
     left = int(round((w - tw) / 2.))
-    return crop(anns, left, upper, th, tw)
+    return crop(anns, left, upper, tw, th)
 
 
 @curry
@@ -168,7 +168,7 @@ def crop(anns, left, upper, width, height, minimal_area_fraction=0.25):
 
     Parameters
     ----------
-    anns : ``List[Dict]``
+    anns : ``Union[List[Dict], BoxList]``
         Sequences of annotation of objects, containing `bbox` of [l, t, w, h].
     left: ``int``
         Left pixel coordinate.
@@ -181,25 +181,18 @@ def crop(anns, left, upper, width, height, minimal_area_fraction=0.25):
     minimal_area_fraction : ``int``
         Minimal area fraction requirement.
     """
-    new_anns = []
-    for ann in anns:
-        l, t, w, h = ann['bbox']
-        area = w * h
-        l -= left
-        t -= upper
-        if l + w >= 0 and l <= width and t + h >= 0 and t <= height:
-            if l < 0:
-                w += l
-                l = 0
-            if t < 0:
-                h += t
-                t = 0
-            w = min(width - l, w)
-            h = min(height - t, h)
-            if w * h < area * minimal_area_fraction:
-                continue
-            new_anns.append({**ann, "bbox": [l, t, w, h]})
-    return new_anns
+    b, to_list = _as_boxlist(anns)
+    l = b.boxes[:, 0] - left
+    t = b.boxes[:, 1] - upper
+    w = b.boxes[:, 2]
+    h = b.boxes[:, 3]
+    area = w * h
+    mask = (l + w >= 0) & (l <= width) & (t + h >= 0) & (t <= height)
+    nw = np.minimum(w + np.minimum(l, 0), width - np.maximum(l, 0))
+    nh = np.minimum(h + np.minimum(t, 0), height - np.maximum(t, 0))
+    mask &= nw * nh >= area * minimal_area_fraction
+    boxes = np.stack([np.maximum(l, 0), np.maximum(t, 0), nw, nh], axis=1)[mask]
+    return _return(b.select(mask).with_boxes(boxes), to_list)
 
 
 @curry
@@ -207,7 +200,7 @@ def resize(anns, size, output_size):
     """
     Parameters
     ----------
-    anns : List[Dict]
+    anns : Union[List[Dict], BoxList]
         Sequences of annotation of objects, containing `bbox` of [l, t, w, h].
     size : Sequence[int]
         Size of the original image.
@@ -231,15 +224,8 @@ def resize(anns, size, output_size):
         ow, oh = output_size
         sw = ow / w
         sh = oh / h
-    new_anns = []
-    for ann in anns:
-        bbox = list(ann['bbox'])
-        bbox[0] *= sw
-        bbox[1] *= sh
-        bbox[2] *= sw
-        bbox[3] *= sh
-        new_anns.append({**ann, "bbox": bbox})
-    return new_anns
+    scale = np.array([sw, sh, sw, sh])
+    return _transform_boxes(anns, lambda boxes: (boxes * scale).astype(boxes.dtype))
 
 
 @curry
@@ -249,21 +235,14 @@ def to_percent_coords(anns, size):
 
     Parameters
     ----------
-    anns : ``List[Dict]``
+    anns : ``Union[List[Dict], BoxList]``
         Sequences of annotation of objects, containing `bbox` of [l, t, w, h].
     size : ``Sequence[int]``
         Size of the original image.
     """
     w, h = size
-    new_anns = []
-    for ann in anns:
-        bbox = list(ann['bbox'])
-        bbox[0] /= w
-        bbox[1] /= h
-        bbox[2] /= w
-        bbox[3] /= h
-        new_anns.append({**ann, "bbox": bbox})
-    return new_anns
+    scale = np.array([w, h, w, h])
+    return _transform_boxes(anns, lambda boxes: (boxes / scale).astype(boxes.dtype))
 
 
 @curry
@@ -273,21 +252,23 @@ def to_absolute_coords(anns, size):
 
     Parameters
     ----------
-    anns : ``List[Dict]``
+    anns : ``Union[List[Dict], BoxList]``
         Sequences of annotation of objects, containing `bbox` of [l, t, w, h].
     size : ``Sequence[int]``
         Size of the original image.
     """
     w, h = size
-    new_anns = []
-    for ann in anns:
-        bbox = list(ann['bbox'])
-        bbox[0] *= w
-        bbox[1] *= h
-        bbox[2] *= w
-        bbox[3] *= h
-        new_anns.append({**ann, "bbox": bbox})
-    return new_anns
+    scale = np.array([w, h, w, h])
+    return _transform_boxes(anns, lambda boxes: (boxes * scale).astype(boxes.dtype))
+
+
+def _flip(boxes, i, size, ltrb):
+    boxes = boxes.copy()
+    if ltrb:
+        boxes[:, [i, i + 2]] = size - boxes[:, [i + 2, i]]
+    else:
+        boxes[:, i] = size - (boxes[:, i] + boxes[:, i + 2])
+    return boxes
 
 
 @curry
@@ -297,18 +278,12 @@ def hflip(anns, size):
 
     Parameters
     ----------
-    anns : ``List[Dict]``
+    anns : ``Union[List[Dict], BoxList]``
         Sequences of annotation of objects, containing `bbox` of [l, t, w, h].
     size : ``Sequence[int]``
         Size of the original image.
     """
-    w, h = size
-    new_anns = []
-    for ann in anns:
-        bbox = list(ann['bbox'])
-        bbox[0] = w - (bbox[0] + bbox[2])
-        new_anns.append({**ann, "bbox": bbox})
-    return new_anns
+    return _transform_boxes(anns, lambda boxes: _flip(boxes, 0, size[0], False))
 
 
 @curry
@@ -318,20 +293,12 @@ def hflip2(anns, size):
 
     Parameters
     ----------
-    anns : ``List[Dict]``
+    anns : ``Union[List[Dict], BoxList]``
         Sequences of annotation of objects, containing `bbox` of [l, t, r, b].
     size : ``Sequence[int]``
         Size of the original image.
     """
-    w, h = size
-    new_anns = []
-    for ann in anns:
-        bbox = list(ann['bbox'])
-        l = bbox[0]
-        bbox[0] = w - bbox[2]
-        bbox[2] = w - l
-        new_anns.append({**ann, "bbox": bbox})
-    return new_anns
+    return _transform_boxes(anns, lambda boxes: _flip(boxes, 0, size[0], True))
 
 
 @curry
@@ -341,18 +308,12 @@ def vflip(anns, size):
 
     Parameters
     ----------
-    anns : ``List[Dict]``
+    anns : ``Union[List[Dict], BoxList]``
         Sequences of annotation of objects, containing `bbox` of [l, t, w, h].
     size : ``Sequence[int]``
         Size of the original image.
     """
-    w, h = size
-    new_anns = []
-    for ann in anns:
-        bbox = list(ann['bbox'])
-        bbox[1] = h - (bbox[1] + bbox[3])
-        new_anns.append({**ann, "bbox": bbox})
-    return new_anns
+    return _transform_boxes(anns, lambda boxes: _flip(boxes, 1, size[1], False))
 
 
 @curry
@@ -362,21 +323,12 @@ def vflip2(anns, size):
 
     Parameters
     ----------
-    anns : ``List[Dict]``
-        Sequences of annotation of objects, containing `bbox` of [l, t, w, h].
+    anns : ``Union[List[Dict], BoxList]``
+        Sequences of annotation of objects, containing `bbox` of [l, t, r, b].
     size : ``Sequence[int]``
         Size of the original image.
     """
-    w, h = size
-
-    new_anns = []
-    for ann in anns:
-        bbox = list(ann['bbox'])
-        t = bbox[1]
-        bbox[1] = h - bbox[3]
-        bbox[3] = h - t
-        new_anns.append({**ann, "bbox": bbox})
-    return new_anns
+    return _transform_boxes(anns, lambda boxes: _flip(boxes, 1, size[1], True))
 
 
 @curry
@@ -386,19 +338,12 @@ def move(anns, x, y):
 
     Parameters
     ----------
-    anns : ``List[Dict]``
+    anns : ``Union[List[Dict], BoxList]``
         Sequences of annotation of objects, containing `bbox` of [l, t, w, h].
     x : ``Number``
         How many to move along the horizontal axis.
     y : ``Number``
         How many to move along the vertical axis.
     """
-
-    new_anns = []
-    for ann in anns:
-        bbox = list(ann['bbox'])
-        bbox[0] += x
-        bbox[1] += y
-        new_anns.append({**ann, "bbox": bbox})
-    return new_anns
-
+    offset = np.array([x, y, 0, 0])
+    return _transform_boxes(anns, lambda boxes: (boxes + offset).astype(boxes.dtype))
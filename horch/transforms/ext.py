@@ -277,11 +277,14 @@ class SubPolicy(object):
         #     operation1, ranges[operation1][magnitude_idx1],
         #     operation2, ranges[operation2][magnitude_idx2])
         self.p1 = p1
+        self.name1 = operation1
         self.operation1 = func[operation1]
         self.magnitude1 = ranges[operation1][magnitude_idx1]
         self.p2 = p2
+        self.name2 = operation2
         self.operation2 = func[operation2]
         self.magnitude2 = ranges[operation2][magnitude_idx2]
+        self.fillcolor = fillcolor
 
     def __call__(self, img):
         if random.random() < self.p1: img = self.operation1(img, self.magnitude1)
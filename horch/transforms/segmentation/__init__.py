@@ -6,14 +6,13 @@ import math
 
 import torch
 import numpy as np
-from scipy.ndimage.interpolation import map_coordinates
-from scipy.ndimage.filters import gaussian_filter
 
 import torchvision.transforms.functional as TF
 from PIL import Image
 from torchvision.transforms.transforms import _get_image_size, _pil_interpolation_to_str
 
 from horch.transforms import JointTransform
+from horch.transforms import batch as HB
 from typing import Iterable
 
 
@@ -552,30 +551,32 @@ def elastic_transform(image, label, alpha=100, sigma=10):
        Convolutional Neural Networks applied to Visual Document Analysis", in
        Proc. of the International Conference on Document Analysis and
        Recognition, 2003.
-    """
-
-    image = np.asarray(image)
-    label = np.asarray(label)
-
-    shape = image.shape
-
-    dx = gaussian_filter((np.random.rand(*shape) * 2 - 1), sigma, mode="constant", cval=0) * alpha
-    dy = gaussian_filter((np.random.rand(*shape) * 2 - 1), sigma, mode="constant", cval=0) * alpha
-
-    x, y = np.meshgrid(np.arange(shape[0]), np.arange(shape[1]), indexing='ij')
-
-    indices = np.reshape(x + dx, (-1, 1)), np.reshape(y + dy, (-1, 1))
 
-    image = map_coordinates(image, indices, order=1, mode='reflect').reshape(shape)
-    label = map_coordinates(label, indices, order=1, mode='reflect').reshape(shape)
+    Grayscale and RGB images are supported. The label is resampled by nearest neighbor,
+    so class ids are preserved. See `horch.transforms.batch.elastic_grid`.
+    """
+    image = np.array(image)
+    label = np.array(label)
+
+    x = torch.from_numpy(image).float()
+    x = x.unsqueeze(0) if x.dim() == 2 else x.permute(2, 0, 1)
+    y = torch.from_numpy(label).long()
+    x, y = HB.elastic_transform(x[None], y[None], alpha, sigma)
+
+    x = x[0].round_().clamp_(0, 255).to(torch.uint8)
+    x = x[0] if image.ndim == 2 else x.permute(1, 2, 0)
+    image = x.numpy().astype(image.dtype)
+    label = y[0].numpy().astype(label.dtype)
     return Image.fromarray(image), Image.fromarray(label)
 
 
 class ElasticTransform(JointTransform):
-    """Vertically flip the given PIL Image randomly with a given probability.
+    """Elastic deformation of the image and the label.
 
     Args:
-        p (float): probability of the image being flipped. Default value is 0.5
+        alpha (float or tuple): scale of the displacements in pixels. If a tuple (min, max),
+            sampled as an integer from the range.
+        sigma (float): standard deviation of the gaussian filter of the displacements in pixels.
     """
 
     def __init__(self, alpha=100, sigma=10):
@@ -586,12 +587,12 @@ class ElasticTransform(JointTransform):
     def __call__(self, image, label):
         """
         Args:
-            img (PIL Image): Image to be flipped.
+            image (PIL Image): Image to be deformed.
+            label (PIL Image): Label to be deformed.
 
         Returns:
-            PIL Image: Randomly flipped image.
+            tuple: Deformed image and label.
         """
-        assert len(image.size) == 2
         alpha = self.alpha
         if isinstance(alpha, tuple):
             alpha = random.randint(*alpha)
@@ -601,6 +602,6 @@ class ElasticTransform(JointTransform):
 
     def __repr__(self):
         format_string = self.__class__.__name__ + '(alpha={0}'.format(self.alpha)
-        format_string += ', sigma={0}'.format(self.sigma)
+        format_string += ', sigma={0})'.format(self.sigma)
 
         return format_string
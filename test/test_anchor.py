@@ -0,0 +1,38 @@
+import torch
+
+from horch.models.detection.anchor import AnchorGenerator, pad_boxes, match_iou, match_atss, assign
+
+
+def test_anchor_generator():
+    gen = AnchorGenerator((8, 16), scales=(1,), ratios=(0.5, 1, 2))
+    sizes = [(4, 2), (2, 1)]
+    anchors = gen(sizes)
+    assert gen.num_anchors == (3, 3)
+    assert anchors.shape == (sum(gen.num_anchors_per_level(sizes)), 4)
+    assert gen(sizes) is anchors
+    # (W, H, A) order: the second location is (x=0, y=1) of the first level
+    assert torch.allclose(anchors[3:6, [0, 2]].mean(dim=1), torch.tensor([4., 4., 4.]))
+    assert torch.allclose(anchors[3:6, [1, 3]].mean(dim=1), torch.tensor([12., 12., 12.]))
+    assert anchors[4].tolist() == [-12, -4, 20, 28]
+
+
+def test_match():
+    gen = AnchorGenerator((8, 16), scales=(1,), ratios=(1,), octave_base=2)
+    sizes = [(4, 4), (2, 2)]
+    anchors = gen(sizes)
+    gt_boxes, gt_labels, mask = pad_boxes(
+        [torch.tensor([[-8., -8., 24., 24.]]), torch.zeros(0, 4)],
+        [torch.tensor([3]), torch.zeros(0, dtype=torch.long)])
+
+    matched = match_iou(anchors, gt_boxes, mask)
+    assert matched.shape == (2, len(anchors))
+    assert (matched[1] == -1).all()
+    assert matched[0, 16] == 0
+
+    loc_t, cls_t = assign(anchors, gt_boxes, gt_labels, matched)
+    assert cls_t[0, 16] == 3
+    assert torch.allclose(loc_t[0, 16], torch.zeros(4), atol=1e-5)
+
+    matched = match_atss(anchors, gt_boxes, mask, gen.num_anchors_per_level(sizes), topk=4)
+    assert matched[0, 16] == 0
+    assert (matched[1] == -1).all()
@@ -0,0 +1,37 @@
+import numpy as np
+import torch
+
+from horch.boxes import box_iou, aligned_box_iou, encode, decode, convert
+
+
+def test_box_iou():
+    boxes1 = np.array([[0, 0, 2, 2], [1, 1, 3, 3]], dtype=np.float64)
+    boxes2 = np.array([[0, 0, 2, 2], [2, 2, 4, 4], [4, 0, 6, 2]], dtype=np.float64)
+    expected = np.array([[1, 0, 0], [1 / 7, 1 / 7, 0]])
+    np.testing.assert_allclose(box_iou(boxes1, boxes2), expected, atol=1e-6)
+    np.testing.assert_allclose(box_iou(boxes1, boxes2, max_elements=1), expected, atol=1e-6)
+    np.testing.assert_allclose(box_iou(torch.from_numpy(boxes1), torch.from_numpy(boxes2)).numpy(),
+                               expected, atol=1e-6)
+
+    # Batched, for all modes
+    b1 = torch.rand(2, 5, 4)
+    b1[..., 2:] += b1[..., :2]
+    b2 = torch.rand(2, 3, 4)
+    b2[..., 2:] += b2[..., :2]
+    for mode in ['iou', 'giou', 'diou', 'ciou']:
+        pairwise = box_iou(b1, b2, mode)
+        assert pairwise.shape == (2, 5, 3)
+        np.testing.assert_allclose(pairwise[:, 1, 2].numpy(), aligned_box_iou(b1[:, 1], b2[:, 2], mode).numpy())
+        np.testing.assert_allclose(pairwise.numpy(), box_iou(b1.numpy(), b2.numpy(), mode), rtol=1e-4, atol=1e-6)
+
+    # Disjoint boxes: GIoU is negative
+    giou = box_iou(boxes1[:1], boxes2[2:], 'giou')
+    np.testing.assert_allclose(giou, [[-1 / 3]], atol=1e-6)
+
+
+def test_encode_decode():
+    anchors = np.array([[0, 0, 10, 10], [5, 5, 25, 15]], dtype=np.float32)
+    boxes = np.array([[1, 2, 8, 12], [0, 0, 30, 20]], dtype=np.float32)
+    np.testing.assert_allclose(decode(encode(boxes, anchors), anchors), boxes, atol=1e-4)
+    np.testing.assert_allclose(convert(convert(boxes, 'ltrb', 'xywh'), 'xywh', 'ltwh'),
+                               [[1, 2, 7, 10], [0, 0, 30, 20]], atol=1e-6)
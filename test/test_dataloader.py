@@ -0,0 +1,68 @@
+import time
+
+from torch.utils.data import Dataset, IterableDataset
+
+from horch.dataloader.dataloader import DataLoader
+from horch.dataloader.worker import get_worker_info
+
+
+class _Range(Dataset):
+
+    def __init__(self, n, slow=()):
+        self.n = n
+        self.slow = set(slow)
+
+    def __getitem__(self, i):
+        if i in self.slow:
+            time.sleep(0.2)
+        return i
+
+    def __len__(self):
+        return self.n
+
+
+class _IterRange(IterableDataset):
+    # Worker i yields `sizes[i]` items, so workers may run out at different times
+
+    def __init__(self, sizes):
+        self.sizes = sizes
+
+    def __iter__(self):
+        info = get_worker_info()
+        start = sum(self.sizes[:info.id])
+        return iter(range(start, start + self.sizes[info.id]))
+
+
+def _flatten(loader):
+    return [i for batch in loader for i in batch.tolist()]
+
+
+def test_persistent_workers_map():
+    loader = DataLoader(_Range(23, slow=[0, 7]), batch_size=3, num_workers=2,
+                        persistent_workers=True, prefetch_factor=1, max_prefetch_factor=3)
+    assert _flatten(loader) == list(range(23))
+    workers = loader._iterator._workers
+    assert _flatten(loader) == list(range(23))
+    assert loader._iterator._workers is workers
+
+    # An epoch stopped early doesn't leak its batches into the next one
+    for i, batch in enumerate(loader):
+        if i == 2:
+            break
+    assert _flatten(loader) == list(range(23))
+
+
+def test_persistent_workers_iterable():
+    loader = DataLoader(_IterRange([10, 7]), batch_size=2, num_workers=2, persistent_workers=True)
+    for _ in range(2):
+        assert sorted(_flatten(loader)) == list(range(17))
+
+
+def test_iterable_exhausted_mid_epoch():
+    # The second worker runs out after one batch, the first keeps going
+    for persistent_workers in [False, True]:
+        loader = DataLoader(_IterRange([9, 2, 0]), batch_size=2, num_workers=3,
+                            persistent_workers=persistent_workers)
+        batches = list(loader)
+        assert sorted(i for batch in batches for i in batch.tolist()) == list(range(11))
+        assert [len(b) for b in batches].count(1) == 1
@@ -0,0 +1,151 @@
+import numpy as np
+from PIL import Image
+
+from horch.datasets.mmap import MMapDataset, build_mmap_cache
+
+
+class _Detection:
+
+    def __init__(self):
+        self.imgs = [np.random.randint(256, size=(40 + i, 60, 3), dtype=np.uint8) for i in range(3)]
+
+    def __len__(self):
+        return len(self.imgs)
+
+    def __getitem__(self, i):
+        anns = [{'bbox': [1., 2., 10., 20.], 'category_id': i + 1, 'area': 200., 'iscrowd': 0}] * (i + 1)
+        return Image.fromarray(self.imgs[i]), anns
+
+
+def test_mmap_cache(tmp_path):
+    ds = _Detection()
+    build_mmap_cache(ds, tmp_path / "det.cache")
+    cached = MMapDataset(tmp_path / "det.cache", to_pil=False)
+    assert len(cached) == 3
+    for i in range(3):
+        img, boxes = cached[i]
+        np.testing.assert_array_equal(img, ds.imgs[i])
+        assert boxes.to_anns() == ds[i][1]
+
+    build_mmap_cache(ds, tmp_path / "small.cache", max_size=30)
+    img, boxes = MMapDataset(tmp_path / "small.cache")[0]
+    assert img.size == (30, 20)
+    np.testing.assert_allclose(boxes.boxes[0], [0.5, 1., 5., 10.])
+
+
+def test_records(tmp_path):
+    from horch.datasets import RecordDataset, Subset, Fullset, write_records
+
+    ds = _Detection()
+    write_records(ds, tmp_path, shard_size=1, format='PNG')
+    records = RecordDataset(tmp_path)
+    assert len(records.shards) == 3
+    samples = list(records)
+    for (img, anns), i in zip(samples, range(3)):
+        np.testing.assert_array_equal(np.asarray(img), ds.imgs[i])
+        assert anns == ds[i][1]
+
+    subset = Subset(RecordDataset(tmp_path, shuffle=True, buffer_size=2), [2, 0])
+    assert sorted(len(anns) for _, anns in subset) == [1, 3]
+
+    subset = Subset(Fullset(RecordDataset(tmp_path), lambda img, anns: (img, len(anns))), [2, 0])
+    assert [n for _, n in subset] == [1, 3]
+
+
+class _Files(_Detection):
+
+    def __init__(self, root):
+        super().__init__()
+        self.root = root
+        for i, img in enumerate(self.imgs):
+            Image.fromarray(img).convert('L').save(root / ("%d.jpg" % i))
+        self.transform = None
+
+    def __getitem__(self, i):
+        img, anns = super().__getitem__(i)
+        if self.transform is not None:
+            img, anns = self.transform(img, anns)
+        return img, anns
+
+    def get_image_file(self, i):
+        return self.root / ("%d.jpg" % i)
+
+    def get_target(self, i):
+        return super().__getitem__(i)[1]
+
+
+def test_records_keep_files(tmp_path):
+    from horch.datasets import RecordDataset, Subset, write_records
+
+    # Original files are stored unchanged and converted to RGB when read
+    ds = _Files(tmp_path)
+    write_records(ds, tmp_path / "files")
+    rec = (tmp_path / "files" / "00000.rec").read_bytes()
+    assert (tmp_path / "1.jpg").read_bytes() in rec
+    img, anns = list(RecordDataset(tmp_path / "files"))[1]
+    assert img.mode == 'RGB' and anns == ds[1][1]
+
+    # The transform of a dataset wrapped by Subset is applied
+    ds.transform = lambda img, anns: (img.resize((8, 8)), anns[:1])
+    write_records(Subset(ds, [2]), tmp_path / "subset")
+    img, anns = next(iter(RecordDataset(tmp_path / "subset")))
+    assert img.size == (8, 8) and anns == ds[2][1] and len(anns) == 1
+
+    # Decoded RGB images without a format are encoded as JPEG
+    write_records(_Detection(), tmp_path / "arrays")
+    img, _ = next(iter(RecordDataset(tmp_path / "arrays")))
+    assert img.format == 'JPEG'
+
+
+def test_coco_annotations(tmp_path):
+    from horch.datasets.annotations import CocoAnnotations
+
+    data = {
+        'images': [{'id': 3, 'file_name': 'a.jpg', 'width': 10, 'height': 20},
+                   {'id': 5, 'file_name': 'b.jpg', 'width': 30, 'height': 40}],
+        'annotations': [
+            {'id': 1, 'image_id': 5, 'bbox': [1., 2., 3., 4.], 'category_id': 2, 'area': 12., 'iscrowd': 0},
+            {'id': 2, 'image_id': 3, 'bbox': [0., 0., 5., 5.], 'category_id': 1, 'area': 25., 'iscrowd': 1,
+             'segmentation': [[0, 0, 5, 0, 5, 5]]},
+            {'id': 3, 'image_id': 5, 'bbox': [2., 2., 2., 2.], 'category_id': 1, 'area': 4., 'iscrowd': 0},
+        ],
+        'categories': [{'id': 1, 'name': 'x'}, {'id': 2, 'name': 'y'}],
+    }
+    anns = CocoAnnotations.from_coco(data)
+    assert anns.anns(0) == [data['annotations'][1]]
+    assert anns.anns(1) == [data['annotations'][0], data['annotations'][2]]
+    assert anns.file_name(1) == 'b.jpg'
+
+    sub = anns.subset([1])
+    assert sub.to_coco()['images'] == [data['images'][1]]
+    assert sub.boxlist(0).labels.tolist() == [2, 1]
+
+    anns.save(tmp_path)
+    loaded = CocoAnnotations.load(tmp_path)
+    assert loaded.to_coco() == anns.to_coco()
+
+    merged = CocoAnnotations.concat([anns, sub]).to_coco()
+    assert [img['id'] for img in merged['images']] == [3, 5, 6]
+    assert [ann['id'] for ann in merged['annotations']] == [2, 1, 3, 4, 5]
+    assert [ann['image_id'] for ann in merged['annotations']] == [3, 5, 5, 6, 6]
+
+
+def test_coco_annotations_optional_fields(tmp_path):
+    import json
+    from horch.datasets.annotations import CocoAnnotations
+
+    data = {
+        'images': [{'id': 1, 'file_name': 'a.jpg'},
+                   {'id': 2, 'file_name': 'b.jpg', 'width': 30, 'height': 40}],
+        'annotations': [
+            {'id': 1, 'image_id': 1, 'bbox': [1., 2., 3., 4.], 'category_id': 2},
+            {'id': 2, 'image_id': 2, 'bbox': [0., 0., 5., 5.], 'category_id': 1, 'area': 25., 'iscrowd': 1},
+        ],
+        'categories': [{'id': 1, 'name': 'x'}, {'id': 2, 'name': 'y'}],
+    }
+    ann_file = tmp_path / "instances.json"
+    ann_file.write_text(json.dumps(data))
+    for _ in range(2):
+        anns = CocoAnnotations.from_file(ann_file)
+        assert anns.to_coco() == data
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["instances.json", "instances.json.cache"]
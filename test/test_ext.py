@@ -0,0 +1,57 @@
+import os
+
+import pytest
+import torch
+import torch.nn as nn
+
+from horch.ext.checkpoint import AsyncWriter, ModelCheckpoint
+
+
+def test_async_model_checkpoint(tmp_path):
+    writer = AsyncWriter()
+    handler = ModelCheckpoint(str(tmp_path), 'net', save_interval=1, n_saved=2,
+                              save_as_state_dict=True, writer=writer)
+    model = nn.Linear(3, 3)
+    for i in range(4):
+        handler(None, {"model": model})
+        with torch.no_grad():
+            model.weight.fill_(i)
+    writer.flush()
+    assert sorted(os.listdir(tmp_path)) == ['net_model_3.pth', 'net_model_4.pth']
+    # Saved the snapshot, not the weights modified after the call
+    assert torch.equal(torch.load(tmp_path / 'net_model_4.pth')['weight'], torch.full((3, 3), 2.))
+    writer.close()
+
+
+def test_async_writer_error():
+    writer = AsyncWriter()
+
+    def fail():
+        raise IOError("disk full")
+
+    writer.submit(fail)
+    with pytest.raises(RuntimeError):
+        writer.flush()
+    writer.close()
+
+
+def test_async_save_trainer(tmp_path):
+    from collections import defaultdict
+    from horch.ext.checkpoint import snapshot
+    from horch.train.trainer import Trainer
+
+    model = nn.Linear(3, 3)
+    optimizer = torch.optim.SGD(model.parameters(), lr=0.1, momentum=0.9)
+    trainer = Trainer(model, nn.MSELoss(), optimizer, save_path=str(tmp_path), async_save=True)
+    trainer.metric_history["loss"].append(1.0)
+
+    state = snapshot(trainer.state_dict())
+    assert isinstance(state["metric_history"], defaultdict)
+    assert state["metric_history"]["loss"] == [1.0]
+    assert state["metric_history"] is not trainer.metric_history
+
+    trainer.save()
+    trainer.flush()
+    saved = torch.load(str(next(tmp_path.glob("trainer/*_trainer_*.pth"))))
+    assert saved["metric_history"]["loss"] == [1.0]
+    assert torch.equal(saved["model"]["weight"], model.weight.detach().cpu())
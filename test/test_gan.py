@@ -0,0 +1,64 @@
+import numpy as np
+import torch
+from scipy import linalg
+
+from horch.gan.eval import RunningStatistics, trace_sqrt_product
+
+
+def test_running_statistics():
+    x = np.random.randn(100, 8) * np.arange(1, 9) + 3
+    stats = RunningStatistics()
+    for start, end in [(0, 7), (7, 40), (40, 41), (41, 100)]:
+        stats.update(torch.from_numpy(x[start:end]))
+    np.testing.assert_allclose(stats.mean, x.mean(axis=0))
+    np.testing.assert_allclose(stats.cov, np.cov(x, rowvar=False))
+
+
+def test_trace_sqrt_product():
+    a, b = np.random.randn(50, 16), np.random.randn(50, 16)
+    sigma1, sigma2 = np.cov(a, rowvar=False), np.cov(b, rowvar=False)
+    expected = np.trace(linalg.sqrtm(sigma1 @ sigma2).real)
+    np.testing.assert_allclose(trace_sqrt_product(sigma1, sigma2), expected, rtol=1e-6)
+
+
+def test_knn_index(tmp_path):
+    from horch.gan.knn import KNNIndex, IVFIndex
+    from horch.gan.utils import knn
+
+    rng = np.random.RandomState(0)
+    xs = rng.randint(0, 256, size=(300, 4, 4, 3), dtype=np.uint8)
+    queries = xs[[5, 17, 200]]
+    flat = xs.reshape(300, -1).astype(np.float64)
+    expected = np.sqrt(((flat[None] - flat[[5, 17, 200]][:, None]) ** 2).sum(-1))
+
+    index = KNNIndex(xs, device='cpu')
+    indices, dists = index.search(queries, k=3, batch_size=2, max_elements=48 * 7)
+    assert indices[:, 0].tolist() == [5, 17, 200]
+    np.testing.assert_allclose(dists, np.sort(expected, axis=1)[:, :3], rtol=1e-5)
+
+    index.save(tmp_path / "index")
+    loaded = KNNIndex.load(tmp_path / "index", device='cpu')
+    assert (loaded.search(queries, k=3)[0] == indices).all()
+
+    ivf = IVFIndex(xs, num_lists=4, nprobe=4, device='cpu')
+    # The database isn't copied
+    assert np.shares_memory(ivf.data, xs)
+    assert (ivf.search(queries, k=3)[0] == indices).all()
+    ivf.save(tmp_path / "ivf")
+    loaded = KNNIndex.load(tmp_path / "ivf", device='cpu')
+    i, d = loaded.search(queries, k=3, max_elements=48 * 7)
+    assert (i == indices).all()
+    np.testing.assert_allclose(d, dists, rtol=1e-5)
+
+    i, d = knn(xs[17], xs, k=1)
+    assert i.tolist() == [17] and d.tolist() == [0]
+
+
+def test_batch_apply_uint8():
+    import torch.nn as nn
+    from horch.gan.eval import batch_apply
+
+    imgs = np.random.randint(0, 256, size=(5, 4, 6, 3), dtype=np.uint8)
+    out = batch_apply(imgs, nn.Identity(), batch_size=2, device='cpu')
+    assert out.shape == (5, 3, 4, 6) and out.dtype == torch.float32
+    np.testing.assert_allclose(out.numpy(), imgs.transpose(0, 3, 1, 2) / 255, rtol=1e-6)
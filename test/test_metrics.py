@@ -79,4 +79,103 @@
 #     #     np.mean([
 #     #         mean_average_precision(image_dts[i], image_gts[i], iou_threshold=0.3, use_07_metric=True)
 #     #         for i in image_gts.keys()
-#     #     ]), 0.2456867)
\ No newline at end of file
+#     #     ]), 0.2456867)
+
+def test_segmentation_metrics():
+    import math
+    import torch
+    from horch.train.metrics.segmentation import ConfusionMatrix, MeanIoU, ClassIoU, PixelAccuracy, MeanDice
+
+    y_true = torch.tensor([[[0, 1], [1, 255]]])
+    y_pred = torch.tensor([[[0, 1], [0, 1]]])
+    logits = torch.nn.functional.one_hot(y_pred, 3).permute(0, 3, 1, 2).float()
+    output = {"y_true": y_true, "y_pred": logits}
+
+    cm = ConfusionMatrix(3, ignore_index=255)
+    cm.update(cm.output_transform(output))
+    assert cm.compute().tolist() == [[1, 0, 0], [1, 1, 0], [0, 0, 0]]
+
+    for metric, expected in [(MeanIoU(3, 255), 0.5), (MeanDice(3, 255), (2 / 3 + 2 / 3) / 2),
+                             (PixelAccuracy(255), 2 / 3)]:
+        metric.update(metric.output_transform(output))
+        metric.update(metric.output_transform(output))
+        assert math.isclose(metric.compute(), expected)
+
+    ious = ClassIoU(3, 255)
+    ious.update(ious.output_transform(output))
+    assert ious.compute()[:2] == [0.5, 0.5] and math.isnan(ious.compute()[2])
+
+
+def test_coco_average_precision():
+    import math
+    import torch
+    from horch.train.metrics.detection import CocoAveragePrecision
+
+    coco = {
+        "images": [{"id": 1, "file_name": "1.jpg"}, {"id": 2, "file_name": "2.jpg"}],
+        "annotations": [
+            {"id": 1, "image_id": 1, "bbox": [0, 0, 10, 10], "category_id": 1, "iscrowd": 0},
+            {"id": 2, "image_id": 2, "bbox": [0, 0, 10, 10], "category_id": 1, "iscrowd": 0},
+            {"id": 3, "image_id": 2, "bbox": [20, 20, 20, 20], "category_id": 1, "iscrowd": 1},
+        ],
+        "categories": [{"id": 1, "name": "a"}],
+    }
+    boxes = torch.tensor([[[0, 0, 10, 10], [50, 50, 60, 60]],
+                          [[0, 0, 10, 10], [22, 22, 30, 30]]], dtype=torch.float)
+    scores = torch.tensor([[0.9, 0.8], [0.7, 0.6]])
+    labels = torch.ones(2, 2, dtype=torch.long)
+    num_dets = torch.tensor([2, 2])
+
+    metric = CocoAveragePrecision(coco)
+    metric.reset()
+    # Two batches of one image
+    metric.update((boxes[:1], scores[:1], labels[:1], num_dets[:1]))
+    metric.update((boxes[1:], scores[1:], labels[1:], num_dets[1:]))
+    # The detection inside the crowd is ignored
+    assert math.isclose(metric.compute(), (51 + 50 * 2 / 3) / 101)
+    assert math.isclose(metric.stats["AP50"], metric.stats["AP"])
+    assert math.isclose(metric.stats["AR"], 1)
+
+
+def test_coco_average_precision_without_ground_truth():
+    import math
+    import torch
+    from horch.train.metrics.detection import CocoAveragePrecision
+
+    coco = {
+        "images": [{"id": 1, "file_name": "1.jpg"}, {"id": 2, "file_name": "2.jpg"}],
+        "annotations": [
+            {"id": 1, "image_id": 1, "bbox": [0, 0, 10, 10], "category_id": 1, "iscrowd": 0},
+        ],
+        "categories": [{"id": 1, "name": "a"}, {"id": 2, "name": "b"}],
+    }
+    # A detection of a class absent from the first image, and one in an image without annotations
+    boxes = torch.tensor([[[0, 0, 10, 10], [0, 0, 10, 10]],
+                          [[0, 0, 10, 10], [0, 0, 0, 0]]], dtype=torch.float)
+    scores = torch.tensor([[0.9, 0.8], [0.95, 0]])
+    labels = torch.tensor([[1, 2], [1, -1]])
+    num_dets = torch.tensor([2, 1])
+
+    metric = CocoAveragePrecision(coco)
+    metric.reset()
+    metric.update((boxes, scores, labels, num_dets))
+    assert math.isclose(metric.compute(), 0.5)
+    assert math.isclose(metric.stats["AR"], 1)
+
+
+def test_average_on_device():
+    import math
+    import torch
+    from horch.train.metrics import TrainLoss
+    from horch.train.metrics.classification import TopKAccuracy
+
+    loss = TrainLoss()
+    for val, n in [(1.0, 2), (4.0, 1)]:
+        loss.update(loss.output_transform({"loss": torch.tensor(val), "batch_size": n}))
+    assert torch.is_tensor(loss.sum("sum"))
+    assert math.isclose(loss.compute(), 2.0)
+
+    acc = TopKAccuracy(k=1)
+    y_pred = torch.tensor([[0.9, 0.1], [0.2, 0.8], [0.6, 0.4]])
+    acc.update(acc.output_transform({"y_true": torch.tensor([0, 1, 1]), "y_pred": y_pred}))
+    assert math.isclose(acc.compute(), 2 / 3)
@@ -0,0 +1,43 @@
+import numpy as np
+import torch
+
+import horch.mq
+
+
+def test_multipart_roundtrip():
+    context, consumer, addr = horch.mq.new_consumer('inproc')
+    producer = horch.mq.new_producer(addr, context)
+    x = torch.randn(2, 3, 8, 8)
+    y = np.arange(12, dtype=np.int64).reshape(3, 4)
+    horch.mq.put_multipart(producer, (7, {"x": x, "y": y, "name": "a"}))
+    idx, data = horch.mq.get_multipart(consumer)
+    assert idx == 7
+    assert data["name"] == "a"
+    assert torch.equal(data["x"], x)
+    np.testing.assert_array_equal(data["y"], y)
+    producer.close()
+    horch.mq.close_consumer(consumer, addr)
+
+
+def test_dumps_multipart_frames():
+    frames = horch.mq.dumps_multipart([torch.zeros(4), torch.ones(2, 2), 1.0])
+    assert len(frames) == 3
+
+
+def test_multipart_arrays_writable():
+    context, consumer, addr = horch.mq.new_consumer('inproc')
+    producer = horch.mq.new_producer(addr, context)
+    horch.mq.put_multipart(producer, np.arange(4))
+    y = horch.mq.get_multipart(consumer)
+    y[0] = 5
+    assert y.tolist() == [5, 1, 2, 3]
+    producer.close()
+    horch.mq.close_consumer(consumer, addr)
+
+
+def test_dataloader_transport():
+    import pytest
+    from horch.dataloader.dataloader import DataLoader
+
+    with pytest.raises(ValueError):
+        DataLoader(list(range(4)), num_workers=2, transport='inproc')
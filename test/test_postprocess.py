@@ -0,0 +1,42 @@
+import torch
+
+from horch.models.detection.postprocess import nms, batched_nms, soft_nms, matrix_nms, postprocess
+
+
+def test_nms():
+    boxes = torch.tensor([[0., 0., 10., 10.], [1., 1., 11., 11.], [20., 20., 30., 30.]])
+    scores = torch.tensor([0.9, 0.8, 0.7])
+    assert nms(boxes, scores, 0.5).tolist() == [0, 2]
+    assert batched_nms(boxes, scores, torch.tensor([0, 1, 0]), 0.5).tolist() == [0, 1, 2]
+
+    keep, new_scores = soft_nms(boxes, scores, torch.zeros(3, dtype=torch.long))
+    assert keep.tolist() == [0, 2, 1]
+    assert new_scores[0] == 0.9 and new_scores[1] == 0.7 and new_scores[2] < 0.8
+
+    decayed = matrix_nms(boxes, scores, torch.zeros(3, dtype=torch.long))
+    assert decayed[0] == 0.9 and decayed[2] == 0.7 and decayed[1] < 0.8
+
+
+def test_postprocess():
+    anchors = torch.tensor([[0., 0., 10., 10.], [1., 1., 11., 11.], [20., 20., 30., 30.]])
+    loc_preds = torch.zeros(2, 3, 4)
+    cls_preds = torch.full((2, 3, 2), -10.)
+    cls_preds[0, 0, 0] = 3
+    cls_preds[0, 1, 0] = 2
+    cls_preds[0, 2, 1] = 1
+    boxes, scores, labels, num_dets = postprocess(loc_preds, cls_preds, anchors, 2, max_dets=5)
+    assert boxes.shape == (2, 5, 4)
+    assert num_dets.tolist() == [2, 0]
+    assert labels[0].tolist() == [1, 2, -1, -1, -1]
+    assert torch.allclose(boxes[0, 1], anchors[2])
+    assert (scores[1] == 0).all()
+
+    for method in ['soft', 'matrix']:
+        _, _, labels, num_dets = postprocess(loc_preds, cls_preds, anchors, 2, max_dets=5, method=method)
+        assert num_dets.tolist() == [3, 0]
+        assert labels[0, 0] == 1
+
+        _, _, labels, num_dets = postprocess(loc_preds, cls_preds, anchors, 2, max_dets=5, method=method,
+                                             pre_nms_topk=2)
+        assert num_dets.tolist() == [2, 0]
+        assert labels[0, :2].tolist() == [1, 1]
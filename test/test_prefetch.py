@@ -0,0 +1,63 @@
+import pytest
+import torch
+from torch.utils.data import TensorDataset
+
+from horch.train.prefetch import DataPrefetcher
+
+
+def _loader():
+    from torch.utils.data import DataLoader
+    return DataLoader(TensorDataset(torch.arange(20)), batch_size=3)
+
+
+def test_prefetcher_exhaustion():
+    prefetcher = DataPrefetcher(_loader(), 'cpu')
+    for _ in range(2):
+        xs = [x for (x,) in prefetcher]
+        assert torch.cat(xs).tolist() == list(range(20))
+    prefetcher.close()
+
+
+def test_prefetcher_early_break():
+    prefetcher = DataPrefetcher(_loader(), 'cpu', num_buffers=1)
+    for i, (x,) in enumerate(prefetcher):
+        if i == 1:
+            break
+    thread = prefetcher._it.thread
+    prefetcher.close()
+    assert not thread.is_alive()
+    assert torch.cat([x for (x,) in prefetcher]).tolist() == list(range(20))
+
+
+@pytest.mark.skipif(not torch.cuda.is_available(), reason="CUDA is not available")
+def test_pin_memory_loop():
+    from horch.dataloader.dataloader import DataLoader
+    loader = DataLoader(TensorDataset(torch.arange(20)), batch_size=3, num_workers=2, pin_memory=True)
+    xs = [x for (x,) in loader]
+    assert all(x.is_pinned() for x in xs)
+    assert torch.cat(xs).tolist() == list(range(20))
+
+    prefetcher = DataPrefetcher(loader, 'cuda')
+    xs = [x for (x,) in prefetcher]
+    assert all(x.is_cuda for x in xs)
+    assert torch.cat(xs).tolist() == list(range(20))
+    prefetcher.close()
+
+
+def test_trainer_non_blocking():
+    import torch.nn as nn
+    from ignite.engine import _prepare_batch
+    from horch.train.trainer import create_supervised_trainer
+
+    calls = []
+
+    def prepare_batch(batch, device=None, non_blocking=False):
+        calls.append(non_blocking)
+        return _prepare_batch(batch, device, non_blocking)
+
+    model = nn.Linear(2, 1)
+    optimizer = torch.optim.SGD(model.parameters(), lr=0.1)
+    engine = create_supervised_trainer(model, nn.MSELoss(), optimizer, device='cpu',
+                                       prepare_batch=prepare_batch, non_blocking=True)
+    engine.run([(torch.randn(4, 2), torch.randn(4, 1))], 1)
+    assert calls == [True]
@@ -0,0 +1,24 @@
+from horch.train.sampler import DistributedIterSampler
+
+
+def test_distributed_iter_sampler_shards():
+    data = list(range(20))
+    samplers = [DistributedIterSampler(data, 2, num_iterations=5, num_replicas=2, rank=i) for i in range(2)]
+    shards = [[i for batch in s for i in batch] for s in samplers]
+    assert len(shards[0]) == len(shards[1]) == 10
+    assert sorted(shards[0] + shards[1]) == data
+
+
+def test_distributed_iter_sampler_resume():
+    data = list(range(20))
+    full = list(DistributedIterSampler(data, 3, num_iterations=10, num_replicas=2, rank=1))
+    resumed = list(DistributedIterSampler(data, 3, num_iterations=10, start_iter=6, num_replicas=2, rank=1))
+    assert resumed == full[6:]
+    assert len(full) == 10
+
+
+def test_distributed_iter_sampler_empty_shard():
+    import pytest
+
+    with pytest.raises(ValueError):
+        DistributedIterSampler(list(range(5)), 4, drop_last=True, num_replicas=2, rank=0)
@@ -0,0 +1,155 @@
+import copy
+from contextlib import contextmanager
+
+import pytest
+import torch
+import torch.nn as nn
+
+from horch.train.trainer import create_supervised_trainer
+
+
+class _SGD(torch.optim.SGD):
+    # Records the norm of the gradients when a step is taken
+
+    def __init__(self, params, lr):
+        super().__init__(params, lr)
+        self.grad_norms = []
+
+    def step(self, closure=None):
+        grads = [p.grad for group in self.param_groups for p in group['params']]
+        self.grad_norms.append(torch.norm(torch.stack([g.norm() for g in grads])).item())
+        return super().step(closure)
+
+
+class _NoSync(nn.Linear):
+    # Counts micro-steps without gradient reduction, like DistributedDataParallel
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.no_sync_calls = 0
+
+    @contextmanager
+    def no_sync(self):
+        self.no_sync_calls += 1
+        yield
+
+
+def _batches(n, batch_size=4):
+    torch.manual_seed(0)
+    return [(torch.randn(batch_size, 3), torch.randn(batch_size, 2)) for _ in range(n)]
+
+
+def test_accumulation_matches_full_batch():
+    model = _NoSync(3, 2)
+    full = copy.deepcopy(model)
+    (x, y), = _batches(1)
+
+    optimizer = _SGD(model.parameters(), lr=0.1)
+    engine = create_supervised_trainer(model, nn.MSELoss(), optimizer, device='cpu', accumulation_steps=2)
+    engine.run([(x[:2], y[:2]), (x[2:], y[2:])], 1)
+    assert len(optimizer.grad_norms) == 1
+    assert model.no_sync_calls == 1
+
+    full_optimizer = _SGD(full.parameters(), lr=0.1)
+    engine = create_supervised_trainer(full, nn.MSELoss(), full_optimizer, device='cpu')
+    engine.run([(x, y)], 1)
+
+    for p, q in zip(model.parameters(), full.parameters()):
+        assert torch.allclose(p, q, atol=1e-6)
+    assert abs(optimizer.grad_norms[0] - full_optimizer.grad_norms[0]) < 1e-5
+
+
+def test_grad_clip_norm():
+    model = nn.Linear(3, 2)
+    optimizer = _SGD(model.parameters(), lr=0.1)
+    engine = create_supervised_trainer(model, nn.MSELoss(), optimizer, device='cpu',
+                                       accumulation_steps=2, grad_clip_norm=0.01)
+    engine.run([(x * 100, y) for x, y in _batches(4)], 1)
+    assert len(optimizer.grad_norms) == 2
+    assert all(norm <= 0.01 + 1e-6 for norm in optimizer.grad_norms)
+
+
+def test_distributed_fit(tmp_path):
+    import torch.distributed as dist
+    from torch.utils.data import DataLoader, TensorDataset
+    from torch.utils.data.distributed import DistributedSampler
+    from torch.nn.parallel import DistributedDataParallel
+    from horch.train.metrics import TrainLoss
+    from horch.train.trainer import Trainer
+
+    dist.init_process_group('gloo', init_method='file://' + str(tmp_path / "store"), rank=0, world_size=1)
+    try:
+        ds = TensorDataset(torch.randn(16, 3), torch.randn(16, 2))
+        train_loader = DataLoader(ds, batch_size=4, sampler=DistributedSampler(ds))
+        val_loader = DataLoader(ds, batch_size=4)
+        model = nn.Linear(3, 2)
+        weight = model.weight.detach().clone()
+        trainer = Trainer(model, nn.MSELoss(), torch.optim.SGD(model.parameters(), lr=0.1),
+                          metrics={'loss': TrainLoss()}, save_path=str(tmp_path), distributed=True)
+        assert isinstance(trainer.ddp_model, DistributedDataParallel)
+        hist = trainer.fit(train_loader, 1, val_loader=val_loader)
+        assert len(hist['loss']) == len(hist['val_loss']) == 1
+        assert isinstance(hist['val_loss'][0], float)
+        assert not torch.equal(model.weight, weight)
+        assert (tmp_path / 'runs').exists()
+    finally:
+        dist.destroy_process_group()
+
+
+def test_amp_cpu_bf16():
+    model = nn.Linear(3, 2)
+    weight = model.weight.detach().clone()
+    optimizer = torch.optim.SGD(model.parameters(), lr=0.1)
+    engine = create_supervised_trainer(model, nn.MSELoss(), optimizer, device='cpu', amp=True)
+    engine.run(_batches(1), 1)
+    # bfloat16 autocast on CPU, without loss scaling
+    assert engine.state.output['y_pred'].dtype == torch.bfloat16
+    assert model.weight.dtype == torch.float32
+    assert not torch.equal(model.weight, weight)
+
+
+def test_amp_cpu_gan():
+    from horch.train.gan import create_gan_trainer
+
+    G = nn.Linear(4, 3)
+    G.in_channels = 4
+    D = nn.Linear(3, 1)
+    weights = [G.weight.detach().clone(), D.weight.detach().clone()]
+    engine = create_gan_trainer(
+        G, D, lambda fake_p: -fake_p.float().mean(), lambda real_p, fake_p: (fake_p - real_p).float().mean(),
+        torch.optim.SGD(G.parameters(), lr=0.1), torch.optim.SGD(D.parameters(), lr=0.1),
+        device='cpu', amp=True)
+    engine.run(_batches(1), 1)
+    assert torch.isfinite(engine.state.output['lossG'])
+    assert not torch.equal(G.weight, weights[0]) and not torch.equal(D.weight, weights[1])
+
+
+def _amp_trainer(tmp_path):
+    from horch.train.trainer import Trainer
+
+    model = nn.Linear(3, 2)
+    return Trainer(model, nn.MSELoss(), torch.optim.SGD(model.parameters(), lr=0.1),
+                   save_path=str(tmp_path), amp=True)
+
+
+def test_amp_save_load(tmp_path):
+    trainer = _amp_trainer(tmp_path)
+    if trainer.device == 'cpu':
+        # Loss scaling is only needed for float16 on CUDA
+        assert not trainer.scaler.is_enabled()
+    trainer.save()
+    saved = torch.load(str(next(tmp_path.glob("trainer/*.pth"))))
+    assert saved["scaler"] == trainer.scaler.state_dict()
+    loaded = _amp_trainer(tmp_path)
+    loaded.load()
+    assert loaded.scaler.state_dict() == trainer.scaler.state_dict()
+
+
+@pytest.mark.skipif(not torch.cuda.is_available(), reason="GradScaler is only enabled on CUDA")
+def test_grad_scaler_save_load(tmp_path):
+    trainer = _amp_trainer(tmp_path)
+    trainer.scaler.update(1024.)
+    trainer.save()
+    loaded = _amp_trainer(tmp_path)
+    loaded.load()
+    assert loaded.scaler.get_scale() == 1024.
@@ -0,0 +1,108 @@
+import numpy as np
+from PIL import Image
+
+from horch.transforms.detection import functional as HF
+from horch.transforms.detection.affine import AffineImage
+from horch.transforms.detection.boxlist import BoxList
+
+
+def _anns():
+    return [
+        {'bbox': [10.5, 20., 30., 40.], 'category_id': 3, 'area': 1200., 'iscrowd': 0, 'id': 5},
+        {'bbox': [0., 0., 5., 5.], 'category_id': 1, 'area': 25., 'iscrowd': 1, 'id': 6},
+    ]
+
+
+def test_boxlist_roundtrip():
+    anns = _anns()
+    assert BoxList.from_anns(anns, np.float64).to_anns() == anns
+    boxes = BoxList.from_anns(anns)
+    assert boxes.boxes.dtype == np.float32
+    assert boxes[1] == anns[1]
+
+
+def test_boxlist_mixed_fields():
+    anns = _anns()
+    del anns[1]['area'], anns[1]['iscrowd']
+    boxes = BoxList.from_anns(anns, np.float64)
+    assert boxes.fields == ('category_id',)
+    assert boxes.areas.tolist() == [1200., 25.]
+    assert boxes.iscrowd.tolist() == [0, 0]
+
+
+def test_functional_boxlist_matches_dicts():
+    anns = _anns()
+    boxes = BoxList.from_anns(anns)
+    for f in [HF.hflip(size=(100, 80)), HF.move(x=3, y=-2), HF.resize(size=(100, 80), output_size=(50, 50)),
+              HF.crop(left=8, upper=2, width=30, height=30)]:
+        expected = f(anns)
+        result = f(boxes)
+        assert isinstance(result, BoxList)
+        np.testing.assert_allclose(result.boxes, [ann['bbox'] for ann in expected], rtol=1e-6)
+        assert result.labels.tolist() == [ann['category_id'] for ann in expected]
+
+
+def test_affine_image_matches_pil():
+    img = Image.fromarray(np.arange(16 * 12 * 3, dtype=np.uint8).reshape(12, 16, 3))
+    fused = AffineImage(img).crop((2, 3, 10, 9)).hflip().resize((16, 12)).warp(Image.NEAREST)
+    expected = img.crop((2, 3, 10, 9)).transpose(Image.FLIP_LEFT_RIGHT).resize((16, 12), Image.NEAREST)
+    np.testing.assert_array_equal(np.asarray(fused), np.asarray(expected))
+
+
+def test_batch_transforms():
+    import torch
+    from horch.transforms.ext import CIFAR10Policy
+    from horch.transforms.batch import AutoAugment, RandomRotation, Cutout
+
+    x = torch.rand(8, 3, 32, 32)
+    mask = torch.randint(5, (8, 32, 32))
+    y, m = RandomRotation(0)(x, mask)
+    torch.testing.assert_allclose(y, x)
+    assert torch.equal(m, mask)
+
+    y, m = AutoAugment(CIFAR10Policy())(x, mask)
+    assert y.shape == x.shape and m.shape == mask.shape
+    assert 0 <= y.min() and y.max() <= 1
+
+    y, _ = Cutout(1, 8)(x, None)
+    assert (y == 0).any()
+
+
+def test_elastic_transform():
+    import torch
+    from horch.transforms.batch import ElasticTransform
+    from horch.transforms.segmentation import elastic_transform
+
+    x = torch.rand(2, 3, 64, 48)
+    mask = torch.randint(4, (2, 64, 48))
+    y, m = ElasticTransform(alpha=0, sigma=8)(x, mask)
+    torch.testing.assert_allclose(y, x)
+    assert torch.equal(m, mask)
+
+    img = Image.fromarray(np.random.randint(256, size=(64, 48, 3), dtype=np.uint8))
+    label = Image.fromarray(np.random.choice([0, 3, 7], size=(64, 48)).astype(np.uint8))
+    img, label = elastic_transform(img, label, alpha=30, sigma=8)
+    assert img.size == (48, 64) and img.mode == 'RGB'
+    assert set(np.unique(np.asarray(label))) <= {0, 3, 7}
+
+
+def test_ssd_transform_fused_matches_unfused():
+    import random
+    from horch.transforms.detection import SSDTransform
+
+    yy, xx = np.mgrid[0:60, 0:80]
+    img = Image.fromarray(np.stack([xx * 3, yy * 4, (xx + yy) * 2], -1).astype(np.uint8))
+    anns = [{'bbox': [10., 5., 30., 40.], 'category_id': 1, 'area': 1200., 'iscrowd': 0},
+            {'bbox': [50., 20., 20., 30.], 'category_id': 2, 'area': 600., 'iscrowd': 0}]
+    for seed in range(20):
+        outputs = []
+        for fused in [False, True]:
+            random.seed(seed)
+            outputs.append(SSDTransform(32, color_jitter=False, fused=fused)(img, anns))
+        (img1, anns1), (img2, anns2) = outputs
+        assert img1.size == img2.size
+        np.testing.assert_allclose(anns1.boxes, anns2.boxes, rtol=1e-5, atol=1e-4)
+        assert anns1.labels.tolist() == anns2.labels.tolist()
+        # Resampled once instead of after every step
+        diff = np.abs(np.asarray(img1, dtype=np.float64) - np.asarray(img2, dtype=np.float64))
+        assert diff.mean() < 4